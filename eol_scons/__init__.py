@@ -47,6 +47,11 @@ from eol_scons.variables import GlobalOptions   # replaced by GlobalVariables
 from eol_scons.variables import GlobalVariables
 from eol_scons.variables import PathToAbsolute
 from eol_scons.tool import DefineQtTools
+from eol_scons.tool import AlwaysApply
+
+# Start recording the SConscript files read if the build server asks for
+# them.  See eol_scons/sconscripts.py.
+import eol_scons.sconscripts
 
 # This would be needed if the eol_scons package were going to be loaded as
 # a tool by installing it under a site_tools directory somewhere.  However,
@@ -66,6 +71,12 @@ def InstallToolsPath():
     "Add the eol_scons/tools dir to the tool path."
     Debug("Using site_tools: %s" % (tools_dir))
     SCons.Tool.DefaultToolpath.insert(0, tools_dir)
+    # Newer SCons renames some tools, like ninja to its own ninja_tool,
+    # before searching the tool path, which would hide the eol_scons tool.
+    aliases = getattr(SCons.Tool, 'TOOL_ALIASES', {})
+    for name in list(aliases):
+        if os.path.exists(os.path.join(tools_dir, name + ".py")):
+            del aliases[name]
      
 def InstallDefaultHook():
     "Add the hooks dir to the tool path to override the default tool."
@@ -0,0 +1,235 @@
+# -*- python -*-
+# Copyright 2007 UCAR, NCAR, All Rights Reserved
+
+"""
+Record the actions scons executes while building targets.
+
+Once StartTrace() is called, every action executed is recorded with its
+targets, start and end times, and exit status, along with each command the
+action spawns and that command's CPU time and peak resident memory.  The
+dump_trace tool writes the records as a Chrome trace, and the buildtimes
+tool keeps a database of target build times from them.
+
+Actions are recorded by wrapping _ActionAction.__call__, which every
+action which actually runs goes through, and commands are recorded by
+running each action in an override of the build environment with a
+wrapped SPAWN function, similar to the test log spawner in the testing
+tool.  Resource usage for each command comes from os.wait4(), so it is
+only available for commands spawned through the default posix SPAWN
+function.
+"""
+
+import os
+import time
+import threading
+import subprocess
+
+import SCons.Action
+import SCons.Errors
+import SCons.Platform.posix
+import SCons.Util
+
+_enabled = False
+
+# The time to which action times are relative.  This is when the module was
+# first imported, normally by a tool while the SConscript files are read.
+_start_time = time.time()
+
+# Finished action records, in the order they finished.
+_actions = []
+
+# Map the ident of each thread which runs actions to its row in the trace.
+_rows = {}
+
+# The default SPAWN function on posix platforms, which _wait_spawn() mimics.
+# Older SCons versions do not spawn commands through subprocess.
+_posix_spawn = getattr(SCons.Platform.posix, 'subprocess_spawn', None)
+
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _now():
+    return int((time.time() - _start_time) * 1e6)
+
+
+def _row():
+    ident = threading.current_thread().ident
+    with _lock:
+        if ident not in _rows:
+            _rows[ident] = len(_rows) + 1
+        return _rows[ident]
+
+
+def _wait_spawn(sh, escape, cmd, args, env):
+    """
+    Run a command like the SCons posix spawn function, but wait for it with
+    os.wait4() to get the resource usage of that one command.
+    """
+    proc = subprocess.Popen([sh, '-c', ' '.join(args)], env=env,
+                            close_fds=True)
+    pid, status, usage = os.wait4(proc.pid, 0)
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return proc.returncode, usage
+
+
+class _TracedSpawn(object):
+    "Wrap a SPAWN function to record each command in the current action."
+
+    def __init__(self, spawn):
+        self.spawn = spawn
+
+    def __call__(self, sh, escape, cmd, args, env):
+        start = _now()
+        usage = None
+        if self.spawn is _posix_spawn and hasattr(os, 'wait4'):
+            status, usage = _wait_spawn(sh, escape, cmd, args, env)
+        else:
+            status = self.spawn(sh, escape, cmd, args, env)
+        command = {'command': ' '.join(args), 'start': start,
+                   'end': _now(), 'status': status}
+        if usage:
+            # ru_maxrss is in kilobytes on linux.
+            command['maxrss_kb'] = usage.ru_maxrss
+            command['utime'] = usage.ru_utime
+            command['stime'] = usage.ru_stime
+        record = getattr(_local, 'record', None)
+        if record is not None:
+            record['commands'].append(command)
+        return status
+
+
+def _trace_call(call):
+    "Wrap _ActionAction.__call__ to record each action executed."
+
+    def __call__(self, target, source, env, exitstatfunc=SCons.Action._null,
+                 presub=SCons.Action._null, show=SCons.Action._null,
+                 execute=SCons.Action._null, chdir=SCons.Action._null,
+                 executor=None):
+        run = execute
+        if run is SCons.Action._null:
+            run = SCons.Action.execute_actions
+        if not run:
+            return call(self, target, source, env, exitstatfunc, presub,
+                        show, execute, chdir, executor)
+        # Run the action in an override of the build environment with a
+        # traced SPAWN, so the commands this action runs are recorded in it
+        # without changing the Environment other actions share.  Some
+        # actions, like removing a target before it is rebuilt, are run
+        # without an Environment.
+        spawn = env.get('SPAWN') if env is not None else None
+        if spawn is not None and not isinstance(spawn, _TracedSpawn):
+            env = env.Override({'SPAWN': _TracedSpawn(spawn)})
+        targets = target
+        if executor:
+            targets = executor.get_all_targets()
+        elif not SCons.Util.is_List(targets):
+            targets = [targets]
+        record = {'nodes': list(targets),
+                  'targets': [str(t) for t in targets], 'row': _row(),
+                  'start': _now(), 'commands': [], 'status': None}
+        _local.record = record
+        try:
+            stat = call(self, target, source, env, exitstatfunc, presub,
+                        show, execute, chdir, executor)
+            # A failed command returns a BuildError instead of raising it.
+            record['status'] = stat
+            if isinstance(stat, SCons.Errors.BuildError):
+                record['status'] = stat.status
+            return stat
+        except SCons.Errors.BuildError as ex:
+            record['status'] = ex.status
+            raise
+        except Exception:
+            record['status'] = -1
+            raise
+        finally:
+            _local.record = None
+            record['end'] = _now()
+            with _lock:
+                _actions.append(record)
+
+    __call__._eol_scons_trace = True
+    return __call__
+
+
+def StartTrace():
+    "Start recording actions.  The recording cannot be stopped."
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    cls = SCons.Action._ActionAction
+    if not getattr(cls.__call__, '_eol_scons_trace', False):
+        cls.__call__ = _trace_call(cls.__call__)
+
+
+def TraceEnabled():
+    return _enabled
+
+
+def GetActions():
+    """
+    Return the records of the actions finished so far.  Each record is a
+    dictionary with these keys:
+
+      nodes     the target nodes of the action
+      targets   the target names
+      row       the number of the scons job thread which ran the action
+      start     start time in microseconds since GetStartTime()
+      end       end time in microseconds
+      status    exit status, or -1 if the action raised an exception
+      commands  list of the commands spawned, each a dictionary with the
+                keys command, start, end, status, and maxrss_kb, utime,
+                and stime if the resource usage is known.
+    """
+    with _lock:
+        return _actions[:]
+
+
+def GetStartTime():
+    "Return the time from which action times are measured."
+    return _start_time
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test actiontrace.py
+
+def test_wait_spawn():
+    status, usage = _wait_spawn('sh', None, 'exit', ['exit', '3'],
+                                dict(os.environ))
+    assert status == 3
+    assert usage.ru_maxrss > 0
+    spawn = _TracedSpawn(lambda sh, escape, cmd, args, env: 0)
+    record = {'commands': []}
+    _local.record = record
+    try:
+        status = spawn('sh', None, 'true', ['true'], dict(os.environ))
+    finally:
+        _local.record = None
+    assert status == 0
+    assert record['commands'][0]['command'] == 'true'
+    assert record['commands'][0]['end'] >= record['commands'][0]['start']
+
+
+def test_trace_call():
+    import json
+
+    def fail(self, target, source, env, *args):
+        return SCons.Errors.BuildError(errstr="Error 2", status=2)
+
+    traced = _trace_call(fail)
+    try:
+        # Actions like Unlink are called without an Environment.
+        stat = traced(None, 'a.o', [], None, execute=1)
+        assert isinstance(stat, SCons.Errors.BuildError)
+        record = GetActions()[-1]
+        assert record['status'] == 2
+        assert record['targets'] == ['a.o']
+        json.dumps(record['status'])
+    finally:
+        del _actions[:]
@@ -0,0 +1,255 @@
+# -*- python -*-
+# Copyright 2007 UCAR, NCAR, All Rights Reserved
+
+"""
+Keep a database of how long each target takes to build, and report the
+slowest targets and the critical path of each build.
+
+The actions executed are recorded by eol_scons.actiontrace.  At exit, the
+duration of each action is stored in buildtimes.json in the top directory,
+keyed by the first target of the action, so the database holds the most
+recent build time of every target built with it enabled, plus a short
+history of totals for each build.  The report printed at exit lists:
+
+  - the total action time and elapsed time, compared to the previous build
+  - the critical path: the chain of dependent actions with the longest
+    total time, which limits how fast the build can go no matter how many
+    jobs run in parallel
+  - the slowest actions, with the time each took in the previous build
+    which ran it
+
+See the buildtimes tool to enable the database from the command line.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+
+import eol_scons.actiontrace as at
+
+_db_file = "buildtimes.json"
+
+# Number of actions listed in the slowest actions report.
+_slowest_rows = 50
+
+# Number of build totals kept in the database history.
+_history = 20
+
+
+def _empty_database():
+    return {'targets': {}, 'builds': []}
+
+
+def LoadBuildTimes(path):
+    """
+    Return the build times database at path, or an empty database if it
+    does not exist or cannot be read.  The 'targets' dictionary maps each
+    target name to the seconds its action took the last time it was built,
+    and 'builds' is a list of the totals for recent builds, oldest first.
+    """
+    try:
+        with open(path, "r") as fp:
+            db = json.load(fp)
+    except (IOError, OSError, ValueError):
+        return _empty_database()
+    if not isinstance(db, dict) or 'targets' not in db:
+        return _empty_database()
+    db.setdefault('builds', [])
+    return db
+
+
+def SaveBuildTimes(path, db):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump(db, fp, indent=1, sort_keys=True)
+    os.rename(tmp, path)
+
+
+def _action_times(actions):
+    """
+    Sum the action durations in seconds by the name of the first target.
+    Actions in a list of actions for the same targets are added together.
+    """
+    times = {}
+    for action in actions:
+        if not action['targets']:
+            continue
+        name = action['targets'][0]
+        times[name] = times.get(name, 0.0) + \
+            (action['end'] - action['start']) / 1e6
+    return times
+
+
+def _critical_path(roots, duration, children):
+    """
+    Return the chain of nodes, starting from one of the roots and following
+    children, with the longest total duration, as the tuple (total, path).
+    Each node is visited only once, and the traversal is not recursive, so
+    deep trees do not hit the recursion limit.
+    """
+    # Map each node to (total, next node in the chain), or None while the
+    # node's children are still being visited.
+    best = {}
+    for root in roots:
+        if root in best:
+            continue
+        best[root] = None
+        stack = [(root, list(children(root)), 0)]
+        while stack:
+            node, kids, i = stack[-1]
+            if i < len(kids):
+                stack[-1] = (node, kids, i + 1)
+                kid = kids[i]
+                if kid not in best:
+                    best[kid] = None
+                    stack.append((kid, list(children(kid)), 0))
+                continue
+            stack.pop()
+            total, chain = 0.0, None
+            for kid in kids:
+                # A node still being visited would be a dependency cycle.
+                if best[kid] is not None and best[kid][0] > total:
+                    total, chain = best[kid][0], kid
+            best[node] = (duration(node) + total, chain)
+    path = []
+    start = None
+    for root in roots:
+        if start is None or best[root][0] > best[start][0]:
+            start = root
+    node = start
+    while node is not None:
+        path.append(node)
+        node = best[node][1]
+    total = best[start][0] if start is not None else 0.0
+    return total, path
+
+
+def BuildReport(actions, db, elapsed):
+    """
+    Return the report of the build times for the action records, compared
+    with the times in database db from previous builds, as a list of lines.
+    """
+    times = _action_times(actions)
+    previous = db['targets']
+    if not times:
+        return ["Build times: no actions were run, %.1fs elapsed" % elapsed]
+    lines = []
+    summary = ("Build times: %d actions took %.1fs, %.1fs elapsed" %
+               (len(times), sum(times.values()), elapsed))
+    if db['builds']:
+        last = db['builds'][-1]
+        summary += ("; previous build: %d actions took %.1fs, %.1fs elapsed"
+                    % (last['actions'], last['action_time'],
+                       last['elapsed']))
+    lines.append(summary)
+
+    node_times = {}
+    for action in actions:
+        for node in action['nodes']:
+            node_times[node] = node_times.get(node, 0.0) + \
+                (action['end'] - action['start']) / 1e6
+    roots = [action['nodes'][0] for action in actions if action['nodes']]
+    total, path = _critical_path(roots,
+                                 lambda node: node_times.get(node, 0.0),
+                                 lambda node: node.children(scan=0))
+    path = [node for node in path if node in node_times]
+    lines.append("Critical path: %.1fs in %d actions" % (total, len(path)))
+    for node in path:
+        lines.append("%10.3f  %s" % (node_times[node], node))
+
+    slowest = sorted(times.items(), key=lambda item: item[1], reverse=True)
+    lines.append("Slowest %d actions:" % min(_slowest_rows, len(slowest)))
+    lines.append("%10s %10s %8s  %s" % ("time(s)", "previous", "change",
+                                        "target"))
+    for name, seconds in slowest[:_slowest_rows]:
+        if name in previous:
+            lines.append("%10.3f %10.3f %+7.0f%%  %s" %
+                         (seconds, previous[name],
+                          _percent_change(previous[name], seconds), name))
+        else:
+            lines.append("%10.3f %10s %8s  %s" % (seconds, "-", "", name))
+    return lines
+
+
+def _percent_change(before, after):
+    if before <= 0:
+        return 0.0
+    return (after - before) * 100.0 / before
+
+
+def UpdateBuildTimes(actions, db, elapsed):
+    """
+    Add the times from the action records to database db.  Builds which
+    ran no actions are not added to the history.
+    """
+    times = _action_times(actions)
+    if not times:
+        return db
+    db['targets'].update(times)
+    db['builds'].append({'time': time.time(), 'elapsed': elapsed,
+                         'actions': len(times),
+                         'action_time': sum(times.values())})
+    del db['builds'][:-_history]
+    return db
+
+
+def Report(path):
+    "Print the report for this build and update the database at path."
+    actions = at.GetActions()
+    elapsed = time.time() - at.GetStartTime()
+    db = LoadBuildTimes(path)
+    print("\n".join(BuildReport(actions, db, elapsed)))
+    try:
+        SaveBuildTimes(path, UpdateBuildTimes(actions, db, elapsed))
+        print("Build times written to %s" % (path))
+    except (IOError, OSError) as ex:
+        print("Could not write build times %s: %s" % (path, ex))
+    sys.stdout.flush()
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test buildtimes.py
+
+def test_critical_path():
+    graph = {'prog': ['main.o', 'libx.a', 'header.h'],
+             'libx.a': ['x1.o', 'x2.o'],
+             'main.o': ['header.h'], 'x1.o': ['header.h'],
+             'x2.o': ['header.h'], 'header.h': [],
+             'doc': ['header.h']}
+    durations = {'prog': 1.0, 'main.o': 5.0, 'libx.a': 0.5,
+                 'x1.o': 3.0, 'x2.o': 4.0, 'doc': 2.0}
+    total, path = _critical_path(['x1.o', 'main.o', 'prog', 'doc'],
+                                 lambda n: durations.get(n, 0.0),
+                                 lambda n: graph[n])
+    assert total == 6.0
+    assert path == ['prog', 'main.o']
+    assert _critical_path([], None, None) == (0.0, [])
+
+
+def test_database(tmpdir):
+    path = str(tmpdir.join(_db_file))
+    db = LoadBuildTimes(path)
+    assert db == _empty_database()
+    assert BuildReport([], db, 1.0) == [
+        "Build times: no actions were run, 1.0s elapsed"]
+    assert UpdateBuildTimes([], db, 1.0) == _empty_database()
+    actions = [{'nodes': [], 'targets': ['a.o'], 'start': 0,
+                'end': 2000000},
+               {'nodes': [], 'targets': ['a.o'], 'start': 2000000,
+                'end': 2500000},
+               {'nodes': [], 'targets': ['b.o', 'b.h'], 'start': 0,
+                'end': 1000000}]
+    lines = BuildReport(actions, db, 3.0)
+    assert lines[0] == "Build times: 2 actions took 3.5s, 3.0s elapsed"
+    SaveBuildTimes(path, UpdateBuildTimes(actions, db, 3.0))
+    db = LoadBuildTimes(path)
+    assert db['targets'] == {'a.o': 2.5, 'b.o': 1.0}
+    actions[0]['end'] = 4500000
+    lines = BuildReport(actions[:2], db, 5.0)
+    assert lines[0].endswith("previous build: 2 actions took 3.5s, "
+                             "3.0s elapsed")
+    assert lines[-1] == "     5.000      2.500    +100%  a.o"
@@ -47,9 +47,12 @@ def _apply_default_tool(env):
             toolnames = SCons.Tool.tool_list(env['PLATFORM'], env)
         else:
             toolnames = ['mingw']
-        # Now instantiate a Tool for each of the names.
-        Debug("Applying default tools: %s" % (",".join(toolnames)))
-        _default_tool_list = [ SCons.Tool.Tool(t) for t in toolnames ]
+        # Now instantiate a Tool for each of the names.  Newer versions of
+        # SCons may return Tool instances instead of names.
+        Debug("Applying default tools: %s" %
+              (",".join([str(t) for t in toolnames])))
+        _default_tool_list = [ t if isinstance(t, SCons.Tool.Tool)
+                               else SCons.Tool.Tool(t) for t in toolnames ]
 
     # Now apply the default tools
     for tool in _default_tool_list:
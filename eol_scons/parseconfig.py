@@ -5,13 +5,27 @@ from __future__ import print_function
 
 import os
 import re
+import json
+import atexit
+import hashlib
+import threading
 
 import subprocess as sp
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    # Without concurrent.futures (python 2), prefetching is disabled and
+    # config queries just run when they are requested.
+    ThreadPoolExecutor = None
+
 _debug = False
 
 import SCons.Util
 
+import eol_scons.pkgconfig
+import eol_scons.profiler
+
 """
 Notes on PKG_CONFIG environment variables.
 
@@ -76,6 +90,423 @@ def _extract_results(text):
         return (-1, text)
 
 
+# The persistent config script cache is disabled by default.  It is
+# enabled by the eolsconsconfigcache variable through EnableConfigCache().
+_enable_config_cache = False
+_config_cache_file = "#/config_scripts.cache"
+_persistent_cache = None
+
+
+class ConfigScriptCache(object):
+    """
+    File-backed cache of config script results which persists across scons
+    runs, so a no-op rebuild does not need to run any config scripts.
+
+    Each entry is keyed by the full path to the config script, its
+    arguments, and the settings in ENV which can change the output, namely
+    PATH and any PKG_CONFIG_* variables.  Along with the result, each entry
+    records a stamp for every file and directory the result depends upon:
+    the config script itself and, for pkg-config, each directory on the .pc
+    search path.  The stamp for a directory covers the names and
+    modification times of all the .pc files it contains.  A cached result
+    is only used if all of its stamps still match, so installing, removing,
+    or modifying a package or config script invalidates the entry
+    automatically.
+
+    The number of hits and misses are counted so the savings can be
+    reported, see ConfigCacheStats().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        # Stamps are only computed once per run for each path.
+        self._stamps = {}
+        self.load()
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as cfile:
+                self.entries = json.load(cfile)
+        except (IOError, OSError, ValueError) as ex:
+            print("Ignoring unreadable config script cache %s: %s" %
+                  (self.path, str(ex)))
+            self.entries = {}
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        ctemp = "%s.tmp" % (self.path)
+        with open(ctemp, "w") as cfile:
+            json.dump(self.entries, cfile, indent=1, sort_keys=True)
+        # Make the result file visible atomically.
+        os.rename(ctemp, self.path)
+        self.dirty = False
+
+    def stamp(self, path):
+        """
+        Return a string which changes whenever the file or directory at
+        @p path changes.  The stamp of a directory includes the .pc files
+        in it, since that is what pkg-config searches for.
+        """
+        stamp = self._stamps.get(path)
+        if stamp is not None:
+            return stamp
+        try:
+            st = os.stat(path)
+            stamp = "%r:%d" % (st.st_mtime, st.st_size)
+            if os.path.isdir(path):
+                sig = hashlib.md5(stamp.encode())
+                for fname in sorted(os.listdir(path)):
+                    if fname.endswith('.pc'):
+                        pcpath = os.path.join(path, fname)
+                        pcstamp = "%s:%r" % (fname, os.path.getmtime(pcpath))
+                        sig.update(pcstamp.encode())
+                stamp = sig.hexdigest()
+        except OSError:
+            stamp = "missing"
+        self._stamps[path] = stamp
+        return stamp
+
+    def makeKey(self, config, args, psenv):
+        envkeys = [k for k in sorted(psenv)
+                   if k == 'PATH' or k.startswith('PKG_CONFIG_')]
+        return " ".join([config] + args + ["%s=%s" % (k, psenv[k])
+                                           for k in envkeys])
+
+    def lookup(self, key):
+        "Return the cached (returncode, output) for @p key, or None."
+        entry = self.entries.get(key)
+        if entry:
+            for path, stamp in entry['stamps']:
+                if self.stamp(path) != stamp:
+                    entry = None
+                    break
+        if not entry:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return (entry['returncode'], entry['output'])
+
+    def store(self, key, result, depends):
+        self.entries[key] = {
+            'returncode': result[0],
+            'output': result[1],
+            'stamps': [(path, self.stamp(path)) for path in depends]
+        }
+        self.dirty = True
+
+
+def EnableConfigCache(enable):
+    """
+    Enable or disable the persistent config script cache.  This is called
+    with the setting of the eolsconsconfigcache variable.
+    """
+    global _enable_config_cache
+    _enable_config_cache = bool(enable)
+
+
+def _save_persistent_cache():
+    if _persistent_cache:
+        _persistent_cache.save()
+        print("Config script cache: %d hits, %d misses, %s" %
+              (_persistent_cache.hits, _persistent_cache.misses,
+               _persistent_cache.path))
+
+
+def getPersistentCache(env):
+    """
+    Return the ConfigScriptCache if it is enabled, otherwise None.  The
+    cache file is loaded the first time it is needed and saved at exit.
+    """
+    global _persistent_cache
+    if not _enable_config_cache:
+        return None
+    if _persistent_cache is None:
+        path = env.File(_config_cache_file).get_abspath()
+        _persistent_cache = ConfigScriptCache(path)
+        atexit.register(_save_persistent_cache)
+    return _persistent_cache
+
+
+# Stamps are needed to record the files a config query depends on, even if
+# the persistent cache is disabled, so this cache with no file holds them.
+_stamp_cache = ConfigScriptCache(None)
+
+
+def getStampCache(env):
+    "Return the ConfigScriptCache to use for stamping files."
+    return getPersistentCache(env) or _stamp_cache
+
+
+def ConfigCacheStats():
+    """
+    Return a dictionary with the hits and misses counted by the persistent
+    config script cache, and the path to the cache file.
+    """
+    if not _persistent_cache:
+        return {'hits': 0, 'misses': 0, 'path': None}
+    return {'hits': _persistent_cache.hits,
+            'misses': _persistent_cache.misses,
+            'path': _persistent_cache.path}
+
+
+def _is_pkg_config(config):
+    name = os.path.basename(config)
+    return name.endswith('pkg-config') or name == 'pkgconf'
+
+
+def _config_depends(pcache, config, psenv):
+    """
+    Return the list of files and directories which can change the output
+    of the config script at path @p config.  For pkg-config, that includes
+    the directories on the .pc search path.  The default search path is
+    compiled into pkg-config, so it is queried (and cached) using the
+    pc_path variable, unless PKG_CONFIG_LIBDIR replaces it.
+    """
+    depends = [config]
+    if not _is_pkg_config(config):
+        return depends
+    dirs = psenv.get('PKG_CONFIG_PATH', '').split(os.pathsep)
+    if 'PKG_CONFIG_LIBDIR' in psenv:
+        dirs.extend(psenv['PKG_CONFIG_LIBDIR'].split(os.pathsep))
+    else:
+        args = ['--variable', 'pc_path', 'pkg-config']
+        key = pcache.makeKey(config, args, {})
+        result = pcache.lookup(key)
+        if result is None:
+            try:
+                result = _run_config(config, args, psenv)
+            except OSError:
+                result = (1, "")
+            pcache.store(key, result, [config])
+        dirs.extend(result[1].split(os.pathsep))
+    depends.extend([d for d in dirs if d])
+    return depends
+
+
+# Dictionaries which collect the stamps of the files and directories that
+# config queries depend on, keyed by path, while eol_scons.snapshot records
+# the tools which make the queries.
+_config_watchers = []
+
+
+def _watch_config(env, search_paths, config):
+    """
+    Add the stamps of the files which can change the result of a query of
+    the config script @p config, as returned by _find_config(), to each of
+    the _config_watchers.  If the config script was not found, then the
+    directories it was looked for in are stamped instead, so installing it
+    changes the stamps.
+    """
+    psenv = _string_env(env['ENV'])
+    cpath = config
+    if cpath and not os.path.isabs(cpath):
+        cpath = SCons.Util.WhereIs(cpath, psenv.get('PATH'))
+    pcache = getStampCache(env)
+    if cpath:
+        depends = _config_depends(pcache, cpath, psenv)
+    else:
+        dirs = search_paths or psenv.get('PATH', '').split(os.pathsep)
+        depends = [d for d in dirs if d]
+    for watcher in _config_watchers:
+        for path in depends:
+            watcher[path] = pcache.stamp(path)
+
+
+def _run_config(config, args, psenv):
+    """
+    Run the config script and return the (returncode, output) tuple.
+    Raises OSError if the config script cannot be run.
+    """
+    if _debug:
+        print("calling Popen([%s])" % ",".join([config]+args))
+        print("\n".join(["%s=%s" % (k,v) for k,v in psenv.items()]))
+    child = sp.Popen([config] + args, stdout=sp.PIPE, env=psenv)
+    result = child.communicate()[0]
+    result = result.decode().strip()
+    # Ubuntu 16.04 on Vortex had a mal configured cpp_common.pc libs entry.
+    # e.g. -l:/usr/lib/libcpp_common.so - clean it up here.
+    result = result.replace('-l:/','/')
+    return (child.returncode, result)
+
+
+_enable_pkgconfig_resolver = False
+
+# PkgConfig resolvers keyed by the pkg-config path and process environment.
+_resolvers = {}
+
+
+def EnablePkgConfigResolver(enable):
+    """
+    Enable or disable answering pkg-config queries by reading the .pc files
+    in python rather than running pkg-config.  This is called with the
+    setting of the eolsconspkgconfig variable.
+    """
+    global _enable_pkgconfig_resolver
+    _enable_pkgconfig_resolver = bool(enable)
+
+
+def _pkgconfig_variable(env, config, name):
+    "Return a variable of the pkg-config program itself, or empty string."
+    (rc, value) = _get_config(env, None, config,
+                              ['--variable', name, 'pkg-config'])
+    if rc != 0 or not value:
+        return ''
+    return value
+
+
+def _get_resolver(env, config, psenv):
+    """
+    Return the PkgConfig resolver for this pkg-config and process
+    environment, creating it the first time.  The default search path and
+    the system directories are compiled into pkg-config, so they are
+    queried from pkg-config once, through the usual caches.
+    """
+    key = _process_cache_key(config, [], psenv)
+    resolver = _resolvers.get(key)
+    if resolver is None:
+        libdirs = _pkgconfig_variable(env, config, 'pc_system_libdirs')
+        incdirs = _pkgconfig_variable(env, config, 'pc_system_includedirs')
+        resolver = eol_scons.pkgconfig.PkgConfig(
+            psenv, _pkgconfig_variable(env, config, 'pc_path'),
+            [d for d in libdirs.split(os.pathsep) if d],
+            [d for d in incdirs.split(os.pathsep) if d])
+        _resolvers[key] = resolver
+    return resolver
+
+
+def _resolve_config(env, config, args, psenv):
+    """
+    Answer a pkg-config query with the python resolver if it is enabled and
+    understands the query, otherwise run the config script.  Queries about
+    the pkg-config package itself always run pkg-config, since that is how
+    the resolver gets its search path.
+    """
+    if _enable_pkgconfig_resolver and _is_pkg_config(config) and \
+       args[-1:] != ['pkg-config']:
+        try:
+            result = _get_resolver(env, config, psenv).query(args)
+            if _debug: print("  resolved: %s" % (str(result)))
+            return result
+        except eol_scons.pkgconfig.PkgConfigUnsupported as ex:
+            if _debug: print("  not resolved: %s" % (str(ex)))
+    return _run_config(config, args, psenv)
+
+
+# Config script results shared by all Environments in this scons run,
+# keyed by the config script, its arguments, and the process environment
+# it runs with.  See _get_config().
+_process_cache = {}
+
+
+def _process_cache_key(config, args, psenv):
+    return tuple([config] + args) + tuple(sorted(psenv.items()))
+
+
+# Config queries submitted by PrefetchConfig() which have not been
+# collected yet, mapped by the same key as the _process_cache.
+_pending = {}
+_executor = None
+_prefetch_workers = 8
+
+
+def _shutdown_prefetch():
+    """
+    Cancel the prefetched queries which were never collected and wait for
+    the ones already running, so no config scripts are left running or
+    started at exit.
+    """
+    global _executor
+    for future in _pending.values():
+        future.cancel()
+    _pending.clear()
+    if _executor:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+def _persistent_key(pcache, config, args, psenv):
+    """
+    Return the persistent cache key and the full path to the config
+    script, or (None, None) if the config script cannot be found.
+    """
+    cpath = config
+    if not os.path.isabs(cpath):
+        cpath = SCons.Util.WhereIs(config, psenv.get('PATH'))
+    if not cpath:
+        return (None, None)
+    return (pcache.makeKey(cpath, args, psenv), cpath)
+
+
+def _find_config(env, search_paths, config_script):
+    """
+    Return the config script to run for @p config_script: the path found
+    in @p search_paths if given, otherwise the script name as is.  The
+    result is part of the cache keys, so prefetched queries must find the
+    config script the same way as the query which collects them.
+    """
+    if not search_paths:
+        return config_script
+    search_paths = [ p for p in search_paths if os.path.exists(p) ]
+    env.LogDebug("Checking for %s in %s" %
+                 (config_script, ",".join(search_paths)))
+    return env.WhereIs(config_script, search_paths)
+
+
+def PrefetchConfig(env, commands, search_paths=None):
+    """
+    Start running a batch of config script commands concurrently in a
+    thread pool, so that later calls to RunConfig(), CheckConfig(), or
+    ParseConfig() with the same command and ENV only need to collect the
+    result instead of waiting on the command.  This helps tools which need
+    to make many config queries, such as one or more pkg-config queries
+    for each Qt module.  Commands whose results are already cached are not
+    run again.  If the thread pool is not available, this does nothing.
+
+    The config scripts are looked up in @p search_paths if given, which
+    must match the search paths of the later query for it to find the
+    prefetched result.  See PrefetchPkgConfigPrefix().
+    """
+    global _executor
+    if ThreadPoolExecutor is None:
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=_prefetch_workers)
+        # Since python 3.9 the executor threads are joined, running every
+        # queued query, before the atexit functions are called, so cancel
+        # the queries in time where that hook exists.
+        register = getattr(threading, '_register_atexit', atexit.register)
+        register(_shutdown_prefetch)
+    psenv = _string_env(env['ENV'])
+    pcache = getPersistentCache(env)
+    for command in commands:
+        args = command.split()
+        config = _find_config(env, search_paths, args[0])
+        args = args[1:]
+        if not config:
+            continue
+        skey = _process_cache_key(config, args, psenv)
+        if skey in _process_cache or skey in _pending:
+            continue
+        if _enable_pkgconfig_resolver and _is_pkg_config(config):
+            # The resolver is faster than a thread running pkg-config.
+            continue
+        if pcache:
+            pkey, _ = _persistent_key(pcache, config, args, psenv)
+            result = pkey and pcache.lookup(pkey)
+            if result:
+                _process_cache[skey] = result
+                continue
+        if _debug: print("prefetching: %s" % (command))
+        _pending[skey] = _executor.submit(_run_config, config, args, psenv)
+
+
 def getConfigCache(env):
     cache = env.get("_config_cache")
     if cache is None:
@@ -103,7 +534,28 @@ def _get_config(env, search_paths, config_script, args):
     results.  The goal is to avoid redundant runs of the same config script
     when called for the same environment, such as redundant applications of
     the same tool.
+
+    Since the results only depend upon the process environment (ENV) and
+    not the rest of the Environment, they are also shared with every other
+    Environment which runs the same config script with the same ENV
+    settings.  So each distinct config query runs at most once per scons
+    run, no matter how many Environments are created.
+
+    If the persistent cache is enabled with eolsconsconfigcache=1, then
+    results are also looked up in and saved to a ConfigScriptCache file,
+    so they can be re-used by later scons runs until the config script or
+    the pkg-config files change.
+
+    If eolsconspkgconfig=1, then pkg-config queries are answered by the
+    eol_scons.pkgconfig resolver, which reads the .pc files directly.
+    Queries it does not support still run pkg-config.
     """
+    with eol_scons.profiler.Timer('config', " ".join([config_script] + args),
+                                  env):
+        return _query_config(env, search_paths, config_script, args)
+
+
+def _query_config(env, search_paths, config_script, args):
     result = None
     if _debug: print("_get_config(%s,%s): " % (config_script, ",".join(args)))
     # See if the output for this config script call has already been cached.
@@ -114,14 +566,13 @@ def _get_config(env, search_paths, config_script, args):
         if _debug: print("  cached: %s" % (result))
         return _extract_results(result)
     if not result:
-        if search_paths:
-            search_paths = [ p for p in search_paths if os.path.exists(p) ]
-            env.LogDebug("Checking for %s in %s" % 
-                         (config_script, ",".join(search_paths)))
-            config = env.WhereIs(config_script, search_paths)
-        else:
-            config = config_script
+        config = _find_config(env, search_paths, config_script)
         env.LogDebug("Found: %s" % config)
+        # Results cached in the Environment were watched when the query
+        # was first made, and the Environment cache is part of the
+        # snapshot of any tool which reuses them.
+        if _config_watchers:
+            _watch_config(env, search_paths, config)
     if not result and config:
         # The env dictionary must be converted to strings or else
         # execve() complains.
@@ -130,22 +581,42 @@ def _get_config(env, search_paths, config_script, args):
             # This is not done by default because it violates the scons
             # principle of precisely controlling the build environment.
             PassPkgConfigPath(env, psenv)
-        if _debug:
-            print("calling Popen([%s])" % ",".join([config]+args))
-            print("\n".join(["%s=%s" % (k,v) for k,v in psenv.items()]))
+        # Environments with the same process environment get the same
+        # results, so share them across all Environments in this run.
+        skey = _process_cache_key(config, args, psenv)
+        result = _process_cache.get(skey)
+        if _debug and result: print("  shared: %s" % (str(result)))
+        # The query may already be running if it was prefetched.
+        future = None
+        if result is None:
+            future = _pending.pop(skey, None)
+        # Otherwise look for the result in the persistent cache, keyed by
+        # the full path to the config script.
+        pcache = None
+        if result is None:
+            pcache = getPersistentCache(env)
+        pkey = None
+        if pcache:
+            pkey, cpath = _persistent_key(pcache, config, args, psenv)
+            if pkey and not future:
+                result = pcache.lookup(pkey)
+                if _debug and result: print("  persistent: %s" % (str(result)))
         try:
-            child = sp.Popen([config] + args, stdout=sp.PIPE, env=psenv)
-            result = child.communicate()[0]
-            result = result.decode().strip()
-            # Ubuntu 16.04 on Vortex had a mal configured cpp_common.pc libs entry.
-            # e.g. -l:/usr/lib/libcpp_common.so - clean it up here.
-            result = result.replace('-l:/','/')
-            cache[name] = "%s,%s" % (child.returncode, result)
-            result = (child.returncode, result)
+            if result is None:
+                if future:
+                    result = future.result()
+                else:
+                    result = _resolve_config(env, config, args, psenv)
+                if pkey:
+                    pcache.store(pkey, result,
+                                 _config_depends(pcache, cpath, psenv))
         except OSError:
             # If the config script cannot be found, then the package must
             # not exist either.
             result = (1, None)
+        _process_cache[skey] = result
+        if result[1] is not None:
+            cache[name] = "%s,%s" % result
     if not result:
         result = (-1, "")
     if _debug: print("   command: %s" % (str(result)))
@@ -257,11 +728,18 @@ def ParseConfigPrefix(env, config_script, search_prefixes,
     return prefix
 
 
+# PkgConfigPrefix() only runs the pkg-config found under these prefixes.
+_pkg_config_prefixes = ['/usr']
+
+
+def _pkg_config_search_paths(env):
+    return [ os.path.join(env.subst(x),"bin")
+             for x in [y for y in _pkg_config_prefixes if y] ]
+
+
 def PkgConfigPrefix(env, pkg_name, default_prefix = "$OPT_PREFIX"):
     """Search for a config script and parse the output."""
-    search_prefixes = ['/usr']
-    search_paths = [ os.path.join(env.subst(x),"bin")
-                     for x in [y for y in search_prefixes if y] ]
+    search_paths = _pkg_config_search_paths(env)
     prefix = None
     if env['PLATFORM'] != 'win32':    
         prefix = _get_config(env, search_paths, 'pkg-config',
@@ -271,3 +749,73 @@ def PkgConfigPrefix(env, pkg_name, default_prefix = "$OPT_PREFIX"):
     return prefix
 
 
+def PrefetchPkgConfigPrefix(env, pkg_name):
+    """
+    Prefetch the pkg-config query made by PkgConfigPrefix(), which finds
+    pkg-config in its own search path rather than in ENV['PATH'].
+    """
+    if env['PLATFORM'] != 'win32':
+        PrefetchConfig(env, ["pkg-config --variable=prefix %s" % (pkg_name)],
+                       _pkg_config_search_paths(env))
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test parseconfig.py
+
+def test_prefetch_pkg_config_prefix(tmpdir):
+    global _pkg_config_prefixes
+    import SCons.Environment
+    if ThreadPoolExecutor is None:
+        return
+    bindir = tmpdir.mkdir('bin')
+    script = bindir.join('pkg-config')
+    script.write("#! /bin/sh\necho /opt/fake\n")
+    script.chmod(0o755)
+    env = SCons.Environment.Environment(tools=[])
+    env.AddMethod(lambda env, msg: None, 'LogDebug')
+    saved = _pkg_config_prefixes
+    _pkg_config_prefixes = [str(tmpdir)]
+    try:
+        PrefetchPkgConfigPrefix(env, 'fake')
+        skey = _process_cache_key(str(script),
+                                  ['--variable=prefix', 'fake'],
+                                  _string_env(env['ENV']))
+        assert list(_pending.keys()) == [skey]
+        # The later query collects the prefetched result by the same key.
+        assert PkgConfigPrefix(env, 'fake') == "/opt/fake"
+        assert skey not in _pending
+        assert _process_cache[skey] == (0, "/opt/fake")
+    finally:
+        _pkg_config_prefixes = saved
+        _pending.clear()
+        _process_cache.clear()
+
+
+def test_shutdown_prefetch(tmpdir):
+    global _prefetch_workers
+    import SCons.Environment
+    if ThreadPoolExecutor is None:
+        return
+    script = tmpdir.join('slow-config')
+    script.write("#! /bin/sh\nsleep 0.2\necho $1\n")
+    script.chmod(0o755)
+    env = SCons.Environment.Environment(tools=[])
+    env.AddMethod(lambda env, msg: None, 'LogDebug')
+    saved = _prefetch_workers
+    _prefetch_workers = 1
+    try:
+        # Start with a new executor with only one worker.
+        _shutdown_prefetch()
+        PrefetchConfig(env, ['%s %s' % (script, arg) for arg in 'ab'])
+        futures = list(_pending.values())
+        assert len(futures) == 2
+        _shutdown_prefetch()
+        assert not _pending and _executor is None
+        # The first query was already running, the second never starts.
+        assert [f.done() for f in futures] == [True, True]
+        assert futures[1].cancelled()
+    finally:
+        _prefetch_workers = saved
+        _pending.clear()
+        _process_cache.clear()
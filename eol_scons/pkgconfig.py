@@ -0,0 +1,508 @@
+# -*- python -*-
+# Copyright 2007 UCAR, NCAR, All Rights Reserved
+
+"""
+Resolve pkg-config queries in python by reading the .pc files directly,
+instead of running the pkg-config program.
+
+The resolver handles the queries which eol_scons tools make most often:
+--cflags, --libs, --variable, --exists, and --modversion, along with the
+--cflags-only-* and --libs-only-* variants.  The .pc files are found on
+the same search path pkg-config uses: PKG_CONFIG_PATH first, then
+PKG_CONFIG_LIBDIR, or if that is not set, the default path compiled into
+pkg-config.  Variables are substituted, and the Requires and
+Requires.private packages are followed recursively, checking any version
+constraints.  Like pkg-config, -I and -L flags for the system directories
+are removed unless PKG_CONFIG_ALLOW_SYSTEM_CFLAGS or
+PKG_CONFIG_ALLOW_SYSTEM_LIBS are set.
+
+Anything the resolver does not understand raises PkgConfigUnsupported, so
+the caller can fall back to running the real pkg-config.  That includes
+options like --static or --define-variable, the uninstalled .pc variants,
+PKG_CONFIG_SYSROOT_DIR, and flags which need shell quoting.  The output is
+meant to be equivalent to the pkg-config output when merged into an
+Environment with MergeFlags(), but it is not guaranteed to be identical
+character for character.
+
+The parseconfig module uses this resolver when the eolsconspkgconfig
+variable is enabled.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import shlex
+
+
+class PkgConfigUnsupported(Exception):
+    """
+    Raised when a query cannot be resolved in python and must be passed to
+    the pkg-config program.
+    """
+    pass
+
+
+class PkgConfigError(Exception):
+    "A package or a variable could not be resolved."
+    pass
+
+
+# Options which take no argument and which the resolver knows how to
+# answer, mapped to the flags output they select.
+_output_options = {
+    '--cflags': ('cflags', None),
+    '--cflags-only-I': ('cflags', 'I'),
+    '--cflags-only-other': ('cflags', 'other'),
+    '--libs': ('libs', None),
+    '--libs-only-L': ('libs', 'L'),
+    '--libs-only-l': ('libs', 'l'),
+    '--libs-only-other': ('libs', 'other'),
+}
+
+# Options which do not change the output.
+_ignored_options = ['--silence-errors', '--print-errors', '--short-errors']
+
+_version_ops = ['<', '<=', '=', '!=', '>=', '>']
+
+
+def vercmp(a, b):
+    """
+    Compare two version strings the way pkg-config does, which is the rpm
+    version comparison: split into alternating runs of digits and letters,
+    and compare numbers numerically.  Returns -1, 0, or 1.
+    """
+    if a == b:
+        return 0
+    sa = re.findall(r'\d+|[a-zA-Z]+', a)
+    sb = re.findall(r'\d+|[a-zA-Z]+', b)
+    for x, y in zip(sa, sb):
+        if x.isdigit() and y.isdigit():
+            x, y = int(x), int(y)
+        elif x.isdigit():
+            # Numeric segments are newer than alphabetic segments.
+            return 1
+        elif y.isdigit():
+            return -1
+        if x != y:
+            return [-1, 1][x > y]
+    if len(sa) == len(sb):
+        return 0
+    return [-1, 1][len(sa) > len(sb)]
+
+
+def _version_matches(version, op, required):
+    cmp = vercmp(version, required)
+    return {'<': cmp < 0, '<=': cmp <= 0, '=': cmp == 0,
+            '!=': cmp != 0, '>=': cmp >= 0, '>': cmp > 0}[op]
+
+
+def parse_requires(text):
+    """
+    Parse a Requires field into a list of (name, op, version) tuples.  The
+    op and version are None if there is no version constraint.
+    """
+    tokens = text.replace(',', ' ').split()
+    requires = []
+    i = 0
+    while i < len(tokens):
+        name = tokens[i]
+        if name in _version_ops:
+            raise PkgConfigUnsupported("cannot parse Requires: %s" % (text))
+        if i + 1 < len(tokens) and tokens[i+1] in _version_ops:
+            if i + 2 >= len(tokens):
+                raise PkgConfigUnsupported("cannot parse Requires: %s" %
+                                           (text))
+            requires.append((name, tokens[i+1], tokens[i+2]))
+            i += 3
+        else:
+            requires.append((name, None, None))
+            i += 1
+    return requires
+
+
+class PcFile(object):
+    """
+    The variables and fields parsed from a single .pc file.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.variables = {'pcfiledir': os.path.dirname(path)}
+        self.fields = {}
+        self._parse()
+
+    def _lines(self):
+        with open(self.path, "r") as pcfile:
+            text = pcfile.read()
+        # Join continued lines, then strip comments which are not escaped.
+        text = text.replace('\\\n', ' ')
+        for line in text.splitlines():
+            line = re.sub(r'(?<!\\)#.*', '', line).replace('\\#', '#')
+            line = line.strip()
+            if line:
+                yield line
+
+    def _parse(self):
+        for line in self._lines():
+            m = re.match(r'^([A-Za-z0-9_.]+)\s*([:=])\s*(.*)$', line)
+            if not m:
+                continue
+            key, sep, value = m.groups()
+            if sep == '=':
+                self.variables[key] = self.expand(value)
+            else:
+                # Field names are case-insensitive, eg, CFlags.
+                self.fields[key.lower()] = self.expand(value)
+
+    def expand(self, value):
+        "Substitute ${variable} references, and $$ for a literal $."
+        def _subst(m):
+            if m.group(0) == '$$':
+                return '$'
+            var = m.group(1)
+            if var not in self.variables:
+                raise PkgConfigError("Variable '%s' not defined in '%s'" %
+                                     (var, self.path))
+            return self.variables[var]
+        return re.sub(r'\$\$|\$\{([^}]*)\}', _subst, value)
+
+    def get(self, field):
+        return self.fields.get(field.lower(), '')
+
+    def version(self):
+        return self.get('version')
+
+    def requires(self, private=False):
+        requires = parse_requires(self.get('requires'))
+        if private:
+            requires += parse_requires(self.get('requires.private'))
+        return requires
+
+    def flags(self, field):
+        """
+        Split a Cflags or Libs field into a list of flags, the way the
+        shell would.
+        """
+        text = self.get(field)
+        try:
+            flags = shlex.split(text)
+        except ValueError:
+            raise PkgConfigUnsupported("cannot split %s in %s" %
+                                       (field, self.path))
+        for flag in flags:
+            if re.search(r'[\s\'"\\$`]', flag):
+                raise PkgConfigUnsupported("flag needs quoting: %s" % (flag))
+        return flags
+
+
+def _keep_last(field, flag):
+    # Libraries must be listed after everything which needs them, so the
+    # last occurrence of a duplicate library flag is the one to keep.
+    # Linker options like -Wl,--as-needed usually bracket libraries, so
+    # they are kept with them.  Search paths keep the first occurrence.
+    return field == 'libs' and not flag.startswith('-L')
+
+
+def _merge(field, lists):
+    """
+    Concatenate the flag lists and remove duplicates, keeping either the
+    first or last occurrence of each flag according to _keep_last().
+    """
+    merged = []
+    for flags in lists:
+        merged.extend(flags)
+    last = {}
+    for i, flag in enumerate(merged):
+        last[flag] = i
+    seen = set()
+    result = []
+    for i, flag in enumerate(merged):
+        if _keep_last(field, flag):
+            if last[flag] != i:
+                continue
+        elif flag in seen:
+            continue
+        seen.add(flag)
+        result.append(flag)
+    return result
+
+
+class PkgConfig(object):
+    """
+    Resolve pkg-config queries for one process environment.  @p psenv is
+    the environment dictionary pkg-config would run with, and @p pc_path
+    is the default search path (pkg-config --variable pc_path pkg-config)
+    used when PKG_CONFIG_LIBDIR is not set.  @p system_libdirs and
+    @p system_includedirs are the directories whose -L and -I flags are
+    removed from the output.
+    """
+
+    def __init__(self, psenv, pc_path='', system_libdirs=None,
+                 system_includedirs=None):
+        for var in ['PKG_CONFIG_SYSROOT_DIR', 'PKG_CONFIG_TOP_BUILD_DIR']:
+            if psenv.get(var):
+                raise PkgConfigUnsupported("%s is set" % (var))
+        self.psenv = psenv
+        dirs = psenv.get('PKG_CONFIG_PATH', '').split(os.pathsep)
+        if 'PKG_CONFIG_LIBDIR' in psenv:
+            dirs += psenv['PKG_CONFIG_LIBDIR'].split(os.pathsep)
+        else:
+            dirs += pc_path.split(os.pathsep)
+        self.search_path = [d for d in dirs if d]
+        self.system_libdirs = system_libdirs or ['/usr/lib', '/usr/lib64']
+        self.system_includedirs = system_includedirs or ['/usr/include']
+        # pkgconf lets the system directories be overridden at runtime.
+        if psenv.get('PKG_CONFIG_SYSTEM_LIBRARY_PATH'):
+            self.system_libdirs = \
+                psenv['PKG_CONFIG_SYSTEM_LIBRARY_PATH'].split(os.pathsep)
+        if psenv.get('PKG_CONFIG_SYSTEM_INCLUDE_PATH'):
+            self.system_includedirs = \
+                psenv['PKG_CONFIG_SYSTEM_INCLUDE_PATH'].split(os.pathsep)
+        self._packages = {}
+        self._flattened = {}
+
+    def find(self, name):
+        "Return the path to the .pc file for package @p name, or None."
+        for pcdir in self.search_path:
+            if os.path.exists(os.path.join(pcdir, name + '-uninstalled.pc')):
+                raise PkgConfigUnsupported("uninstalled package: %s" % (name))
+            path = os.path.join(pcdir, name + '.pc')
+            if os.path.exists(path):
+                return path
+        return None
+
+    def package(self, name, op=None, version=None):
+        """
+        Return the PcFile for package @p name.  Raise PkgConfigError if it
+        cannot be found or does not satisfy the version constraint.
+        """
+        if name == 'pkg-config':
+            # The virtual package with the pkg-config settings.
+            raise PkgConfigUnsupported("virtual package: %s" % (name))
+        pkg = self._packages.get(name)
+        if pkg is None:
+            path = self.find(name)
+            if not path:
+                raise PkgConfigError(
+                    "Package %s was not found in the pkg-config search path."
+                    % (name))
+            pkg = PcFile(name, path)
+            self._packages[name] = pkg
+        if op and not _version_matches(pkg.version(), op, version):
+            raise PkgConfigError(
+                "Requested '%s %s %s' but version of %s is %s" %
+                (name, op, version, name, pkg.version()))
+        return pkg
+
+    def _flatten(self, pkg, field, stack=()):
+        """
+        Return the flags from @p field for @p pkg followed by the flags of
+        all its required packages.  Cflags include the private requires,
+        since their headers may be needed, but libs do not.
+        """
+        key = (pkg.name, field)
+        if key in self._flattened:
+            return self._flattened[key]
+        if pkg.name in stack:
+            return []
+        stack = stack + (pkg.name,)
+        lists = [pkg.flags(field)]
+        for name, op, version in pkg.requires(private=(field == 'cflags')):
+            req = self.package(name, op, version)
+            lists.append(self._flatten(req, field, stack))
+        flags = _merge(field, lists)
+        self._flattened[key] = flags
+        return flags
+
+    def _is_system_flag(self, flag):
+        if flag.startswith('-I') and \
+           not self.psenv.get('PKG_CONFIG_ALLOW_SYSTEM_CFLAGS'):
+            return os.path.normpath(flag[2:]) in self.system_includedirs
+        if flag.startswith('-L') and \
+           not self.psenv.get('PKG_CONFIG_ALLOW_SYSTEM_LIBS'):
+            return os.path.normpath(flag[2:]) in self.system_libdirs
+        return False
+
+    def flags(self, packages, field, only=None):
+        flags = _merge(field, [self._flatten(pkg, field)
+                               for pkg in packages])
+        flags = [f for f in flags if not self._is_system_flag(f)]
+        if only == 'I':
+            flags = [f for f in flags if f.startswith('-I')]
+        elif only == 'other' and field == 'cflags':
+            flags = [f for f in flags if not f.startswith('-I')]
+        elif only == 'L':
+            flags = [f for f in flags if f.startswith('-L')]
+        elif only == 'l':
+            flags = [f for f in flags if f.startswith('-l')]
+        elif only == 'other':
+            flags = [f for f in flags if not f.startswith('-l') and
+                     not f.startswith('-L')]
+        return flags
+
+    def query(self, args):
+        """
+        Answer the pkg-config query given by the argument list @p args,
+        returning the same (returncode, output) tuple as running pkg-config
+        with those arguments.  Raise PkgConfigUnsupported if the query
+        cannot be answered here.
+        """
+        outputs = []
+        variable = None
+        exists = False
+        modversion = False
+        silence = False
+        names = []
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in _output_options:
+                outputs.append(_output_options[arg])
+            elif arg == '--variable' and i + 1 < len(args):
+                i += 1
+                variable = args[i]
+            elif arg.startswith('--variable='):
+                variable = arg[len('--variable='):]
+            elif arg == '--exists':
+                exists = True
+            elif arg == '--modversion':
+                modversion = True
+            elif arg in _ignored_options:
+                silence = silence or arg == '--silence-errors'
+            elif arg.startswith('-'):
+                raise PkgConfigUnsupported("option %s" % (arg))
+            else:
+                names.append(arg)
+            i += 1
+        if not names:
+            raise PkgConfigUnsupported("no packages given")
+        if sum([bool(outputs), variable is not None, modversion]) > 1:
+            raise PkgConfigUnsupported("combination of options")
+        # Package names can be followed by version constraints, eg,
+        # 'Qt5Core >= 5.6', which parse just like a Requires field.
+        try:
+            packages = [self.package(name, op, version) for name, op, version
+                        in parse_requires(" ".join(names))]
+            # Make sure all the required packages exist, just like
+            # pkg-config does even for --exists.
+            for pkg in packages:
+                self._flatten(pkg, 'cflags')
+                self._flatten(pkg, 'libs')
+            if exists:
+                output = ''
+            elif modversion:
+                output = "\n".join([pkg.version() for pkg in packages])
+            elif variable is not None:
+                output = " ".join([pkg.variables.get(variable, '')
+                                   for pkg in packages]).strip()
+            else:
+                flags = []
+                for field, only in outputs:
+                    flags.extend(self.flags(packages, field, only))
+                output = " ".join(flags)
+        except PkgConfigError as ex:
+            if not exists and not silence:
+                sys.stderr.write("%s\n" % (str(ex)))
+            return (1, '')
+        return (0, output)
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test pkgconfig.py
+
+_pc_files = {
+    'base': """\
+prefix=/opt/base
+libdir=${prefix}/lib
+includedir=${prefix}/include
+
+Name: base
+Version: 1.2.10
+Libs: -L${libdir} -lbase
+Cflags: -I${includedir} -DBASE
+""",
+    'mid': """\
+prefix=/usr
+libdir=${prefix}/lib64
+# a comment
+Name: mid
+Version: 2.0
+Requires: base >= 1.2.9
+Requires.private: priv
+Libs: -L${libdir} \\
+  -lmid
+Cflags: -I${prefix}/include -I${prefix}/include/mid
+""",
+    'priv': """\
+Name: priv
+Version: 0.1
+Libs: -lpriv
+Cflags: -DPRIV
+""",
+    'top': """\
+Name: top
+Version: 3
+Requires: mid, base
+Libs: -ltop -lbase
+Cflags: -DTOP
+""",
+}
+
+
+def _make_resolver(tmpdir, **kw):
+    for name, text in _pc_files.items():
+        tmpdir.join(name + '.pc').write(text)
+    return PkgConfig({'PKG_CONFIG_LIBDIR': str(tmpdir)}, **kw)
+
+
+def test_vercmp():
+    assert vercmp('1.2.10', '1.2.9') == 1
+    assert vercmp('1.2', '1.2.0') == -1
+    assert vercmp('5.9.7', '5.9.7') == 0
+    assert vercmp('1.0a', '1.0') == 1
+    assert vercmp('1.0', '1.0a') == -1
+    assert vercmp('1a', '1.1') == -1
+
+
+def test_parse_requires():
+    assert parse_requires('a, b >= 1.0 c') == [('a', None, None),
+                                                ('b', '>=', '1.0'),
+                                                ('c', None, None)]
+    assert parse_requires('') == []
+
+
+def test_pkgconfig_queries(tmpdir):
+    pcr = _make_resolver(tmpdir)
+    assert pcr.query(['--exists', 'top']) == (0, '')
+    assert pcr.query(['--exists', 'nosuch']) == (1, '')
+    assert pcr.query(['--exists', 'base', '>=', '1.3']) == (1, '')
+    assert pcr.query(['--modversion', 'base']) == (0, '1.2.10')
+    assert pcr.query(['--variable=libdir', 'base']) == (0, '/opt/base/lib')
+    assert pcr.query(['--variable', 'pcfiledir', 'base']) == \
+        (0, str(tmpdir))
+    assert pcr.query(['--variable=nosuch', 'base']) == (0, '')
+    # System include and library directories are removed, private
+    # requires contribute only cflags, and the last duplicate library
+    # is kept.
+    assert pcr.query(['--cflags', 'mid']) == \
+        (0, '-I/usr/include/mid -I/opt/base/include -DBASE -DPRIV')
+    assert pcr.query(['--libs', 'top']) == \
+        (0, '-ltop -lmid -L/opt/base/lib -lbase')
+    assert pcr.query(['--libs-only-L', 'top']) == (0, '-L/opt/base/lib')
+    assert pcr.query(['--silence-errors', '--cflags', '--libs', 'base']) == \
+        (0, '-I/opt/base/include -DBASE -L/opt/base/lib -lbase')
+
+
+def test_pkgconfig_unsupported(tmpdir):
+    import pytest
+    pcr = _make_resolver(tmpdir)
+    with pytest.raises(PkgConfigUnsupported):
+        pcr.query(['--static', '--libs', 'top'])
+    with pytest.raises(PkgConfigUnsupported):
+        pcr.query(['--variable', 'pc_path', 'pkg-config'])
+    with pytest.raises(PkgConfigUnsupported):
+        PkgConfig({'PKG_CONFIG_SYSROOT_DIR': '/sysroot'})
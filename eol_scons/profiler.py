@@ -0,0 +1,308 @@
+# -*- python -*-
+# Copyright 2007 UCAR, NCAR, All Rights Reserved
+
+"""
+Profile where eol_scons spends time while the SConscript files are read.
+
+Enable the profile with eolsconsprofile=1 on the scons command line.  The
+setting is read from the command line ARGUMENTS when this module is
+imported, like eolsconsdebug, so that tools applied before the global
+variables are created are profiled too.
+
+When enabled, eol_scons records the wall time, number of calls, and number
+of subprocesses started for each of these operations:
+
+  tool          applying a tool to an Environment, eol_scons.tool._Tool()
+  load          loading a tool_<name>.py file
+  global_tools  applying the global tools to a new Environment
+  config        running (or looking up) a config script query, such as
+                pkg-config, in eol_scons.parseconfig
+  configure     a SConf Configure check, like CheckLib()
+  vcs           the git or svn queries run by the gitinfo or svninfo tools
+
+Each record is also broken down by the directory of the Environment, as
+with eolsconsdebug messages.  Operations nest, so a record has a total
+(inclusive) time and a self time which excludes the nested operations it
+timed.  The self times add up to the total profiled time without double
+counting.  Subprocesses are counted by intercepting subprocess.Popen while
+the SConscript files are read, so that includes compiler runs for Configure
+checks and config scripts, but not the commands run to build targets.  The
+hook is removed the first time a subprocess starts after reading.
+
+At exit the profile is printed, slowest operations first, and written as
+JSON to eolsconsprofile.json in the top directory.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+
+import SCons.Script
+from SCons.Script import ARGUMENTS
+
+_enable_profile = False
+_profile_file = "eolsconsprofile.json"
+
+# Number of rows printed in each table of the report.
+_report_rows = 25
+
+# Map (kind, name, subdir) to the list [calls, total, self, subprocesses],
+# where subprocesses counts the subprocesses started by the operation
+# itself and not by nested operations.
+_records = {}
+
+# The stack of operations being timed.  Each entry is the list
+# [key, start, nested time].
+_stack = []
+
+# Subprocesses started in other threads, like prefetched config queries,
+# cannot be attributed to the operation being timed.
+_background_subprocesses = 0
+
+_start_time = time.time()
+
+
+def _is_true(value):
+    return str(value).lower() in ['1', 'yes', 'true', 'on']
+
+
+class Timer(object):
+    """
+    Context manager which times one operation of the given @p kind and
+    @p name, for the directory of Environment @p env.  This does nothing
+    unless profiling is enabled.
+    """
+
+    def __init__(self, kind, name, env=None):
+        self.kind = kind
+        self.name = name
+        self.env = env
+        self.entry = None
+
+    def __enter__(self):
+        if _enable_profile and _in_main_thread():
+            key = (self.kind, str(self.name), _subdir(self.env))
+            self.entry = [key, time.time(), 0.0]
+            _stack.append(self.entry)
+        return self
+
+    def __exit__(self, *exc):
+        if self.entry is None:
+            return False
+        elapsed = time.time() - self.entry[1]
+        # The stack is unwound in order, even when exceptions propagate.
+        while _stack and _stack.pop() is not self.entry:
+            pass
+        if _stack:
+            _stack[-1][2] += elapsed
+        record = _records.setdefault(self.entry[0], [0, 0.0, 0.0, 0])
+        record[0] += 1
+        record[1] += elapsed
+        record[2] += elapsed - self.entry[2]
+        self.entry = None
+        return False
+
+
+def _in_main_thread():
+    return threading.current_thread().name == 'MainThread'
+
+
+def _subdir(env):
+    if env is None:
+        return ''
+    try:
+        import eol_scons.debug
+        return eol_scons.debug.GetSubdir(env)
+    except Exception:
+        return ''
+
+
+def _count_subprocess():
+    global _background_subprocesses
+    if not _in_main_thread():
+        _background_subprocesses += 1
+        return
+    key = _stack[-1][0] if _stack else ('subprocess', 'untimed', '')
+    record = _records.setdefault(key, [0, 0.0, 0.0, 0])
+    record[3] += 1
+
+
+def _install_hooks():
+    """
+    Count the subprocesses started while reading SConscript files, and time
+    the SConf tests.  Both are done by wrapping existing methods, so they
+    are only installed when profiling is enabled.
+    """
+    import subprocess
+    popen_init = subprocess.Popen.__init__
+
+    def __init__(self, *args, **kw):
+        if SCons.Script.sconscript_reading:
+            _count_subprocess()
+        else:
+            # The build has started, so stop counting before the build
+            # commands swamp the subprocesses the report is meant to show.
+            subprocess.Popen.__init__ = popen_init
+        popen_init(self, *args, **kw)
+
+    subprocess.Popen.__init__ = __init__
+
+    import SCons.SConf
+    wrapper = getattr(SCons.SConf.SConfBase, 'TestWrapper', None)
+    if wrapper is None:
+        return
+    test_call = wrapper.__call__
+
+    def __call__(self, *args, **kw):
+        name = getattr(self.test, '__name__', 'Check')
+        if args:
+            name = "%s(%s)" % (name, args[0])
+        with Timer('configure', name, getattr(self.sconf, 'env', None)):
+            return test_call(self, *args, **kw)
+
+    wrapper.__call__ = __call__
+
+
+def EnableProfile(enable):
+    """
+    Enable the profile, which is only possible before the end of the scons
+    run.  It cannot be disabled again once enabled, since the hooks are
+    already installed and the report is registered to run at exit.
+    """
+    global _enable_profile
+    if not enable or _enable_profile:
+        return
+    _enable_profile = True
+    _install_hooks()
+    atexit.register(_report)
+
+
+def ProfileEnabled():
+    return _enable_profile
+
+
+def _summarize(records, keyfn):
+    "Sum the records into a dictionary keyed by keyfn(key)."
+    summary = {}
+    for key, record in records.items():
+        total = summary.setdefault(keyfn(key), [0, 0.0, 0.0, 0])
+        for i in range(4):
+            total[i] += record[i]
+    return summary
+
+
+def GetProfile():
+    """
+    Return the profile as a dictionary suitable for writing as JSON.  The
+    'records' list has one entry per operation per directory, while the
+    'operations' and 'directories' lists sum the records across directories
+    and across operations respectively.
+    """
+    def rows(summary, fields):
+        result = []
+        for key, record in summary.items():
+            row = dict(zip(fields, key))
+            row.update({'calls': record[0], 'total': record[1],
+                        'self': record[2], 'subprocesses': record[3]})
+            result.append(row)
+        result.sort(key=lambda row: row['self'], reverse=True)
+        return result
+
+    operations = _summarize(_records, lambda key: (key[0], key[1]))
+    directories = _summarize(_records, lambda key: (key[2],))
+    profiled = sum([record[2] for record in _records.values()])
+    return {
+        'elapsed': time.time() - _start_time,
+        'profiled': profiled,
+        'subprocesses': sum([r[3] for r in _records.values()]),
+        'background_subprocesses': _background_subprocesses,
+        'records': rows(_records, ('kind', 'name', 'directory')),
+        'operations': rows(operations, ('kind', 'name')),
+        'directories': rows(directories, ('directory',)),
+    }
+
+
+def _format_table(title, rows, labels):
+    lines = ["%s:" % (title),
+             "%9s %9s %6s %6s  %s" %
+             ("self(s)", "total(s)", "calls", "procs", labels)]
+    for row in rows[:_report_rows]:
+        if 'kind' in row:
+            label = "%-12s %s" % (row['kind'], row['name'])
+        else:
+            label = row['directory'] or '(none)'
+        lines.append("%9.3f %9.3f %6d %6d  %s" %
+                     (row['self'], row['total'], row['calls'],
+                      row['subprocesses'], label))
+    if len(rows) > _report_rows:
+        lines.append("%29s  ... %d more" % ("", len(rows) - _report_rows))
+    return "\n".join(lines)
+
+
+def _report():
+    profile = GetProfile()
+    print("eol_scons profile: %.3fs of %.3fs elapsed in eol_scons "
+          "operations, %d subprocesses (%d in background threads)" %
+          (profile['profiled'], profile['elapsed'], profile['subprocesses'],
+           profile['background_subprocesses']))
+    print(_format_table("Operations", profile['operations'], "operation"))
+    print(_format_table("Directories", profile['directories'], "directory"))
+    path = _profile_path()
+    try:
+        with open(path, "w") as fp:
+            json.dump(profile, fp, indent=1)
+        print("eol_scons profile written to %s" % (path))
+    except (IOError, OSError) as ex:
+        print("Could not write eol_scons profile %s: %s" % (path, ex))
+    sys.stdout.flush()
+
+
+def _profile_path():
+    try:
+        import SCons.Node.FS
+        return SCons.Node.FS.get_default_fs().File('#/' + _profile_file) \
+                                             .get_abspath()
+    except Exception:
+        return os.path.abspath(_profile_file)
+
+
+EnableProfile(_is_true(ARGUMENTS.get('eolsconsprofile', False)))
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test profiler.py
+
+def test_timer():
+    global _enable_profile
+    _records.clear()
+    _enable_profile = True
+    try:
+        with Timer('tool', 'outer'):
+            with Timer('config', 'inner'):
+                time.sleep(0.02)
+            _count_subprocess()
+            time.sleep(0.01)
+        with Timer('tool', 'outer'):
+            pass
+    finally:
+        _enable_profile = False
+    outer = _records[('tool', 'outer', '')]
+    inner = _records[('config', 'inner', '')]
+    assert outer[0] == 2 and inner[0] == 1
+    assert outer[1] >= inner[1] + 0.01
+    assert abs(outer[2] - (outer[1] - inner[1])) < 1e-6
+    assert outer[3] == 1 and inner[3] == 0
+    profile = GetProfile()
+    assert profile['operations'][0]['name'] == 'inner'
+    assert profile['directories'][0]['calls'] == 3
+    # Timers do nothing when the profile is disabled.
+    with Timer('tool', 'disabled'):
+        pass
+    assert ('tool', 'disabled', '') not in _records
+    _records.clear()
@@ -0,0 +1,145 @@
+# -*- python -*-
+# Copyright 2007 UCAR, NCAR, All Rights Reserved
+
+"""
+Record the SConstruct and SConscript files read by scons.
+
+SCons does not keep a list of the SConscript files it has read, but tools
+like ninja need that list to know when the build configuration may have
+changed.  Start() records the SConscript files on SCons' SConscript call
+stack, and from then on every SConscript file pushed onto that stack.  Tool
+files are loaded as SConscript files, so they are recorded too.  SConscript
+files which were read and finished before Start() are not recorded, so
+recording should start from the SConstruct file, before reading any
+SConscript files.
+
+Nothing is recorded unless Start() is called.  It is started when this
+module is imported by eol_scons, if ninja is set in the command-line
+ARGUMENTS or the EOL_SCONS_INPUTS environment variable names a file, so
+every SConscript file read after the SConstruct is recorded.  The ninja
+tool also calls it when the ninja variable is set some other way.  When
+EOL_SCONS_INPUTS is set, each path is also appended to that file as it is
+recorded, so that another process, like the scons_server.py build server,
+can watch the SConscript files.  When scons then enters interactive mode,
+the alias names are appended to that file too, as lines of the form
+'alias NAME', so the server can tell aliases from file targets.
+"""
+
+import os
+
+import SCons.Node
+import SCons.Node.Alias
+import SCons.Script
+import SCons.Script.Interactive
+from SCons.Script import ARGUMENTS
+
+# Absolute paths of the SConscript files read, in the order they were read.
+_sconscripts = []
+
+
+def _record(path):
+    path = os.path.abspath(path)
+    if path not in _sconscripts:
+        _sconscripts.append(path)
+        inputs = os.environ.get('EOL_SCONS_INPUTS')
+        if inputs:
+            with open(inputs, "a") as fp:
+                fp.write(path + "\n")
+
+
+def _record_frame(frame):
+    "Record the SConscript file of a frame on the SConscript call stack."
+    node = frame.sconscript
+    if node is None:
+        return
+    if not node.rexists() and node.srcnode().rexists():
+        node = node.srcnode()
+    _record(node.rfile().get_abspath())
+
+
+class _CallStack(list):
+    """
+    Replaces SCons' list of SConscript frames, to record each SConscript
+    file as its frame is pushed.  The frame is created before it is pushed,
+    so this does not get between SConscript() and its caller when the
+    exports are looked up in the caller's namespace.
+    """
+
+    def append(self, frame):
+        list.append(self, frame)
+        _record_frame(frame)
+
+
+def Start():
+    "Start recording the SConscript files read."
+    sconscript = SCons.Script._SConscript
+    if isinstance(sconscript.call_stack, _CallStack):
+        return
+    stack = _CallStack(sconscript.call_stack)
+    for frame in stack:
+        _record_frame(frame)
+    sconscript.call_stack = stack
+    SCons.Script.call_stack = stack
+
+
+def GetSConscripts():
+    "Return the absolute paths of the SConscript files read so far."
+    return _sconscripts[:]
+
+
+def _report_aliases(interact):
+    "Wrap SCons' interactive loop to report the aliases before it starts."
+    def wrapper(*args, **kw):
+        inputs = os.environ.get('EOL_SCONS_INPUTS')
+        if inputs:
+            with open(inputs, "a") as fp:
+                for name in sorted(SCons.Node.Alias.default_ans.keys()):
+                    fp.write("alias %s\n" % name)
+        return interact(*args, **kw)
+    return wrapper
+
+
+if os.environ.get('EOL_SCONS_INPUTS') or ARGUMENTS.get('ninja'):
+    Start()
+
+if os.environ.get('EOL_SCONS_INPUTS'):
+    SCons.Script.Interactive.interact = _report_aliases(
+        SCons.Script.Interactive.interact)
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test sconscripts.py
+
+def test_sconscript_exports(tmpdir):
+    import sys
+    import subprocess
+    tmpdir.join('SConstruct').write(
+        "import eol_scons\n"
+        "env = Environment(tools=['default'])\n"
+        "x = 1\n"
+        "SConscript('src/SConscript', exports='env x')\n"
+        "Environment(tools=['default', 'ninja']).NinjaCheck()\n")
+    tmpdir.mkdir('src').join('SConscript').write(
+        "Import('env', 'x')\n"
+        "env.Command('out.txt', [], 'echo %d > $TARGET' % x)\n")
+    pkgdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    scons = os.path.dirname(os.path.dirname(os.path.abspath(
+        SCons.__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([pkgdir, scons])
+    cmd = [sys.executable, '-c', 'import SCons.Script; SCons.Script.main()',
+           '-Q', 'ninja=build.ninja', 'src/out.txt']
+    child = subprocess.Popen(cmd, cwd=str(tmpdir), env=env,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT)
+    output = child.communicate()[0].decode('utf-8', 'replace')
+    assert child.returncode == 0, output
+    # The ninja tool is applied after the SConscript files are read, but
+    # they are still inputs to the regenerate rule, along with the
+    # directory of the missing config.py.
+    regenerate = [line for line in tmpdir.join('build.ninja').readlines()
+                  if line.startswith('build build.ninja:')][0].split()
+    assert 'SConstruct' in regenerate
+    assert 'src/SConscript' in regenerate
+    assert str(tmpdir) in regenerate
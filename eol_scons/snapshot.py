@@ -0,0 +1,640 @@
+# -*- python -*-
+# Copyright 2007 UCAR, NCAR, All Rights Reserved
+
+"""
+Snapshot the construction variables set by tools and restore them in later
+scons runs instead of applying the tools again.
+
+When enabled with eolsconssnapshot=1, each application of a tool by
+eol_scons.Tool() is recorded as the set of construction variables it
+changed in the Environment.  The recording is saved in env_snapshots.cache
+in the top directory, keyed by:
+
+ - the tool name and a hash of the source file which defines it,
+ - a fingerprint of the Environment construction variables before the tool
+   was applied, and
+ - a fingerprint of the inputs to the whole run: the command-line
+   ARGUMENTS and the variables config files.
+
+While a tool is recorded, os.environ is replaced by a stand-in which
+records the process environment variables the tool reads, including the
+variables which are missing, and the variable names if the tool iterates
+over them.  Likewise any config script queries the tool makes, through
+RunConfig(), CheckConfig(), ParseConfig() and the like, record the stamps
+of the config script and the pkg-config search directories, the same
+stamps used by the persistent config script cache in parseconfig.py.  A
+snapshot is only restored if all of those variables and stamps still
+match, so snapshots still match when unrelated variables like SHLVL or
+OLDPWD differ between shells, but a changed PKG_CONFIG_PATH, QTDIR, or
+newly installed package invalidates the snapshots which depend on it.
+
+In the next run, if a tool would be applied to an Environment with the same
+fingerprint, the recorded variables are restored directly, skipping the
+tool function and any config scripts or Configure checks it would run.
+The source files of any tools the tool applied in turn must also be
+unchanged.  The tools are still loaded, since tool_<name>.py files may
+define build targets, and they are entered in the applied tools ledger as
+if they had been applied.
+
+Only tools whose effect can be replayed exactly are recorded.  A recording
+is discarded if the tool adds or changes a value which cannot be
+serialized, such as a builder, a scanner, or a function, or if it adds
+methods to the Environment, exports symbols other than the tools it
+loads, adds global variables, or adds aliases, default targets, or clean
+targets.
+In practice that means tools which only set flags, paths, and libraries,
+like most tools which locate external packages, while compiler tools and
+tools which add builders are always applied.  Tools loaded with keyword
+parameters, tools exempted with eol_scons.AlwaysApply(), and tools listed
+with eol_scons.snapshot.NoSnapshot() are also always applied.
+
+Some effects of a tool function cannot be detected, and they would be
+skipped silently when the snapshot is restored: creating file targets
+with builders like Command() or Install(), and changing state outside the
+Environment, such as registering atexit functions or starting a trace.
+Tools which set or remove process environment variables are detected and
+not recorded.
+Tools which do those things must be listed with NoSnapshot(), which a
+tool module can do itself when it is imported, like the buildtimes tool:
+
+@code
+eol_scons.snapshot.NoSnapshot('buildtimes')
+@endcode
+
+The snapshots cannot know about changes to the system outside the inputs
+listed above, such as a newly installed library which would change the
+result of a Configure check, or a file a tool reads directly.  Remove env_snapshots.cache, or run with
+eolsconssnapshot=0, to apply the tools from scratch.
+"""
+
+from __future__ import print_function
+
+import os
+import json
+import atexit
+import hashlib
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+import SCons.Util
+import SCons.Environment
+import SCons.Node.FS
+import SCons.Node.Alias
+import SCons.Script
+from SCons.Script import ARGUMENTS
+from SCons.Script.SConscript import global_exports
+
+import eol_scons.parseconfig
+
+_enable_snapshots = False
+_snapshot_file = "#/env_snapshots.cache"
+_snapshots = None
+
+# Snapshots not used in this many runs are dropped when the file is saved.
+_max_unused_runs = 10
+
+# Names of tools which are never snapshot.
+_no_snapshot = set()
+
+# The recordings of the tools being applied, innermost last.  Tools can
+# apply other tools, so everything a tool reads is recorded for all of the
+# tools which are being applied.
+_watching = []
+
+# The ledger of applied tools is handled separately from the variables.
+_ledger_key = '_EOL_APPLIED_TOOLS'
+
+
+def EnableSnapshots(enable):
+    """
+    Enable or disable Environment snapshots.  This is called with the
+    setting of the eolsconssnapshot variable.
+    """
+    global _enable_snapshots
+    _enable_snapshots = bool(enable)
+
+
+def NoSnapshot(tools):
+    "Always apply the named tool or list of tools instead of restoring it."
+    if not isinstance(tools, type([])):
+        tools = [tools]
+    _no_snapshot.update(tools)
+
+
+class _WatchedEnviron(MutableMapping):
+    """
+    Stands in for os.environ while tools are being recorded, to record the
+    process environment variables they read in each of the recordings.
+    """
+
+    def __init__(self, environ):
+        self.environ = environ
+
+    def __getitem__(self, name):
+        value = self.environ.get(name)
+        for recording in _watching:
+            recording.environ.setdefault(name, value)
+        if value is None:
+            raise KeyError(name)
+        return value
+
+    def __setitem__(self, name, value):
+        for recording in _watching:
+            recording.environ_changed = True
+        self.environ[name] = value
+
+    def __delitem__(self, name):
+        for recording in _watching:
+            recording.environ_changed = True
+        del self.environ[name]
+
+    def __iter__(self):
+        names = sorted(self.environ.keys())
+        for recording in _watching:
+            recording.names = names
+        return iter(names)
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def copy(self):
+        return dict(self)
+
+
+def _target_counts():
+    "Count the targets a tool might add which are not in the Environment."
+    return (len(SCons.Node.Alias.default_ans),
+            len(SCons.Script.DEFAULT_TARGETS),
+            len(SCons.Environment.CleanTargets))
+
+
+class _Unencodable(Exception):
+    pass
+
+
+def _encode(value):
+    """
+    Convert a construction variable value to JSON which _decode() can
+    restore exactly, or raise _Unencodable.
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, SCons.Util.CLVar):
+        return {'__CLVar__': [_encode(v) for v in value]}
+    if SCons.Util.is_String(value):
+        if type(value) not in (type(''), type(u'')):
+            raise _Unencodable(type(value).__name__)
+        return value
+    if type(value) is list:
+        return [_encode(v) for v in value]
+    if type(value) is tuple:
+        return {'__tuple__': [_encode(v) for v in value]}
+    if type(value) is dict:
+        for k in value:
+            if not SCons.Util.is_String(k):
+                raise _Unencodable('dict key %r' % (k,))
+        return {'__dict__': dict([(k, _encode(v)) for k, v in value.items()])}
+    if isinstance(value, SCons.Node.FS.Dir):
+        return {'__Dir__': value.get_abspath()}
+    if isinstance(value, SCons.Node.FS.File):
+        return {'__File__': value.get_abspath()}
+    raise _Unencodable(type(value).__name__)
+
+
+def _decode(value, env):
+    if isinstance(value, list):
+        return [_decode(v, env) for v in value]
+    if not isinstance(value, dict):
+        return value
+    tag, content = list(value.items())[0]
+    if tag == '__CLVar__':
+        return SCons.Util.CLVar([_decode(v, env) for v in content])
+    if tag == '__tuple__':
+        return tuple([_decode(v, env) for v in content])
+    if tag == '__dict__':
+        return dict([(k, _decode(v, env)) for k, v in content.items()])
+    if tag == '__Dir__':
+        return env.Dir(content)
+    return env.File(content)
+
+
+def _describe(value):
+    """
+    Return a JSON description of @p value which is the same in every run
+    when the value is the same, even if the value cannot be encoded.
+    """
+    try:
+        return _encode(value)
+    except _Unencodable:
+        pass
+    if isinstance(value, (list, tuple)) or \
+       isinstance(value, SCons.Util.UserList):
+        return [_describe(v) for v in value]
+    if hasattr(value, 'keys') and hasattr(value, '__getitem__'):
+        return dict([(str(k), _describe(value[k])) for k in value.keys()])
+    name = getattr(value, '__name__', None) or type(value).__name__
+    return "<%s.%s>" % (getattr(value, '__module__', ''), name)
+
+
+def _digest(data):
+    text = json.dumps(data, sort_keys=True)
+    return hashlib.md5(text.encode('utf-8')).hexdigest()
+
+
+def _tool_source(tool):
+    "Return the path to the python file which defines @p tool, or None."
+    func = getattr(tool, 'generate', tool)
+    code = getattr(func, '__code__', None)
+    if code is None:
+        code = getattr(getattr(func, '__call__', None), '__code__', None)
+    if code is None or not os.path.isfile(code.co_filename):
+        return None
+    return os.path.abspath(code.co_filename)
+
+
+def _global_variable_count():
+    import eol_scons.variables
+    gv = eol_scons.variables._global_variables
+    return len(gv.options) if gv else 0
+
+
+class _Recording(object):
+    "The state of an Environment before a tool is applied."
+
+    def __init__(self, env, name, source, key):
+        self.name = name
+        self.source = source
+        self.key = key
+        self.values = dict([(k, (id(v), _describe(v)))
+                            for k, v in env.Dictionary().items()
+                            if k != _ledger_key])
+        self.tools = set(env.get(_ledger_key, {}))
+        self.attributes = dict([(k, id(v)) for k, v in env.__dict__.items()])
+        self.exports = set(global_exports)
+        self.variables = _global_variable_count()
+        self.targets = _target_counts()
+        # Process environment variables read, None if missing, the
+        # variable names if they were listed, and the config stamps.
+        self.environ = {}
+        self.names = None
+        self.environ_changed = False
+        self.stamps = {}
+
+
+class EnvironmentSnapshots(object):
+    """
+    The collection of tool snapshots read from and saved to the file at
+    @p path.
+    """
+
+    _version = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.run = 0
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self.dirty = False
+        self._hashes = {}
+        self._inputs = None
+        self.load()
+
+    def load(self):
+        self.entries = {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as fp:
+                data = json.load(fp)
+            if data.get('version') == self._version:
+                self.entries = data['entries']
+                self.run = data['run'] + 1
+        except (IOError, OSError, ValueError, KeyError):
+            print("Ignoring unreadable environment snapshots: %s" %
+                  (self.path))
+            self.entries = {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        entries = dict([(k, e) for k, e in self.entries.items()
+                        if e['run'] >= self.run - _max_unused_runs])
+        data = {'version': self._version, 'run': self.run,
+                'entries': entries}
+        tmppath = self.path + ".tmp"
+        try:
+            with open(tmppath, "w") as fp:
+                json.dump(data, fp)
+            os.rename(tmppath, self.path)
+            self.dirty = False
+        except (IOError, OSError) as ex:
+            print("Could not write environment snapshots %s: %s" %
+                  (self.path, ex))
+
+    def hashFile(self, path):
+        digest = self._hashes.get(path)
+        if digest is None:
+            try:
+                with open(path, "rb") as fp:
+                    digest = hashlib.md5(fp.read()).hexdigest()
+            except (IOError, OSError):
+                digest = "missing"
+            self._hashes[path] = digest
+        return digest
+
+    def inputs(self):
+        "Fingerprint the inputs which are the same for the whole run."
+        if self._inputs is None:
+            import eol_scons.variables
+            gv = eol_scons.variables._global_variables
+            files = gv and gv.files or []
+            self._inputs = _digest({
+                'arguments': dict(ARGUMENTS),
+                'files': [(f, self.hashFile(os.path.abspath(f)))
+                          for f in files]})
+        return self._inputs
+
+    def begin(self, env, name, tool):
+        """
+        Return a _Recording of the Environment before applying tool
+        @p name, or None if the tool cannot be snapshot.
+        """
+        if name in _no_snapshot:
+            return None
+        source = _tool_source(tool)
+        if not source:
+            return None
+        recording = _Recording(env, name, source, None)
+        recording.key = _digest([name, self.hashFile(source), self.inputs(),
+                                 sorted(recording.tools),
+                                 [(k, v[1]) for k, v in
+                                  sorted(recording.values.items())]])
+        return recording
+
+    def _matches(self, env, entry):
+        """
+        Return True if the tool sources, process environment variables,
+        and config stamps recorded in @p entry are unchanged.  They are
+        checked through os.environ and recorded, like anything else a tool
+        reads, if this tool is being restored while applying another tool.
+        """
+        for path, digest in entry['sources']:
+            if self.hashFile(path) != digest:
+                return False
+        for name, value in entry['environ'].items():
+            if os.environ.get(name) != value:
+                return False
+        if entry['names'] is not None and \
+           sorted(os.environ.keys()) != entry['names']:
+            return False
+        pcache = eol_scons.parseconfig.getStampCache(env)
+        for path, stamp in entry['stamps']:
+            if pcache.stamp(path) != stamp:
+                return False
+        for recording in _watching:
+            recording.stamps.update(dict(entry['stamps']))
+        return True
+
+    def restore(self, env, recording):
+        """
+        Restore the snapshot for the recording, if there is one and all
+        the inputs it depends on are unchanged, and return the list of
+        tools which it applied.  Otherwise return None.
+        """
+        entry = self.entries.get(recording.key)
+        if not entry or not self._matches(env, entry):
+            self.misses += 1
+            return None
+        for k, v in entry['set'].items():
+            env[k] = _decode(v, env)
+        for k in entry['del']:
+            if k in env:
+                del env[k]
+        if entry['run'] != self.run:
+            entry['run'] = self.run
+            self.dirty = True
+        self.hits += 1
+        return entry['tools']
+
+    def apply(self, env, recording, tool):
+        """
+        Apply @p tool to @p env, recording the process environment
+        variables and config scripts it reads, then store its changes with
+        finish().
+        """
+        if not _watching:
+            os.environ = _WatchedEnviron(os.environ)
+        _watching.append(recording)
+        eol_scons.parseconfig._config_watchers.append(recording.stamps)
+        try:
+            tool(env)
+        finally:
+            eol_scons.parseconfig._config_watchers.pop()
+            _watching.pop()
+            if not _watching:
+                os.environ = os.environ.environ
+        self.finish(env, recording)
+
+    def finish(self, env, recording):
+        """
+        Store the changes made to the Environment since @p recording, if
+        they can be restored exactly.
+        """
+        entry = self._changes(env, recording)
+        if entry is None:
+            self.rejected += 1
+            return
+        self.entries[recording.key] = entry
+        self.dirty = True
+
+    def _changes(self, env, recording):
+        if recording.environ_changed:
+            return None
+        if _global_variable_count() != recording.variables:
+            return None
+        if _target_counts() != recording.targets:
+            return None
+        attributes = dict([(k, id(v)) for k, v in env.__dict__.items()])
+        if attributes != recording.attributes:
+            return None
+        values = env.Dictionary()
+        changed = {}
+        for k, v in values.items():
+            if k == _ledger_key:
+                continue
+            before = recording.values.get(k)
+            if before and before[0] == id(v) and before[1] == _describe(v):
+                continue
+            try:
+                encoded = _encode(v)
+            except _Unencodable:
+                return None
+            if not before or before[1] != encoded:
+                changed[k] = encoded
+        removed = [k for k in recording.values if k not in values]
+        ledger = env.get(_ledger_key, {})
+        tools = sorted([t for t in ledger if t not in recording.tools])
+        # Loading a tool file exports the tool, and the tools applied in
+        # turn are loaded again when the snapshot is restored.
+        exports = set(global_exports) - recording.exports
+        if not exports.issubset(tools):
+            return None
+        sources = [(recording.source, self.hashFile(recording.source))]
+        for t in tools:
+            source = _tool_source(ledger[t])
+            if not source:
+                return None
+            sources.append((source, self.hashFile(source)))
+        return {'set': changed, 'del': removed, 'tools': tools,
+                'sources': sources, 'environ': recording.environ,
+                'names': recording.names,
+                'stamps': sorted(recording.stamps.items()),
+                'run': self.run}
+
+
+def _save_snapshots():
+    if _snapshots:
+        _snapshots.save()
+        print("Environment snapshots: %d restored, %d applied, "
+              "%d not restorable, %s" %
+              (_snapshots.hits, _snapshots.misses, _snapshots.rejected,
+               _snapshots.path))
+
+
+def GetSnapshots(env):
+    """
+    Return the EnvironmentSnapshots if they are enabled, otherwise None.
+    The snapshot file is loaded the first time it is needed and saved at
+    exit.
+    """
+    global _snapshots
+    if not _enable_snapshots:
+        return None
+    if _snapshots is None:
+        _snapshots = EnvironmentSnapshots(env.File(_snapshot_file)
+                                          .get_abspath())
+        atexit.register(_save_snapshots)
+    return _snapshots
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test snapshot.py
+
+def test_encode():
+    import SCons.Environment
+    env = SCons.Environment.Environment(tools=[])
+    values = [None, 1, 'a', ['a', 1], ('x', 'y'), {'A': ['1']},
+              SCons.Util.CLVar('-O2 -g'), env.Dir('/tmp'),
+              [env.File('/tmp/x.c')]]
+    for value in values:
+        encoded = json.loads(json.dumps(_encode(value)))
+        decoded = _decode(encoded, env)
+        assert decoded == value
+        assert type(decoded) is type(value)
+    for value in [env['BUILDERS'], _encode, object()]:
+        try:
+            _encode(value)
+            assert False
+        except _Unencodable:
+            pass
+    assert _describe([_encode]) == _describe([_encode])
+
+
+def test_snapshot(tmpdir):
+    import SCons.Environment
+
+    def pure(env):
+        env.Append(CPPDEFINES=['PURE'], CPPPATH=[env.Dir('/opt/pure')])
+        env['PURE_ROOT'] = '/opt/pure'
+
+    def impure(env):
+        env.Append(BUILDERS={'Impure': SCons.Builder.Builder(action='x')})
+
+    path = str(tmpdir.join('snapshots'))
+    snapshots = EnvironmentSnapshots(path)
+    env = SCons.Environment.Environment(tools=[])
+    recording = snapshots.begin(env, 'pure', pure)
+    assert snapshots.restore(env, recording) is None
+    pure(env)
+    snapshots.finish(env, recording)
+    recording = snapshots.begin(env, 'impure', impure)
+    impure(env)
+    snapshots.finish(env, recording)
+    assert snapshots.rejected == 1
+    snapshots.save()
+
+    snapshots = EnvironmentSnapshots(path)
+    env2 = SCons.Environment.Environment(tools=[])
+    recording = snapshots.begin(env2, 'pure', pure)
+    assert snapshots.restore(env2, recording) == []
+    assert env2['CPPDEFINES'] == ['PURE']
+    assert env2['CPPPATH'] == [env2.Dir('/opt/pure')]
+    assert env2['PURE_ROOT'] == '/opt/pure'
+    # A different starting Environment does not match.
+    env3 = SCons.Environment.Environment(tools=[], CPPDEFINES=['OTHER'])
+    recording = snapshots.begin(env3, 'pure', pure)
+    assert snapshots.restore(env3, recording) is None
+
+
+def test_snapshot_inputs(tmpdir):
+    import SCons.Environment
+    script = tmpdir.join('fake-config')
+    script.write("#! /bin/sh\necho -DFAKE\n")
+    script.chmod(0o755)
+
+    def reader(env):
+        env['FAKE_DIR'] = os.environ.get('SNAPSHOT_TEST_DIR', '/opt')
+        env['FAKE_FLAGS'] = eol_scons.parseconfig.RunConfig(env, str(script))
+
+    def setter(env):
+        os.environ['SNAPSHOT_TEST_SET'] = '1'
+
+    def alias(env):
+        env.Alias('snapshot_test_alias', [])
+
+    def new_env():
+        env = SCons.Environment.Environment(tools=[])
+        env.AddMethod(lambda env, msg: None, 'LogDebug')
+        return env
+
+    def restore():
+        env = new_env()
+        recording = snapshots.begin(env, 'reader', reader)
+        return snapshots.restore(env, recording) is not None and env
+
+    snapshots = EnvironmentSnapshots(str(tmpdir.join('snapshots')))
+    env = new_env()
+    recording = snapshots.begin(env, 'reader', reader)
+    snapshots.apply(env, recording, reader)
+    assert not isinstance(os.environ, _WatchedEnviron)
+    entry = snapshots.entries[recording.key]
+    assert entry['environ'] == {'SNAPSHOT_TEST_DIR': None}
+    assert str(script) in dict(entry['stamps'])
+    assert restore()['FAKE_FLAGS'] == '-DFAKE'
+    # Variables the tool did not read do not matter, the ones it did do.
+    os.environ['SNAPSHOT_TEST_OTHER'] = '1'
+    try:
+        assert restore()
+        os.environ['SNAPSHOT_TEST_DIR'] = '/usr/local'
+        assert not restore()
+    finally:
+        del os.environ['SNAPSHOT_TEST_OTHER']
+        os.environ.pop('SNAPSHOT_TEST_DIR', None)
+    assert restore()
+    # So does a change to the config script.
+    script.write("#! /bin/sh\necho -DFAKE -DCHANGED\n")
+    eol_scons.parseconfig._stamp_cache._stamps.clear()
+    assert not restore()
+
+    for tool in [setter, alias]:
+        env = new_env()
+        recording = snapshots.begin(env, tool.__name__, tool)
+        snapshots.apply(env, recording, tool)
+    os.environ.pop('SNAPSHOT_TEST_SET', None)
+    assert snapshots.rejected == 2
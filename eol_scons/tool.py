@@ -8,7 +8,6 @@ functionality which applies the eol_scons extensions as if it were a tool.
 """
 
 import os
-import re
 import SCons.Tool
 from SCons.Script.SConscript import global_exports
 
@@ -25,10 +24,20 @@ import eol_scons.library
 import eol_scons.methods
 import eol_scons.variables as esv
 import eol_scons.debug as esd
+import eol_scons.toolindex as toolindex
+import eol_scons.profiler as profiler
+import eol_scons.snapshot
 
-_tool_matches = None
+# Map tool names to the list of tool_<name>.py files which define them.
+_tool_files = None
 _global_tools = {}
 
+# Incremented whenever a key is added to _global_tools.
+_global_tools_generation = 0
+
+# Map a global tools key to the (stamp, tools) of its last resolution.
+_resolved_global_tools = {}
+
 def _setup_global_tools(env):
     """
     Make sure the global tools list exists for this Environment.  Generate
@@ -40,10 +49,57 @@ def _setup_global_tools(env):
         gkey = env.Dir('.').get_abspath()
         env['GLOBAL_TOOLS_KEY'] = gkey
     if gkey not in _global_tools:
+        global _global_tools_generation
         _global_tools[gkey] = []
+        _global_tools_generation += 1
     return gkey
 
 
+def _parent_keys(gkey):
+    """
+    Return the keys of the global tool lists which apply to directory key
+    @p gkey, parent directories first, ending with @p gkey itself.
+    """
+    keys = []
+    path = gkey
+    while True:
+        if path in _global_tools:
+            keys.append(path)
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    keys.reverse()
+    return keys
+
+
+def _resolve_global_tools(gkey):
+    """
+    Return the ordered list of global tools for directory key @p gkey,
+    without duplicates, from the global tool lists of the directory and
+    all its parents.  The result is cached until a global tools key is
+    added or the contents of one of the lists it came from change, so
+    resolving the tools for each new Environment does not need to merge
+    the lists again.  The lists are compared by content since GlobalTools()
+    returns them to callers who may change them in place.
+    """
+    keys = _parent_keys(gkey)
+    stamp = (_global_tools_generation,
+             tuple([tuple(_global_tools[k]) for k in keys]))
+    resolved = _resolved_global_tools.get(gkey)
+    if resolved and resolved[0] == stamp:
+        return resolved[1]
+    gtools = []
+    seen = set()
+    for k in keys:
+        for t in _global_tools[k]:
+            if t not in seen:
+                seen.add(t)
+                gtools.append(t)
+    _resolved_global_tools[gkey] = (stamp, gtools)
+    return gtools
+
+
 def _apply_global_tools(env):
     """
     The global tools are keyed by directory path, so they are only applied
@@ -61,18 +117,16 @@ def _apply_global_tools(env):
         newtools = env['GLOBAL_TOOLS']
         env.LogDebug("Adding global tools @ %s: %s" % (gkey, str(newtools)))
         _global_tools[gkey].extend(newtools)
-    # Now find every global tool list for parents of this directory.  Sort
-    # them so that parent directories will appear before subdirectories.
-    dirs = [k for k in _global_tools if gkey.startswith(k)]
-    dirs.sort()
-    gtools = []
-    for k in dirs:
-        for t in _global_tools[k]:
-            if t not in gtools:
-                gtools.append(t)
+    # Now find every global tool list for parents of this directory, with
+    # parent directories before subdirectories.  Tools already applied to
+    # this Environment, such as when it was cloned from an Environment with
+    # the same global tools, are skipped.
+    gtools = [t for t in _resolve_global_tools(gkey)
+              if not (SCons.Util.is_String(t) and _isApplied(env, t))]
     env.LogDebug("Applying global tools @ %s: %s" %
                  (gkey, ",".join([str(x) for x in gtools])))
-    env.Require(gtools)
+    with profiler.Timer('global_tools', 'Require', env):
+        env.Require(gtools)
 
 
 def _GlobalTools(env):
@@ -105,48 +159,69 @@ def _RequireGlobal(env, tools):
     return env.Require(tools)
 
 
-def _findToolFile(env, name):
-    global _tool_matches
-    # Need to know if the cache is enabled or not.
+def _searchToolFiles(env):
+    "Return the list of all tool_*.py files under the top directory."
+    # Need to know if the cache and the index are enabled or not.
     esv._update_variables(env)
+    if toolindex.ToolIndexEnabled():
+        # The index checks the tree for changes itself, so it is used
+        # instead of the tools.cache setting.
+        return toolindex.FindToolFiles(
+            env.Dir('#').get_abspath(),
+            env.File(toolindex._tool_index_file).get_abspath())
+
     cache = esv.ToolCacheVariables(env)
     toolcache = cache.getPath()
-    if _tool_matches is None:
-        cvalue = cache.lookup(env, '_tool_matches')
-        if cvalue:
-            _tool_matches = cvalue.split("\n")
-            print("Using %d cached tool filenames from %s" % 
-                  (len(_tool_matches), toolcache))
-
-    if _tool_matches is None:
-        print("Searching for tool_*.py files...")
-        # Get a list of all files named "tool_<tool>.py" under the
-        # top directory.
-        toolpattern = re.compile(r"^tool_.*\.py")
-        _tool_matches = []
-        for dirpath, dirnames, filenames in os.walk(env.Dir('#').get_abspath(),
-                                                    followlinks=True):
-            hidden = [d for d in dirnames if d.startswith('.')]
-            for d in hidden:
-                dirnames.remove(d)
-            if 'site_scons' in dirnames:
-                dirnames.remove('site_scons')
-            if 'apidocs' in dirnames:
-                dirnames.remove('apidocs')
-            _tool_matches.extend([os.path.join(dirpath, fname)
-                                  for fname in filenames if
-                                  toolpattern.match(fname)])
-        # Update the cache
-        cache.store(env, '_tool_matches', "\n".join(_tool_matches))
-        if toolcache:
-            cachemsg = "cached in %s." % (toolcache)
-        else:
-            cachemsg = "caching is disabled."
-        print("Found %d tool files, %s" %
-              (len(_tool_matches), cachemsg))
-
-    toolfilename = "tool_" + name + ".py"
-    return [f for f in _tool_matches if toolfilename == os.path.basename(f)]
+    cvalue = cache.lookup(env, '_tool_matches')
+    if cvalue:
+        tool_matches = cvalue.split("\n")
+        print("Using %d cached tool filenames from %s" % 
+              (len(tool_matches), toolcache))
+        return tool_matches
+
+    print("Searching for tool_*.py files...")
+    # Get a list of all files named "tool_<tool>.py" under the
+    # top directory.
+    index = toolindex.ToolFileIndex(env.Dir('#').get_abspath())
+    tool_matches = index.scan()
+    # Update the cache
+    cache.store(env, '_tool_matches', "\n".join(tool_matches))
+    if toolcache:
+        cachemsg = "cached in %s." % (toolcache)
+    else:
+        cachemsg = "caching is disabled."
+    print("Found %d tool files, %s" %
+          (len(tool_matches), cachemsg))
+    return tool_matches
+
+
+def _mapToolFiles(tool_matches):
+    """
+    Map each tool name to the list of tool_<name>.py files which define it,
+    in the order they were found, and warn about any tool defined by more
+    than one file.
+    """
+    tool_files = {}
+    for path in tool_matches:
+        fname = os.path.basename(path)
+        if fname.startswith("tool_") and fname.endswith(".py"):
+            tool_files.setdefault(fname[5:-3], []).append(path)
+    for name in sorted(tool_files):
+        if len(tool_files[name]) > 1:
+            print("Warning: multiple tool files for " + name + ": " +
+                  str(tool_files[name]) + ", using the first one")
+    return tool_files
+
+
+def _findToolFile(env, name):
+    """
+    Return the list of tool_<name>.py files for tool @p name.  The tree is
+    only searched the first time a tool file is needed.
+    """
+    global _tool_files
+    if _tool_files is None:
+        _tool_files = _mapToolFiles(_searchToolFiles(env))
+    return _tool_files.get(name, [])
 
 # Keep a stack of tools as they are loaded, since loading a tool may trigger
 # other tools to be loaded, and we need to catch cyclic dependencies where a
@@ -176,15 +251,13 @@ def _loadToolFile(env, name):
         # search will continue, another scons tool might be found and
         # applied instead.  Most likely scons will exit with a tool error.
         return None
-    # If we got more than one match, complain...
-    if len(matchlist) > 1:
-        print("Warning: multiple tool files for " + name + ": " +
-              str(matchlist) + ", using the first one")
-    # Load the first match
+    # Load the first match.  Multiple matches were reported when the tool
+    # files were found.
     toolscript = matchlist[0]
     env.LogDebug("Loading %s to get tool %s..." % (toolscript, name))
     _tool_stack.append(name)
-    env.SConscript(toolscript)
+    with profiler.Timer('load', toolscript, env):
+        env.SConscript(toolscript)
     _tool_stack.pop()
     # After loading the script, make sure the tool appeared in the global
     # exports list.
@@ -209,11 +282,112 @@ def _loadToolFile(env, name):
 # they are still cached in the tool dictionary as before.
 _tool_dict = {}
 
+# Names of tools which must be applied every time they are required, even
+# if already applied to the Environment.  See AlwaysApply().
+_always_apply = set()
+
+# Set from the eolsconsapplyonce variable.  If False, the default, the
+# ledger is still kept but tools are always applied.
+_apply_once = False
+
+def EnableApplyOnce(enable):
+    global _apply_once
+    _apply_once = bool(enable)
+
+
+def _isApplied(env, name):
+    "Return True if tool @p name does not need to be applied again."
+    return _apply_once and name not in _always_apply and \
+        name in _AppliedTools(env)
+
+
+def AlwaysApply(tools):
+    """
+    Exempt the named tool or list of tools from the applied tools ledger,
+    so they are applied every time they are required in an Environment.
+    Use this for tools which are not idempotent on purpose, such as a tool
+    which moves its libraries to the end of LIBS each time it is applied.
+    """
+    if not isinstance(tools, type([])):
+        tools = [tools]
+    _always_apply.update(tools)
+
+
+def _AppliedTools(env):
+    """
+    Return the ledger of tools applied to this Environment, mapping the
+    tool name to the tool.  The ledger is a construction variable, so a
+    cloned Environment starts with a copy of the ledger of its parent.
+    """
+    applied = env.get('_EOL_APPLIED_TOOLS')
+    if applied is None:
+        applied = {}
+        env['_EOL_APPLIED_TOOLS'] = applied
+    return applied
+
+
 def _Tool(env, tool, toolpath=None, **kw):
+    # Tools named by a string are only applied once to each Environment,
+    # unless keywords specialize the tool or the tool is exempt.
+    name = None
+    if SCons.Util.is_String(tool):
+        name = env.subst(tool)
+        if not kw and _isApplied(env, name):
+            env.LogDebug("Tool %s already applied" % (name))
+            return _AppliedTools(env)[name]
+    with profiler.Timer('tool', tool, env):
+        tool = _apply_tool(env, tool, toolpath, **kw)
+    if name is not None:
+        _AppliedTools(env)[name] = tool
+    return tool
+
+
+def _apply_tool(env, tool, toolpath=None, **kw):
     env.LogDebug("eol_scons.Tool(%s,%s,kw=%s)" % (env.Dir('.'), tool, str(kw)))
-    name = str(tool)
-    env.LogDebug("...before applying tool %s: %s" % (name, esd.Watches(env)))
+    env.LogDebug("...before applying tool %s: %s" % (tool, esd.Watches(env)))
+    by_name = SCons.Util.is_String(tool)
+    name, tool = _resolve_tool(env, tool, toolpath, **kw)
 
+    env.LogDebug("Applying tool %s" % name)
+    _tool_stack.append("applying-%s" % (name))
+    # Restore the effect of applying the tool from a snapshot if possible,
+    # otherwise apply it and try to snapshot the result.
+    snapshots = eol_scons.snapshot.GetSnapshots(env)
+    recording = None
+    applied = None
+    if snapshots and by_name and not kw and name not in _always_apply:
+        recording = snapshots.begin(env, name, tool)
+    if recording:
+        applied = snapshots.restore(env, recording)
+    if applied is not None:
+        env.LogDebug("Restored tool %s from snapshot" % name)
+        for t in applied:
+            _AppliedTools(env)[t] = _resolve_tool(env, t)[1]
+    elif recording:
+        snapshots.apply(env, recording, tool)
+    else:
+        tool(env)
+    _tool_stack.pop()
+    env.LogDebug("...after applying tool %s: %s" % (name, esd.Watches(env)))
+    # We could regenerate the help text after each tool is loaded,
+    # presuming that only tools add variables, but that would not catch
+    # variables which are added after the last tool is loaded, as well as
+    # being a lot of extra calls.  So this works to a point, and it would
+    # still allow the help text to be customized at the end of the
+    # SConstruct file.  However, it is left unused in favor of adding a
+    # simple SetHelp() call at the end of SConstruct.
+    #
+    # env.SetHelp()
+    #
+    return tool
+
+
+def _resolve_tool(env, tool, toolpath=None, **kw):
+    """
+    Find the tool to apply for @p tool, loading it if necessary, and
+    return the tuple (name, tool).
+    """
+    name = str(tool)
     if SCons.Util.is_String(tool):
         name = env.subst(tool)
         tool = None
@@ -267,23 +441,7 @@ def _Tool(env, tool, toolpath=None, **kw):
             elif kw:
                 env.LogDebug("Tool %s not cached because it has "
                              "keyword parameters." % (name))
-
-    env.LogDebug("Applying tool %s" % name)
-    _tool_stack.append("applying-%s" % (name))
-    tool(env)
-    _tool_stack.pop()
-    env.LogDebug("...after applying tool %s: %s" % (name, esd.Watches(env)))
-    # We could regenerate the help text after each tool is loaded,
-    # presuming that only tools add variables, but that would not catch
-    # variables which are added after the last tool is loaded, as well as
-    # being a lot of extra calls.  So this works to a point, and it would
-    # still allow the help text to be customized at the end of the
-    # SConstruct file.  However, it is left unused in favor of adding a
-    # simple SetHelp() call at the end of SConstruct.
-    #
-    # env.SetHelp()
-    #
-    return tool
+    return (name, tool)
 
 
 def _Require(env, tools):
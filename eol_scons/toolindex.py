@@ -0,0 +1,254 @@
+# -*- python -*-
+# Copyright 2007 UCAR, NCAR, All Rights Reserved
+
+"""
+Incremental index of the tool_*.py files in a source tree.
+
+eol_scons finds tool files by searching the whole source tree for files
+named tool_<name>.py.  In a large checkout, especially one with data
+directories, listing every directory can take seconds.  The ToolFileIndex
+records, for every directory it searches, the directory modification time,
+the subdirectories to search, and the tool files found there.  The next
+time the tree is searched, a directory whose modification time has not
+changed is not listed again, since adding, removing, or renaming a file or
+subdirectory always changes the modification time of the directory
+containing it.  So each search costs one stat() per directory, and only
+the directories which changed are listed again.
+
+The index is kept in a sidecar file, tools.index in the top directory, and
+it is only written when the set of directories or tool files changes.  A
+directory modified within the last few seconds of a search is not trusted
+to be unchanged the next time, since file systems with coarse timestamps
+could then miss a change made in the same tick.
+
+Directories are searched in the same way as before: symbolic links are
+followed, and hidden directories, site_scons, and apidocs are skipped.
+The index can be disabled with eolsconstoolindex=0, in which case the tree
+is searched without saving an index.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import json
+import time
+
+_enable_tool_index = True
+_tool_index_file = "#/tools.index"
+
+_toolpattern = re.compile(r"^tool_.*\.py")
+
+# Directories modified more recently than this many seconds before a
+# search are listed again on the next search.
+_racy_seconds = 2
+
+
+def EnableToolIndex(enable):
+    """
+    Enable or disable the tool file index sidecar.  This is called with the
+    setting of the eolsconstoolindex variable.
+    """
+    global _enable_tool_index
+    _enable_tool_index = bool(enable)
+
+
+def ToolIndexEnabled():
+    return _enable_tool_index
+
+
+def _skip_dir(name):
+    return name.startswith('.') or name in ['site_scons', 'apidocs']
+
+
+def _listdir(path):
+    """
+    Return the sorted lists of subdirectory names to search and tool file
+    names in directory @p path.  Links to directories are followed.
+    """
+    subdirs = []
+    tools = []
+    for name in os.listdir(path):
+        if os.path.isdir(os.path.join(path, name)):
+            if not _skip_dir(name):
+                subdirs.append(name)
+        elif _toolpattern.match(name):
+            tools.append(name)
+    subdirs.sort()
+    tools.sort()
+    return subdirs, tools
+
+
+class ToolFileIndex(object):
+    """
+    Index the tool files under directory @p topdir, saved in the file at
+    @p path, or not saved at all if @p path is None.
+    """
+
+    _version = 1
+
+    def __init__(self, topdir, path=None):
+        self.topdir = topdir
+        self.path = path
+        # Map directory path, relative to topdir, to the list
+        # [mtime, subdirs, tools].
+        self.dirs = {}
+        self.dirty = False
+        self.scanned = 0
+        self.load()
+
+    def load(self):
+        self.dirs = {}
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as fp:
+                data = json.load(fp)
+            if data.get('version') == self._version and \
+               data.get('topdir') == self.topdir:
+                self.dirs = data['dirs']
+        except (IOError, OSError, ValueError, KeyError):
+            print("Ignoring unreadable tool index: %s" % (self.path))
+            self.dirs = {}
+
+    def save(self):
+        if not self.path or not self.dirty:
+            return
+        data = {'version': self._version, 'topdir': self.topdir,
+                'dirs': self.dirs}
+        tmppath = self.path + ".tmp"
+        try:
+            with open(tmppath, "w") as fp:
+                json.dump(data, fp)
+            os.rename(tmppath, self.path)
+            self.dirty = False
+        except (IOError, OSError) as ex:
+            print("Could not write tool index %s: %s" % (self.path, ex))
+
+    def scan(self):
+        """
+        Return the list of tool file paths under the top directory, listing
+        only the directories which changed since the last scan.  Parent
+        directories come before their subdirectories, as with os.walk().
+        """
+        now = time.time()
+        found = []
+        dirs = {}
+        visited = set()
+        self.scanned = 0
+        stack = ['']
+        while stack:
+            rdir = stack.pop()
+            path = os.path.join(self.topdir, rdir) if rdir else self.topdir
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            # Do not follow a link back into a directory already searched.
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            entry = self.dirs.get(rdir)
+            if entry and entry[0] is not None and entry[0] == st.st_mtime:
+                subdirs, tools = entry[1], entry[2]
+            else:
+                try:
+                    subdirs, tools = _listdir(path)
+                except OSError:
+                    continue
+                self.scanned += 1
+                if not entry or entry[1] != subdirs or entry[2] != tools:
+                    self.dirty = True
+            mtime = st.st_mtime
+            if mtime >= now - _racy_seconds:
+                mtime = None
+            elif entry and entry[0] is None:
+                # Save the modification time now that it can be trusted.
+                self.dirty = True
+            dirs[rdir] = [mtime, subdirs, tools]
+            found.extend([os.path.join(path, t) for t in tools])
+            stack.extend([os.path.join(rdir, d) for d in reversed(subdirs)])
+        if set(dirs) != set(self.dirs):
+            self.dirty = True
+        self.dirs = dirs
+        return found
+
+
+def FindToolFiles(topdir, path=None):
+    """
+    Return the list of tool file paths under @p topdir, using and updating
+    the index saved at @p path.  If @p path is None, the tree is searched
+    without saving an index.
+    """
+    index = ToolFileIndex(topdir, path)
+    tools = index.scan()
+    index.save()
+    print("Found %d tool files, %d of %d directories searched%s." %
+          (len(tools), index.scanned, len(index.dirs),
+           path and ", indexed in %s" % (path) or ""))
+    return tools
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test toolindex.py
+
+def _age_tree(top):
+    "Move recent modification times in the tree safely into the past."
+    past = time.time() - 100
+    for dirpath, dirnames, filenames in os.walk(top):
+        if os.stat(dirpath).st_mtime > past:
+            os.utime(dirpath, (past, past))
+
+
+def test_tool_index(tmpdir):
+    top = str(tmpdir.mkdir('top'))
+    tmpdir.join('top', 'tool_a.py').write('')
+    tmpdir.join('top', 'sub', 'tool_b.py').write('', ensure=True)
+    tmpdir.join('top', 'sub', 'other.py').write('')
+    tmpdir.join('top', '.hidden', 'tool_c.py').write('', ensure=True)
+    tmpdir.join('top', 'site_scons', 'tool_d.py').write('', ensure=True)
+    _age_tree(top)
+    path = str(tmpdir.join('tools.index'))
+
+    index = ToolFileIndex(top, path)
+    assert index.scan() == [os.path.join(top, 'tool_a.py'),
+                            os.path.join(top, 'sub', 'tool_b.py')]
+    assert index.scanned == 2
+    index.save()
+    assert os.path.exists(path)
+
+    # Nothing changed, so nothing is listed again.
+    index = ToolFileIndex(top, path)
+    assert len(index.scan()) == 2
+    assert index.scanned == 0
+    assert not index.dirty
+
+    # Moving a tool file changes both directories.
+    os.rename(os.path.join(top, 'sub', 'tool_b.py'),
+              os.path.join(top, 'tool_b.py'))
+    _age_tree(top)
+    index = ToolFileIndex(top, path)
+    assert index.scan() == [os.path.join(top, 'tool_a.py'),
+                            os.path.join(top, 'tool_b.py')]
+    assert index.scanned == 2
+    assert index.dirty
+    index.save()
+
+    # A new subdirectory with a tool is found.
+    tmpdir.join('top', 'new', 'deep', 'tool_e.py').write('', ensure=True)
+    _age_tree(top)
+    index = ToolFileIndex(top, path)
+    assert index.scan()[-1] == os.path.join(top, 'new', 'deep', 'tool_e.py')
+    assert index.scanned == 3
+
+
+def test_tool_index_recent(tmpdir):
+    # A directory just modified is always listed again.
+    top = str(tmpdir)
+    tmpdir.join('tool_a.py').write('')
+    index = ToolFileIndex(top)
+    assert len(index.scan()) == 1
+    assert index.dirs[''][0] is None
+    assert len(index.scan()) == 1
+    assert index.scanned == 1
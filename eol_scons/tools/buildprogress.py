@@ -0,0 +1,264 @@
+"""
+Show a single progress line during the build instead of the command lines,
+with an estimate of the time remaining based on the build times recorded
+in earlier builds by the buildtimes tool.
+
+Require the 'buildprogress' tool and pass buildprogress=1 on the command
+line to enable it.  The progress line looks like this:
+
+  [ 1234/5678 checked, 321 built] 2:15 elapsed, about 4:30 left: libfoo.a
+
+When the build starts, the file targets under the targets being built are
+counted.  As scons checks each one, its recorded time from buildtimes.json
+is subtracted from the work remaining.  Not every target will need to be
+rebuilt, so the remaining work is scaled by the fraction of the targets
+checked so far which did need to be rebuilt, and then divided by the
+number of parallel jobs (-j).  Run with buildtimes=1 also to keep the
+recorded times up to date.
+
+Command lines are replaced by setting PRINT_CMD_LINE_FUNC in the
+Environment, so only Environments with this tool applied show progress;
+add it to the global tools to use it for the whole tree.  Output from the
+commands themselves, like compiler warnings, is still printed.  When the
+output is not a terminal, the progress line is printed at most every 10
+seconds instead of being redrawn in place.
+"""
+
+from __future__ import print_function
+
+import sys
+import time
+import atexit
+import threading
+import collections
+
+import SCons.Node.Alias
+import SCons.Node.FS
+import SCons.Script
+from SCons.Variables import BoolVariable
+
+import eol_scons.buildtimes as bt
+import eol_scons.snapshot
+
+# generate() installs the Progress() hook, which restoring a snapshot
+# would skip.
+eol_scons.snapshot.NoSnapshot('buildprogress')
+
+variables = None
+
+_progress = None
+
+
+def _format_time(seconds):
+    seconds = int(seconds + 0.5)
+    if seconds >= 3600:
+        return "%d:%02d:%02d" % (seconds // 3600, seconds // 60 % 60,
+                                 seconds % 60)
+    return "%d:%02d" % (seconds // 60, seconds % 60)
+
+
+class BuildProgress(object):
+    """
+    Keep count of the targets checked and built, and estimate the time
+    left from the recorded durations of the targets not yet checked.
+    """
+
+    def __init__(self, durations, jobs, stream=None, tty=None):
+        self.durations = durations
+        self.default = 0.0
+        if durations:
+            self.default = sum(durations.values()) / len(durations)
+        self.jobs = max(1, jobs)
+        self.stream = stream or sys.stdout
+        if tty is None:
+            tty = self.stream.isatty()
+        self.tty = tty
+        self.interval = 0.1 if tty else 10.0
+        self.lock = threading.Lock()
+        self.candidates = None
+        self.remaining = 0.0
+        self.checked = set()
+        self.built = set()
+        self.built_checked = 0
+        self.current = ''
+        self.start = None
+        self.shown = 0
+        self.width = 0
+
+    def setTargets(self, names):
+        "Set the names of the targets which may need to be built."
+        self.candidates = set(names)
+        self.remaining = sum([self.durations.get(n, self.default)
+                              for n in self.candidates])
+
+    def nodeChecked(self, name):
+        if name in self.candidates and name not in self.checked:
+            self.checked.add(name)
+            self.remaining -= self.durations.get(name, self.default)
+
+    def nodeBuilt(self, name):
+        if name not in self.built:
+            self.built.add(name)
+            if name in self.checked:
+                self.built_checked += 1
+        self.current = name
+
+    def estimate(self):
+        "Return the estimated seconds left in the build."
+        ratio = 1.0
+        if self.checked:
+            ratio = float(self.built_checked) / len(self.checked)
+        return max(0.0, self.remaining) * ratio / self.jobs
+
+    def status(self, now):
+        elapsed = now - self.start
+        line = ("[%5d/%d checked, %d built] %s elapsed" %
+                (len(self.checked), len(self.candidates), len(self.built),
+                 _format_time(elapsed)))
+        if self.durations:
+            line += ", about %s left" % _format_time(self.estimate())
+        if self.current:
+            line += ": " + self.current
+        return line
+
+    def show(self, force=False):
+        now = time.time()
+        if self.start is None:
+            self.start = now
+        if not force and now - self.shown < self.interval:
+            return
+        self.shown = now
+        line = self.status(now)
+        if self.tty:
+            # Keep the line within the terminal width, assumed 80.
+            line = line[:79]
+            self.stream.write("\r" + line + " " * (self.width - len(line)))
+            self.width = len(line)
+        else:
+            self.stream.write(line + "\n")
+        self.stream.flush()
+
+    def finish(self):
+        if self.start is not None:
+            self.show(True)
+            if self.tty:
+                self.stream.write("\n")
+                self.stream.flush()
+
+    def __call__(self, node):
+        "Called by the scons Progress() hook for each node checked."
+        with self.lock:
+            if self.candidates is None:
+                self.setTargets([str(n) for n in _build_nodes()])
+            self.nodeChecked(str(node))
+            self.show()
+
+    def printCommand(self, s, target, source, env):
+        "Replace printing each command line with a progress update."
+        with self.lock:
+            if self.candidates is None:
+                # Not building yet, so print commands like env.Execute().
+                sys.stdout.write(s + "\n")
+                return
+            if target:
+                self.nodeBuilt(str(target[0]))
+            self.show()
+
+
+def _build_nodes():
+    """
+    Return the file nodes with builders under the targets being built.
+    Only directories are scanned for children, since scanning sources for
+    implicit dependencies is better left to the build itself.
+    """
+    fs = SCons.Node.FS.get_default_fs()
+    roots = []
+    for target in SCons.Script.BUILD_TARGETS or ['.']:
+        if not isinstance(target, SCons.Node.Node):
+            node = SCons.Node.Alias.default_ans.lookup(target)
+            if node is None:
+                node = fs.Entry(target)
+            target = node
+        roots.append(target)
+    visited = set(roots)
+    pending = collections.deque(roots)
+    nodes = []
+    while pending:
+        node = pending.popleft()
+        isdir = isinstance(node, SCons.Node.FS.Dir)
+        # Targets which do not exist yet may still be Entry nodes.
+        if isinstance(node, SCons.Node.FS.Base) and not isdir and \
+           node.has_builder():
+            nodes.append(node)
+        for kid in node.children(scan=isdir):
+            if kid not in visited:
+                visited.add(kid)
+                pending.append(kid)
+    return nodes
+
+
+def _start(env):
+    global _progress
+    if _progress is None:
+        path = env.File('#/' + bt._db_file).get_abspath()
+        durations = bt.LoadBuildTimes(path)['targets']
+        _progress = BuildProgress(durations,
+                                  SCons.Script.GetOption('num_jobs') or 1)
+        SCons.Script.Progress(_progress)
+        atexit.register(_progress.finish)
+    env['PRINT_CMD_LINE_FUNC'] = _progress.printCommand
+
+
+def generate(env):
+    global variables
+    if variables is None:
+        variables = env.GlobalVariables()
+        variables.AddVariables(BoolVariable(
+            'buildprogress',
+            'Show a progress line with the estimated time left instead of '
+            'the command lines.',
+            False))
+    variables.Update(env)
+    if env['buildprogress']:
+        _start(env)
+
+
+def exists(env):
+    return True
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test buildprogress.py
+
+class _Stream(object):
+    def __init__(self):
+        self.text = ""
+
+    def write(self, text):
+        self.text += text
+
+    def flush(self):
+        pass
+
+
+def test_build_progress():
+    durations = {'a.o': 4.0, 'b.o': 2.0, 'prog': 1.0, 'old.o': 9.0}
+    stream = _Stream()
+    progress = BuildProgress(durations, 2, stream, False)
+    progress.setTargets(['a.o', 'b.o', 'c.o', 'prog'])
+    # c.o has not been built before, so it counts as the average, 4s.
+    assert progress.remaining == 11.0
+    assert progress.estimate() == 5.5
+    progress.nodeChecked('a.o')
+    progress.nodeBuilt('a.o')
+    progress.nodeChecked('b.o')
+    # Half the targets checked needed to be built.
+    assert progress.estimate() == 5.0 * 0.5 / 2
+    progress.start = 100.0
+    assert progress.status(175.0) == ("[    2/4 checked, 1 built] 1:15 "
+                                      "elapsed, about 0:01 left: a.o")
+    progress.show(True)
+    progress.finish()
+    assert stream.text.count("\n") == 2
+    assert _format_time(3725) == "1:02:05"
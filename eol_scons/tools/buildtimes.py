@@ -0,0 +1,52 @@
+"""
+Record how long each target takes to build, and report the slowest targets
+and the critical path at the end of each build.
+
+Require the 'buildtimes' tool and pass buildtimes=1 on the command line to
+enable it.  The duration of every action is kept across builds in
+buildtimes.json in the top directory, and the report compares each build
+with the previous one.  See eol_scons/buildtimes.py.
+"""
+
+import atexit
+
+from SCons.Variables import BoolVariable
+
+import eol_scons.actiontrace as at
+import eol_scons.buildtimes as bt
+import eol_scons.snapshot
+
+# generate() starts the trace and the report at exit, which restoring a
+# snapshot would skip.
+eol_scons.snapshot.NoSnapshot('buildtimes')
+
+variables = None
+
+_db_path = None
+
+
+def _start(path):
+    global _db_path
+    if _db_path is not None:
+        return
+    _db_path = path
+    at.StartTrace()
+    atexit.register(bt.Report, path)
+
+
+def generate(env):
+    global variables
+    if variables is None:
+        variables = env.GlobalVariables()
+        variables.AddVariables(BoolVariable(
+            'buildtimes',
+            'Record the time to build each target in %s and report the '
+            'slowest targets and the critical path.' % (bt._db_file),
+            False))
+    variables.Update(env)
+    if env['buildtimes']:
+        _start(env.File('#/' + bt._db_file).get_abspath())
+
+
+def exists(env):
+    return True
@@ -8,25 +8,122 @@ incorporated as a standard eol_scons tool.
 Just require the 'dump_trace' tool, then pass dump_trace=1 on the command
 line to print all the commands that would be run to build all the targets,
 whether updated or not, without actually running any commands.
+
+To trace a real build instead, pass dump_trace_json=<file>.  Every action
+executed is recorded with its targets, start and end times, and exit
+status, along with each command it spawns and that command's CPU time and
+peak resident memory, see eol_scons/actiontrace.py.  At exit the trace is
+written to the file in the Chrome trace event format, which can be loaded
+in chrome://tracing or https://ui.perfetto.dev.  Each scons job thread is shown as a separate
+row, so gaps in the rows show where the build lost parallelism.
 """
 
+import os
+import sys
+import json
+import atexit
+
 import SCons
+import eol_scons.actiontrace as at
+import eol_scons.snapshot
 from SCons.Variables import BoolVariable
 
+# generate() sets scons options and may start the trace, none of which is
+# kept in the Environment for a snapshot to restore.
+eol_scons.snapshot.NoSnapshot('dump_trace')
+
 variables = None
 
+# The trace file name, or None if no trace is being recorded.
+_trace_path = None
+
+
+def _trace_events(actions):
+    "Convert the action records to Chrome trace events."
+    pid = os.getpid()
+    events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': row,
+               'args': {'name': 'job %d' % row}}
+              for row in sorted(set([a['row'] for a in actions]))]
+    for action in actions:
+        name = action['targets'][0] if action['targets'] else 'action'
+        events.append({'name': name, 'cat': 'action', 'ph': 'X',
+                       'pid': pid, 'tid': action['row'],
+                       'ts': action['start'],
+                       'dur': action['end'] - action['start'],
+                       'args': {'targets': action['targets'],
+                                'status': action['status']}})
+        for command in action['commands']:
+            args = dict(command)
+            del args['start']
+            del args['end']
+            events.append({'name': command['command'].split(' ')[0],
+                           'cat': 'command', 'ph': 'X',
+                           'pid': pid, 'tid': action['row'],
+                           'ts': command['start'],
+                           'dur': command['end'] - command['start'],
+                           'args': args})
+    return events
+
+
+def _write_trace():
+    actions = at.GetActions()
+    events = _trace_events(actions)
+    tmp = _trace_path + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+    os.rename(tmp, _trace_path)
+    sys.stdout.write("Trace of %d actions written to %s\n" %
+                     (len(actions), _trace_path))
+
+
+def _start_trace(path):
+    global _trace_path
+    if _trace_path is not None:
+        return
+    _trace_path = path
+    at.StartTrace()
+    atexit.register(_write_trace)
+
+
 def generate(env):
     global variables
     if variables is None:
         variables = env.GlobalVariables()
         variables.AddVariables(BoolVariable(
             'dump_trace', 'Dump trace of commands in dryrun mode.', False))
+        variables.AddVariables(
+            ('dump_trace_json',
+             'Write a Chrome trace of the actions executed, with their '
+             'times and resource usage, to this file.', ''))
     variables.Update(env)
     if env['dump_trace']:
         env.SetOption('no_exec', True)
         env.Decider(lambda x, y, z: True)
         SCons.Node.Python.Value.changed_since_last_build = (lambda x, y, z: True)
+    elif env['dump_trace_json']:
+        _start_trace(env.File(env['dump_trace_json']).get_abspath())
 
 def exists(env):
     return True
 
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test dump_trace.py
+
+def test_trace_events():
+    actions = [{'targets': ['a.o'], 'row': 1, 'start': 10, 'end': 50,
+                'status': 0,
+                'commands': [{'command': 'gcc -c a.c', 'start': 15,
+                              'end': 45, 'status': 0, 'maxrss_kb': 100,
+                              'utime': 0.01, 'stime': 0.0}]},
+               {'targets': [], 'row': 2, 'start': 20, 'end': 30,
+                'status': 2, 'commands': []}]
+    events = _trace_events(actions)
+    assert [e['name'] for e in events] == ['thread_name', 'thread_name',
+                                           'a.o', 'gcc', 'action']
+    assert events[3]['ts'] == 15 and events[3]['dur'] == 30
+    assert events[3]['args'] == {'command': 'gcc -c a.c', 'status': 0,
+                                 'maxrss_kb': 100, 'utime': 0.01,
+                                 'stime': 0.0}
+    assert events[4]['args']['status'] == 2
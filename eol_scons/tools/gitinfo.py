@@ -50,6 +50,7 @@ from SCons.Node import FS
 from SCons.Node.Python import Value
 import SCons.Warnings
 from eol_scons.gitinfo import GitInfo
+import eol_scons.profiler
 
 # Set to 1 to enable debugging output
 _debug = 0
@@ -107,7 +108,8 @@ def _load_gitinfo(env, workdir):
     # Create a new GitInfo instance, for this workdir
     pdebug("_load_gitinfo(%s): creating gitinfo" % (workdir))
     ginfo = GitInfo(env, workdir)
-    _gitinfomap[workdir] = ginfo.getRepoInfo()
+    with eol_scons.profiler.Timer('vcs', 'gitinfo ' + workdir, env):
+        _gitinfomap[workdir] = ginfo.getRepoInfo()
 
     return ginfo
 
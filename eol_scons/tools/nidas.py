@@ -320,6 +320,12 @@ def generate(env):
     env.AppendUnique(DEPLOY_SHARED_LIBS=nidas_libs)
 
     if env['NIDAS_PATH'] == USE_PKG_CONFIG:
+        # Run the pkg-config queries concurrently, since they are all
+        # needed if nidas is found.
+        pc.PrefetchConfig(env, ['pkg-config nidas',
+                                'pkg-config --cflags --libs nidas',
+                                'pkg-config --libs-only-L nidas'])
+        pc.PrefetchPkgConfigPrefix(env, 'nidas')
         try:
             # env['ENV'] may have PKG_CONFIG_PATH
             exists = pc.CheckConfig(env, 'pkg-config nidas')
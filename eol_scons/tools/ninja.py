@@ -54,6 +54,19 @@ ninja -f all.ninja all
 ninja -f all.ninja aeros/aeros
 @endcode
 
+The ninja file includes a generator rule which runs scons again, with the
+same command-line arguments, whenever any of the SConstruct and SConscript
+files read, tool files, python modules loaded from eol_scons or the source
+tree, or variables config files change.  So ninja regenerates its own
+build file when needed before building anything else.  The SConscript
+files are recorded as they are read when ninja= is given on the command
+line, see eol_scons/sconscripts.py.  If ninja is set some other way, like
+in config.py, then only the SConscript files read after the ninja tool is
+applied are recorded, so apply the tool before reading the SConscript
+files in that case.  If a variables config file like config.py does not
+exist yet, its directory is an input instead, so creating it regenerates
+the ninja file, as does adding or removing any other file there.
+
 Note that ninja seems to build up its cache of which targets have been
 updated, seprate from scons, so the first ninja run may build everything
 even if a scons build wouldn't.  Eventually they converge so that both know
@@ -61,12 +74,49 @@ all targets are up to date and neither rebuilds any targets, although ninja
 is much faster at checking the dependencies, since they are "pre-computed"
 and included explicitly in a single file.
 
+Commands built from the common construction variables, like CCCOM,
+CXXCOM, LINKCOM, and ARCOM, are written as shared ninja rules, where the
+rule command is the substituted command with the target and sources
+replaced by $out and $in.  Targets built with the same flags share the
+same rule, so each build statement only names its rule and files.  This
+keeps the ninja file much smaller and faster for ninja to parse than a
+full command line for every target.  Other commands are written in full
+for each target.
+
+The same traversal can write a JSON compilation database of the C and C++
+compile commands, for tools like clang-tidy, cppcheck --project, and IDE
+indexers.  Set the compiledb variable to the path of the file, either
+with or without the ninja variable:
+
+@code
+scons compiledb=compile_commands.json
+@endcode
+
+When only compiledb is set, nothing is built.
+
+Link commands, doxygen commands, and commands which run valgrind are
+assigned to the ninja pools named link, doxygen, and valgrind, so ninja
+runs only a limited number of them at once, even with a high -j.  The
+pool depths are set with the ninja_link_pool, ninja_doxygen_pool, and
+ninja_valgrind_pool variables, where 0 means no limit.  By default the
+link and valgrind pools allow 2 GB and 1 GB respectively of the memory
+available when scons runs for each command, and only one doxygen command
+runs at a time.
+
+C and C++ compile commands run by gcc, clang, or a compatible compiler are
+written with a rule which adds -MMD -MF <object>.d to the command and tells
+ninja to read that depfile (deps = gcc).  So ninja tracks the header
+dependencies of each object itself, and adding or removing an #include
+does not require generating the ninja file again.  The headers found by
+the scons scanner are only listed in those rules if they are generated,
+as order-only dependencies so they are built before the compile.  Set
+ninja_depfile=0 to list all the scanned dependencies explicitly instead.
+
 Issues:
 
 It may be necessary to build the whole project first to make sure certain
 source and header files are generated, such as Qt uic and moc output files,
-since include dependencies on those files do not yet translate into the
-ninja dependencies.
+unless the scons scanner found the include dependencies on those files.
 
 Some eol_scons targets have complicated dependencies and use Value nodes
 and Actions which run python function.  For example, many test targets do
@@ -77,17 +127,19 @@ are extra dependencies which cause scons to build the documentation rather
 than just the Doxyfiles.  This is probably not a big disadvantage, since
 usually only the compile rules need to be run when doing interactive
 development, and ninja speeds up the edit/compile cycle by avoiding the
-scons startup time.  The developer must remember to re-run scons and
-re-generate the ninja build file as needed, such as whenever header
-dependencies or source file lists change, or when compiler flags need to
-change.
-
-Simple python function targets, like header files generated from the
-svninfo and gitinfo tools, and source files generated with the text2cc
-tool, work fine with ninja.  When generating a ninja file, SCons
-automatically builds those nodes (if they are dependencies of the
-command-line targets) to make sure they are updated.  Then the ninja rules
-have all they need to run.
+scons startup time.  When source file lists or compiler flags change in
+the SConscript files, ninja runs scons to generate the ninja file again.
+
+Some python function actions are translated into commands which run the
+standalone scripts/ninja_helper.py script, so ninja can build those
+targets without scons: installing files with Install(), symbolic links
+from the symlink tool, source files generated with the text2cc tool, and
+Diff() from the testing tool.  The function actions which only check
+things, like the Qt moc check, are left out.  Targets built by other
+python functions, like header files generated from the svninfo and
+gitinfo tools, are built by scons when the ninja file is generated (if
+they are dependencies of the command-line targets) to make sure they are
+updated.  Then the ninja rules have all they need to run.
 
 It should be possible to define an alias in a project's SConstruct file
 which contains all the aliases and targets which work with ninja, while
@@ -113,12 +165,27 @@ options.
 """
 
 import os
+import re
+import sys
+import json
+import shlex
+from collections import deque
 import SCons
-# from SCons.Variables import BoolVariable
+import SCons.Errors
+from SCons.Variables import BoolVariable
+import eol_scons.sconscripts
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
 # import eol_scons.scons_to_ninja as sn
 
 variables = None
 
+# Write depfile rules for C and C++ compiles, from the ninja_depfile variable.
+_depfile = True
+
 CustomCommandPrinter = None
 
 # This somewhat approximates the Entry inner function in
@@ -161,6 +228,12 @@ _ninja_header = """\
 rule cmd
   command = $cmd
 
+# C and C++ compiles which write a depfile of the headers they include.
+rule cc
+  command = $cmd
+  depfile = $out.d
+  deps = gcc
+
 """
 
 _ninja_alias = """
@@ -172,6 +245,76 @@ build %s: cmd %s
   cmd = %s
 """
 
+_ninja_cc = """
+build %s: cc %s%s
+  cmd = %s -MMD -MF %s.d
+"""
+
+_ninja_regenerate = """
+# Run scons to regenerate this file when the build configuration changes.
+rule regenerate
+  command = %s
+  description = Regenerating $out
+  generator = 1
+
+build %s: regenerate %s
+"""
+
+_ninja_rule = """
+rule %s
+  command = %s
+"""
+
+_ninja_depfile = """\
+  depfile = $out.d
+  deps = gcc
+"""
+
+_ninja_build = """
+build %s: %s %s%s%s
+"""
+
+_ninja_pool = """\
+  pool = %s
+"""
+
+_ninja_pool_depth = """\
+pool %s
+  depth = %d
+
+"""
+
+# The depth of each ninja pool, from the ninja_<pool>_pool variables, where
+# a depth of zero means the pool is not used.
+_pools = {}
+
+# The memory in MB which one link or valgrind command may use, to compute
+# the default pool depths from the available memory.
+_pool_memory = {'link': 2048, 'valgrind': 1024}
+
+# The command variables which are written as shared rules, and the prefix
+# for the names of the rules created from them.
+_rule_prefixes = {
+    'CCCOM': 'cc',
+    'SHCCCOM': 'shcc',
+    'CXXCOM': 'cxx',
+    'SHCXXCOM': 'shcxx',
+    'LINKCOM': 'link',
+    'SHLINKCOM': 'shlink',
+    'LDMODULECOM': 'ldmodule',
+    'ARCOM': 'ar',
+    'RANLIBCOM': 'ranlib',
+}
+
+# Source suffixes of C and C++ compile nodes.
+_compile_suffixes = ['.c', '.C', '.cc', '.cpp', '.cxx', '.c++', '.cp']
+
+# Compilers which can write gcc-style depfiles, possibly with a version
+# suffix like gcc-12, and possibly run through ccache.
+_depfile_compiler = re.compile(
+    r'^(ccache\s+)?(\S*/)?(gcc|g\+\+|cc|c\+\+|clang|clang\+\+|icc|icpc)'
+    r'(-[\d.]+)?\s')
+
 
 class NinjaNode(object):
     """
@@ -186,6 +329,7 @@ class NinjaNode(object):
     def __init__(self, node):
         self.node = node
         self.ntype = None
+        self.cmds = None
         self.assignType()
 
     def assignType(self):
@@ -224,9 +368,11 @@ class NinjaNode(object):
         # a conf node.
         return ".sconf_temp" in self.node.get_path()
 
-    def getRule(self):
+    def getRule(self, rules=None):
         """
         Create the ninja rule for this node by converting actions to strings.
+        If @p rules is a NinjaRules instance, then commands from the common
+        construction variables are written using shared rules.
         """
         node = self.node
         depnodes = node.all_children()
@@ -239,54 +385,475 @@ class NinjaNode(object):
 
         dest_path = node.get_path()
         deps = [GetRealNode(dep).get_path() for dep in depnodes]
-        executor = node.get_executor()
-        if executor is None:
-            print("ignoring node without executor: %s" % (str(node)))
+        cmds = self.getCommands()
+        if cmds is None:
+            print("ignoring node which ninja cannot build: %s" % (str(node)))
             return ""
-        actions = executor.get_action_list()
-        env = node.get_env()
-        from SCons.Subst import SUBST_RAW
-        cmds = [env.subst(cmd, 0, executor=executor)
-                for cmd in str(executor).splitlines()
-                if not cmd.startswith('_checkMocIncluded')]
-        return _ninja_cmd % (dest_path, ' '.join(deps), ' && '.join(cmds))
+        depfile = _depfile and self.isCompileNode(cmds) and \
+            bool(_depfile_compiler.match(cmds[0]))
+        names = self.getCommandVariables()
+        pool = self.getPool(names, cmds)
+        if rules is not None:
+            rule = self.getSharedRule(rules, dest_path, cmds, depfile,
+                                      names, pool)
+            if rule:
+                return rule
+        if depfile:
+            rule = self.getCompileRule(dest_path, cmds[0])
+        else:
+            rule = _ninja_cmd % (dest_path, ' '.join(deps), ' && '.join(cmds))
+        if pool:
+            rule += _ninja_pool % (pool)
+        return rule
 
+    def getCommands(self):
+        """
+        Return the list of substituted commands which build this node, or
+        None if the node has no executor or if it has a python function
+        action which cannot be run outside of scons.  The function actions
+        known to _helper_command() are run with the ninja_helper.py script.
+        """
+        if self.cmds is None:
+            executor = self.node.get_executor()
+            if executor is None:
+                return None
+            targets = executor.get_all_targets()
+            sources = executor.get_all_sources()
+            env = self.node.get_env()
+            cmds = []
+            for action in executor.get_action_list():
+                for act in getattr(action, 'list', [action]):
+                    if isinstance(act, SCons.Action.FunctionAction):
+                        cmd = _helper_command(act, targets, sources, env)
+                        if cmd is None:
+                            return None
+                        cmds.extend(cmd)
+                    else:
+                        text = act.genstring(targets, sources, env)
+                        cmds.extend([self.subst(cmd)
+                                     for cmd in text.splitlines()])
+            self.cmds = cmds
+        return self.cmds
+
+    def subst(self, string):
+        """
+        Substitute @p string for the targets and sources of this node.  The
+        lists are passed explicitly, since substituting $SOURCES through the
+        executor takes time quadratic in the number of sources.
+        """
+        executor = self.node.get_executor()
+        return self.node.get_env().subst(
+            string, 0, target=executor.get_all_targets(),
+            source=executor.get_all_sources())
 
-def WriteFile(dest_file, node_list):
-    dest_temp = '%s.tmp' % dest_file
-    ninja_fh = open(dest_temp, 'w')
-    ninja_fh.write(_ninja_header)
+    def isCompileNode(self, cmds):
+        """
+        Return true if this node compiles a single C or C++ source file
+        with a single command.
+        """
+        sources = self.node.sources
+        if len(cmds) != 1 or len(sources) != 1:
+            return False
+        return os.path.splitext(str(sources[0]))[1] in _compile_suffixes
 
+    def getCompileRule(self, dest_path, cmd):
+        """
+        Compile rules leave the header dependencies to the depfile written by
+        the compiler, so ninja tracks them without regenerating the ninja
+        file.  Headers which are generated must still be built first, so
+        they are listed as order-only dependencies.  Other implicit
+        dependencies, like the compiler itself, are kept.
+        """
+        sources = [GetRealNode(dep).get_path() for dep in self.node.sources]
+        implicit, order_only = self.getDependencies(True)
+        if order_only:
+            order_only = ' || ' + ' '.join(order_only)
+        return _ninja_cc % (dest_path, ' '.join(sources + implicit),
+                            order_only or '', cmd, dest_path)
+
+    def getDependencies(self, depfile):
+        """
+        Return the lists of implicit and order-only dependency paths of this
+        node, meaning all the dependencies except the sources.  If
+        @p depfile is true, then the headers are left to the depfile,
+        except generated headers are order-only dependencies.
+        """
+        node = self.node
+        cppsuffixes = node.get_env().get('CPPSUFFIXES', [])
+        implicit = []
+        order_only = []
+        sources = set(node.sources)
+        sources.add(node)
+        for dep in node.all_children():
+            if dep in sources:
+                continue
+            if not depfile or \
+               os.path.splitext(str(dep))[1] not in cppsuffixes:
+                implicit.append(GetRealNode(dep).get_path())
+            elif dep.has_builder():
+                order_only.append(dep.get_path())
+        return implicit, order_only
+
+    def getCommandVariables(self):
+        """
+        Return the names of the construction variables, like CXXCOM, which
+        provide the actions of this node, with None for any action which is
+        not just a construction variable.
+        """
+        executor = self.node.get_executor()
+        targets = executor.get_all_targets()
+        sources = executor.get_all_sources()
+        names = []
+        for action in executor.get_action_list():
+            for act in getattr(action, 'list', [action]):
+                if not isinstance(act, SCons.Action.LazyAction) and \
+                   isinstance(act, SCons.Action.CommandGeneratorAction):
+                    act = act._generate(targets, sources, self.node.get_env(),
+                                        0)
+                names.append(getattr(act, 'var', None))
+        return names
+
+    def getPool(self, names, cmds):
+        """
+        Return the name of the ninja pool for this node, given the
+        construction variable @p names of its actions and its commands, or
+        None if the node does not belong in a pool.
+        """
+        pool = None
+        if set(names) & set(['LINKCOM', 'SHLINKCOM', 'LDMODULECOM']):
+            pool = 'link'
+        elif 'DOXYGEN_COM' in names:
+            pool = 'doxygen'
+        else:
+            valgrind = self.node.get_env().get('VALGRIND_PATH')
+            if valgrind and [cmd for cmd in cmds if valgrind in cmd]:
+                pool = 'valgrind'
+        if _pools.get(pool):
+            return pool
+        return None
+
+    def getSharedRule(self, rules, dest_path, cmds, depfile, names, pool):
+        """
+        Write the command for this node as a shared rule, where the command
+        is the same for every target built from the same construction
+        variable with the same flags, except for $out and $in.  This is
+        only possible if the command refers to the target and the sources
+        as whole words.  Return the build statement, preceded by the rule
+        if it is new, or None if the command cannot be shared.
+        """
+        executor = self.node.get_executor()
+        if not names or [name for name in names
+                         if name not in _rule_prefixes]:
+            return None
+        if len(executor.get_all_targets()) != 1:
+            return None
+        sources = self.subst('$SOURCES').split()
+        command = _template(' && '.join(cmds), dest_path, sources)
+        if command is None:
+            return None
+        if depfile:
+            command += ' -MMD -MF $out.d'
+        name, rule = rules.getRule(_rule_prefixes[names[0]], command,
+                                   depfile, pool)
+        implicit, order_only = self.getDependencies(depfile)
+        implicit = implicit and ' | ' + ' '.join(implicit) or ''
+        order_only = order_only and ' || ' + ' '.join(order_only) or ''
+        return rule + _ninja_build % (dest_path, name, ' '.join(sources),
+                                      implicit, order_only)
+
+
+# The script which runs python function actions as commands.
+_helper_script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'scripts', 'ninja_helper.py')
+
+# Function actions which only check things and can be left out of the
+# ninja commands.
+_skip_functions = ['_checkMocIncluded', 'SharedFlagChecker']
+
+
+def _helper(*args):
+    "Return the command line which runs the helper script with @p args."
+    return ' '.join([quote(str(arg))
+                     for arg in (sys.executable, _helper_script) + args])
+
+
+def _helper_command(action, targets, sources, env):
+    """
+    Return the list of commands which replace the python FunctionAction
+    @p action for the given targets and sources, or None if the function is
+    not known.
+    """
+    name = action.function_name()
+    if name in _skip_functions:
+        return []
+    if name == 'LibSymlinksActionFunction' and not env.get('SHLIBVERSION'):
+        # Only versioned libraries need symlinks.
+        return []
+    if name == 'installFunc':
+        install = env.get('INSTALL')
+        if getattr(install, '__name__', None) != 'copyFunc' or \
+           len(targets) != len(sources):
+            return None
+        return [_helper('install', s.get_path(), t.get_path())
+                for t, s in zip(targets, sources)]
+    if name == 'MakeSymLink':
+        return [_helper('symlink', sources[0].get_path(),
+                        targets[0].get_path())]
+    if name == '_embedded_text_builder':
+        return [_helper('text2cc', sources[0].get_path(),
+                        targets[0].get_path(),
+                        env['TEXT_DATA_VARIABLE_NAME'])]
+    if name == 'diff_files':
+        return [_helper('diff', sources[0].get_path(), sources[1].get_path())]
+    return None
+
+
+def _template(cmd, out, sources):
+    """
+    Replace the words of @p cmd which are the target path @p out with
+    $out, and the sequence of words which are the @p sources with $in.
+    Any other $ in the command is escaped for ninja.  Return None if either
+    the target or the sources do not appear in the command.
+    """
+    words = cmd.split(' ')
+    result = []
+    found_in = found_out = False
+    i = 0
+    while i < len(words):
+        if sources and words[i] == sources[0] and \
+           words[i:i+len(sources)] == sources:
+            result.append('$in')
+            found_in = True
+            i += len(sources)
+            continue
+        if words[i] == out:
+            result.append('$out')
+            found_out = True
+        else:
+            result.append(words[i].replace('$', '$$'))
+        i += 1
+    if not found_in or not found_out:
+        return None
+    return ' '.join(result)
+
+
+class NinjaRules(object):
+    """
+    Keep the shared rules written to a ninja file, so that each distinct
+    command is written as a rule only once.
+    """
+
+    def __init__(self):
+        self.rules = {}
+        self.counts = {}
+
+    def getRule(self, prefix, command, depfile, pool=None):
+        """
+        Return the name of the rule for @p command, and the rule
+        definition to write if the rule is new, otherwise an empty string.
+        """
+        key = (command, depfile, pool)
+        if key in self.rules:
+            return self.rules[key], ''
+        count = self.counts.get(prefix, 0) + 1
+        self.counts[prefix] = count
+        name = "%s_%d" % (prefix, count)
+        self.rules[key] = name
+        rule = _ninja_rule % (name, command)
+        if depfile:
+            rule += _ninja_depfile
+        if pool:
+            rule += _ninja_pool % (pool)
+        return name, rule
+
+
+def _escape_path(path):
+    "Escape a path for a ninja build statement."
+    return re.sub(r'([$ :])', r'$\1', path)
+
+
+def _scons_command():
+    """
+    Return the command which runs scons again with the same arguments,
+    without the options which change directory, since ninja runs in the
+    top directory.
+    """
+    args = []
+    skip = False
+    for arg in sys.argv[1:]:
+        if skip:
+            skip = False
+        elif arg in ['-C', '--directory']:
+            skip = True
+        elif arg.startswith('--directory=') or \
+             (arg.startswith('-C') and not arg.startswith('--')):
+            pass
+        elif arg not in ['-u', '-U', '-D', '--up', '--search-up']:
+            args.append(arg)
+    script = sys.argv[0]
+    if os.sep in script:
+        script = os.path.abspath(script)
+    return ' '.join([quote(arg) for arg in [sys.executable, script] + args])
+
+
+def _regenerate_inputs(env):
+    """
+    Return the files which, when changed, require the ninja file to be
+    generated again: the SConscript files read, including tool files, the
+    python modules loaded from eol_scons or the source tree, and the
+    variables config files.  A config file which does not exist yet is
+    replaced by its directory, which changes when the file is created.
+    """
+    topdir = env.Dir('#').get_abspath()
+    pkgdir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = eol_scons.sconscripts.GetSConscripts()
+    for path in [os.path.abspath(f) for f in variables.files]:
+        if not os.path.exists(path):
+            path = os.path.dirname(path)
+        paths.append(path)
+    for module in list(sys.modules.values()):
+        path = getattr(module, '__file__', None)
+        if not path:
+            continue
+        path = os.path.abspath(path)
+        if path.endswith('.pyc') or path.endswith('.pyo'):
+            path = path[:-1]
+        if path.startswith(pkgdir + os.sep) or \
+           path.startswith(topdir + os.sep):
+            paths.append(path)
+    inputs = set()
+    for path in paths:
+        if os.path.exists(path):
+            if path.startswith(topdir + os.sep):
+                path = os.path.relpath(path, topdir)
+            inputs.add(path)
+    return sorted(inputs)
+
+
+def GetRegenerateRule(env, dest_file):
+    """
+    Return the ninja rule which runs scons to regenerate @p dest_file when
+    any of its inputs change.
+    """
+    command = _scons_command().replace('$', '$$')
+    inputs = [_escape_path(path) for path in _regenerate_inputs(env)]
+    return _ninja_regenerate % (command, _escape_path(dest_file),
+                                ' '.join(inputs))
+
+
+class NinjaFile(object):
+    """
+    Write the rules for nodes to a ninja file as they are added.  The file
+    is written to a temporary path and only renamed to @p dest_file when
+    closed, so the result becomes visible atomically.
+    """
+
+    def __init__(self, dest_file):
+        self.dest_file = dest_file
+        self.dest_temp = '%s.tmp' % dest_file
+        self.rules = NinjaRules()
+        self.count = 0
+        self.ninja_fh = open(self.dest_temp, 'w')
+        self.ninja_fh.write(_ninja_header)
+        for pool in sorted(_pools):
+            if _pools[pool]:
+                self.ninja_fh.write(_ninja_pool_depth % (pool, _pools[pool]))
+
+    def addNode(self, nn):
+        "Write the rule for NinjaNode @p nn."
+        self.ninja_fh.write(nn.getRule(self.rules))
+        self.count += 1
+
+    def close(self, regenerate=None):
+        if regenerate:
+            self.ninja_fh.write(regenerate)
+        self.ninja_fh.close()
+        # Make the result file visible atomically.
+        os.rename(self.dest_temp, self.dest_file)
+        # The rename changes the directory, which may be an input of the
+        # regenerate rule, so make sure the ninja file is newer than it.
+        os.utime(self.dest_file, None)
+
+
+def WriteFile(dest_file, node_list, regenerate=None):
+    ninja_file = NinjaFile(dest_file)
     for node in node_list:
-        nn = NinjaNode(node)
-        ninja_fh.write(nn.getRule())
+        ninja_file.addNode(NinjaNode(node))
+    ninja_file.close(regenerate)
 
-    # Make the result file visible atomically.
-    os.rename(dest_temp, dest_file)
 
+class CompileDatabase(object):
+    """
+    Collect the C and C++ compile commands of the nodes added, and write
+    them as a JSON compilation database, such as compile_commands.json,
+    for tools like clang-tidy and IDE indexers.
+    """
 
-def SeparateNodes(env, targets, ninjanodes, sconsnodes):
+    def __init__(self, dest_file, directory):
+        self.dest_file = dest_file
+        self.directory = directory
+        self.entries = []
+
+    def addNode(self, nn):
+        "Add the compile command of NinjaNode @p nn, if it has one."
+        cmds = nn.getCommands()
+        if nn.getType() != NinjaNode.FILE or not cmds or \
+           not nn.isCompileNode(cmds):
+            return
+        self.entries.append({
+            'directory': self.directory,
+            'file': nn.subst('$SOURCE'),
+            'arguments': shlex.split(cmds[0]),
+            'output': nn.getNode().get_path()})
+
+    def write(self):
+        dest_temp = '%s.tmp' % self.dest_file
+        with open(dest_temp, 'w') as fp:
+            json.dump(self.entries, fp, indent=1)
+        os.rename(dest_temp, self.dest_file)
+        print("Wrote %d compile commands to %s." %
+              (len(self.entries), self.dest_file))
+
+
+# Print a progress message every time this many nodes have been traversed.
+_progress_interval = 10000
+
+
+def SeparateNodes(env, targets, ninjanodes, sconsnodes, ninja_file=None,
+                  compiledb=None):
     """
     Starting with the root targets, traverse the tree of dependency nodes
     separating them into filesystem nodes which can be built by ninja and
-    those which can only be built within scons.
-
-    Maybe this should be replaced with SCons.Node.Walker.
+    those which can only be built within scons.  Each node is visited once,
+    in breadth-first order.  If @p ninja_file is a NinjaFile, then the
+    rule for each ninja node is written to it as soon as the node is found.
+    Likewise the compile commands are added to @p compiledb, if it is a
+    CompileDatabase.
     """
-    tree = targets[:]
-    while tree:
-        node = tree[0]
-        del tree[0]
-        nn = NinjaNode(node)
-        if not node.has_builder() or node in ninjanodes or node in sconsnodes:
+    queue = deque(targets)
+    visited = set(targets)
+    visited.update(ninjanodes)
+    visited.update(sconsnodes)
+    count = 0
+    while queue:
+        node = queue.popleft()
+        if not node.has_builder():
             continue
-        depnodes = node.all_children()
-        tree.extend(depnodes)
+        count += 1
+        if count % _progress_interval == 0:
+            print("ninja: %d nodes traversed, %d for ninja, %d for scons, "
+                  "%d queued" % (count, len(ninjanodes), len(sconsnodes),
+                                 len(queue)))
+        for dep in node.all_children():
+            if dep not in visited:
+                visited.add(dep)
+                queue.append(dep)
+        nn = NinjaNode(node)
         # print("separating node %s with children: %s" %
-        #       (str(node), " ".join([str(n) for n in depnodes])))
+        #       (str(node), " ".join([str(n) for n in node.all_children()])))
         if nn.isAlias():
             # Explicitly add Aliases to ninja nodes; they will be handled
-            # specially in WriteFile()
+            # specially in NinjaNode.getRule()
             print("adding Alias node to ninja: %s" % (str(node)))
             ninjanodes.append(nn.getNode())
         elif nn.isDirectory():
@@ -299,18 +866,25 @@ def SeparateNodes(env, targets, ninjanodes, sconsnodes):
             
             # print("traversing Directory node: %s" % (str(node)))
             # ninjanodes.append(node)
-            pass
+            continue
         elif nn.isConfNode():
-            pass
+            continue
         elif nn.isValue():
             print("building Value node with scons: %s" % (str(node)))
             sconsnodes.append(node)
-        elif isinstance(node.builder.action, SCons.Action.FunctionAction):
-            print("building function node with scons: %s" % (str(node))) 
+            continue
+        elif nn.getCommands() is None:
+            print("building function node with scons: %s" % (str(node)))
             sconsnodes.append(node)
+            continue
         else:
             ninjanodes.append(node)
-    # print("SeparateNodes() finished.")
+        if ninja_file is not None:
+            ninja_file.addNode(nn)
+        if compiledb is not None:
+            compiledb.addNode(nn)
+    print("ninja: %d nodes traversed, %d for ninja, %d for scons." %
+          (count, len(ninjanodes), len(sconsnodes)))
     return ninjanodes, sconsnodes
 
 
@@ -320,34 +894,117 @@ def generate(env):
         variables = env.GlobalVariables()
         variables.AddVariables((
             'ninja', 'Write ninja build rules into the given file.', None))
+        variables.AddVariables((
+            'compiledb', 'Write a JSON compilation database of the C and '
+            'C++ compile commands into the given file.', None))
+        variables.AddVariables(
+            BoolVariable('ninja_depfile',
+                         'Let ninja track C and C++ header dependencies '
+                         'with compiler depfiles.', True))
+        variables.AddVariables(
+            ('ninja_link_pool',
+             'Maximum number of link commands ninja runs at once, or 0 for '
+             'no limit.  The default allows %d MB of the available memory '
+             'for each link.' % (_pool_memory['link']),
+             _default_depth('link')),
+            ('ninja_doxygen_pool',
+             'Maximum number of doxygen commands ninja runs at once, or 0 '
+             'for no limit.', _default_depth('doxygen')),
+            ('ninja_valgrind_pool',
+             'Maximum number of valgrind commands ninja runs at once, or 0 '
+             'for no limit.  The default allows %d MB of the available '
+             'memory for each command.' % (_pool_memory['valgrind']),
+             _default_depth('valgrind')))
+    variables.Update(env)
+    if env.get('ninja'):
+        # The SConscript files read are inputs to the regenerate rule.
+        eol_scons.sconscripts.Start()
     env.AddMethod(NinjaCheck)
 
 
+def _available_memory():
+    "Return the available memory in bytes, or None if it is not known."
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _default_depth(pool):
+    """
+    Return the default depth of @p pool, allowing the estimated memory
+    for each command in the available memory, or 0 if the available memory
+    is not known.
+    """
+    if pool not in _pool_memory:
+        return 1
+    memory = _available_memory()
+    if not memory:
+        return 0
+    return max(1, int(memory // (_pool_memory[pool] * 1024 * 1024)))
+
+
 def NinjaCheck(env):
+    global _depfile
     variables.Update(env)
     ninjapath = env.get('ninja')
-    if not ninjapath:
+    compiledbpath = env.get('compiledb')
+    _depfile = env.get('ninja_depfile', True)
+    if not ninjapath and not compiledbpath:
         return
+    for pool in ['link', 'doxygen', 'valgrind']:
+        try:
+            _pools[pool] = int(env.get('ninja_%s_pool' % (pool), 0))
+        except ValueError:
+            raise SCons.Errors.StopError(
+                "ninja_%s_pool must be an integer: %s" %
+                (pool, env.get('ninja_%s_pool' % (pool))))
 
     # Add the ninja build file as a clean target, so that 'scons -c
     # ninja=build.ninja .' does something reasonable.
-    env.Clean(ninjapath, ninjapath)
+    for path in [ninjapath, compiledbpath]:
+        if path:
+            env.Clean(path, path)
 
     # Unless actually building, we're done here.
     if env.GetOption('clean') or env.GetOption('help'):
         return
 
-    print("Generating ninja file (%s) instead of running commands..." %
-          (ninjapath))
-
     targets = SCons.Script.BUILD_TARGETS
     fs = SCons.Node.FS.get_default_fs()
     nodes = [_f for _f in [Entry(x, fs) for x in targets] if _f]
     # nodes = [_f for _f in map(fs.Entry, targets) if _f]
 
-    ninjanodes, sconsnodes = SeparateNodes(env, nodes, [], [])
-    SCons.Script.BUILD_TARGETS[:] = sconsnodes
-    WriteFile(ninjapath, ninjanodes)
+    ninja_file = None
+    if ninjapath:
+        print("Generating ninja file (%s) instead of running commands..." %
+              (ninjapath))
+        ninja_file = NinjaFile(ninjapath)
+    compiledb = None
+    if compiledbpath:
+        print("Generating compilation database (%s)..." % (compiledbpath))
+        compiledb = CompileDatabase(compiledbpath,
+                                    env.Dir('#').get_abspath())
+
+    ninjanodes, sconsnodes = SeparateNodes(env, nodes, [], [], ninja_file,
+                                           compiledb)
+    if compiledb:
+        compiledb.write()
+    if not ninja_file:
+        # Only the compilation database was requested, so build nothing.
+        SCons.Script.BUILD_TARGETS[:] = [env.File(compiledbpath)]
+        return
+    # With nothing for scons to build, target the ninja file itself so that
+    # scons still succeeds when run by the ninja regenerate rule.
+    SCons.Script.BUILD_TARGETS[:] = sconsnodes or [env.File(ninjapath)]
+    ninja_file.close(GetRegenerateRule(env, ninjapath))
 
   
 # def generate(env):
@@ -387,3 +1044,21 @@ def NinjaCheck(env):
 def exists(env):
     return True
 
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test ninja.py
+
+def test_template():
+    assert _template("gcc -o x.o -c -I. x.c", "x.o", ["x.c"]) == \
+        "gcc -o $out -c -I. $in"
+    assert _template("ar rc libx.a a.o b.o && ranlib libx.a", "libx.a",
+                     ["a.o", "b.o"]) == "ar rc $out $in && ranlib $out"
+    assert _template("echo $HOME -o x x.c", "x", ["x.c"]) == \
+        "echo $$HOME -o $out $in"
+    # The target is not a whole word, so the command cannot be shared.
+    assert _template("gcc -ox.o -c x.c", "x.o", ["x.c"]) is None
+    rules = NinjaRules()
+    assert rules.getRule('cc', 'gcc -c $in', False)[0] == 'cc_1'
+    assert rules.getRule('cc', 'gcc -c $in', False) == ('cc_1', '')
+    assert rules.getRule('cc', 'gcc -c $in', True)[0] == 'cc_2'
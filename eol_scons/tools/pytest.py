@@ -1,5 +1,6 @@
 
 import SCons.Warnings
+from SCons.Action import Action
 
 _options = None
 
@@ -38,10 +39,12 @@ def PythonTest(env, name, script, **kw):
 def PyTest(env, name, sources, **kw):
     """
     Run pytest, collecting tests from the source files.  To select only certain
-    tests, add the -k option to PYTESTARGS.
+    tests, add the -k option to PYTESTARGS.  The command runs in a LogAction
+    from the testing tool, so it can run in parallel with other tests and
+    use the test result cache.
     """
-    target = env.Command(name, sources,
-                         '${PYTEST} ${PYTESTARGS} ${SOURCES}', **kw)
+    action = env.LogAction([Action('${PYTEST} ${PYTESTARGS} ${SOURCES}')])
+    target = env.Command(name, sources, action, **kw)
     env.Alias(name, target)
     return target
 
@@ -68,6 +71,7 @@ def generate(env):
                      "Arguments for python test script, such as -q -v or -d",
                      "-v")
     _options.Update(env)
+    env.Require('testing')
     env.SetDefault(PYTHON='python')
     env.AddMethod(PythonTest, "PythonTest")
     env.AddMethod(PyDotTest, "PyDotTest")
@@ -538,12 +538,18 @@ def enable_modules(env, modules, debug=False):
         env.LogDebug("QT5DIR not set, cannot enable module.")
         return False
 
-    onefailed = False
     for module in modules:
         if module.startswith('Qt5') or module.startswith('Qt4'):
             raise SCons.Errors.StopError(
                 "Qt module names should not be qualified with "
                 "the version: %s" % (module))
+
+    if ((sys.platform.startswith("linux") or sys.platform == "msys") and
+            env['QT5DIR'] == USE_PKG_CONFIG):
+        prefetch_modules_linux(env, modules, debug)
+
+    onefailed = False
+    for module in modules:
         ok = False
         if sys.platform.startswith("linux") or sys.platform == "msys":
             ok = enable_module_linux(env, module, debug)
@@ -579,6 +585,23 @@ def replace_drive_specs(pathlist):
     return None
 
 
+def prefetch_modules_linux(env, modules, debug=False):
+    """
+    Start all the pkg-config queries which enable_module_linux() will need
+    for these modules, so they run concurrently instead of one at a time.
+    The commands must match those in enable_module_linux() exactly.
+    """
+    commands = ['pkg-config --silence-errors --variable=headerdir Qt5',
+                'pkg-config --variable=prefix Qt5Core']
+    for module in modules:
+        if debug:
+            module = module + "_debug"
+        modpackage = qualify_module_name(module)
+        commands.append('pkg-config --exists ' + modpackage)
+        commands.append('pkg-config --cflags --libs ' + modpackage)
+    pc.PrefetchConfig(env, commands)
+
+
 def enable_module_linux(env, module, debug=False):
     """
     On Linux, a Qt5 module is enabled either with the settings from
@@ -17,9 +17,14 @@ if env.Rerun():
 
 All the SConscript() calls would follow.
 
-Once the rerun commands succeed, then a full scons build is repeated to
-make sure all the dependencies are updated and the build continues past the
-failed commands.
+Each failed command is cached in scons_rerun_commands.pickle along with the
+process environment (ENV) and the directory it ran in.  When the cache
+exists, Rerun() runs the cached commands directly, in parallel according
+to the -j option, without building any nodes, and scons exits before any
+other SConscript files are read.  The commands which still fail stay in
+the cache for the next run.  Once all the cached commands succeed, then a
+full scons build is repeated to make sure all the dependencies are updated
+and the build continues past the failed commands.
 
 The intention is that it will be faster to iterate through compiles when
 fixing a source file.  Until the file compiles successfully, scons will
@@ -34,16 +39,27 @@ import os
 import sys
 import atexit
 import pickle
+import threading
+import subprocess
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 from SCons.Variables import BoolVariable
-from SCons.Script import SetOption
+from SCons.Script import GetOption
 from SCons.Script import GetBuildFailures
+import SCons.Util
 
 # Cache the scons command with all its arguments
 _scons_command = sys.argv[:]
 
 _last_command_path = None
 
+# The name of the cache before it was a binary pickle, removed if found.
+_old_command_file = "scons_rerun_commands.txt"
+
 _options = None
 
 def bf_to_str(bf):
@@ -61,25 +77,128 @@ def bf_to_str(bf):
     return 'unknown failure: ' + bf.errstr
 
 
+def _command_env(bf):
+    """
+    Return the ENV the failed command ran with, with list values joined
+    the way SCons joins them when it spawns a command.
+    """
+    if bf.executor:
+        env = bf.executor.get_build_env()
+    else:
+        env = bf.node.get_build_env()
+    penv = {}
+    for key, value in env['ENV'].items():
+        if SCons.Util.is_List(value):
+            value = os.pathsep.join([str(v) for v in value])
+        penv[str(key)] = str(value)
+    return penv
+
+
+def _command_dir(bf):
+    "Return the directory the failed command ran in."
+    chdir = getattr(bf.action, 'chdir', None)
+    if bf.executor:
+        chdir = getattr(bf.executor, 'builder_kw', {}).get('chdir', chdir)
+    if not chdir:
+        return os.getcwd()
+    if hasattr(chdir, 'get_abspath'):
+        return chdir.get_abspath()
+    if SCons.Util.is_String(chdir):
+        return os.path.abspath(chdir)
+    return bf.node.dir.get_abspath()
+
+
+def _failed_commands(failures):
+    "Convert build failures to the commands cached for rerunning them."
+    commands = []
+    for bf in failures:
+        # Failures without a node or a command, like unknown targets or
+        # python function actions, cannot be rerun.
+        if bf is None or not bf.node or not bf.command:
+            continue
+        command = bf.command
+        if SCons.Util.is_List(command):
+            command = " ".join([str(c) for c in command])
+        commands.append({'target': str(bf.node),
+                         'sources': [str(s) for s in bf.node.sources],
+                         'command': command,
+                         'env': _command_env(bf),
+                         'cwd': _command_dir(bf)})
+    return commands
+
+
+def _write_commands(commands):
+    tmp = _last_command_path + ".tmp"
+    with open(tmp, "wb") as lc:
+        pickle.dump(commands, lc, 2)
+    os.rename(tmp, _last_command_path)
+
+
+def _read_commands():
+    with open(_last_command_path, "rb") as lin:
+        return pickle.load(lin)
+
+
+def _run_commands(commands, jobs):
+    """
+    Run the cached commands with up to @p jobs at once, printing the
+    output of each command together once it finishes.  Return the
+    commands which failed, in their original order.
+    """
+    pending = queue.Queue()
+    for i, cmd in enumerate(commands):
+        pending.put((i, cmd))
+    lock = threading.Lock()
+    failed = {}
+
+    def worker():
+        while True:
+            try:
+                i, cmd = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                proc = subprocess.Popen(cmd['command'], shell=True,
+                                        env=cmd['env'], cwd=cmd['cwd'],
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+                output = proc.communicate()[0]
+                status = proc.returncode
+            except OSError as ex:
+                output = str(ex).encode() + b"\n"
+                status = 127
+            with lock:
+                print(cmd['command'])
+                sys.stdout.flush()
+                stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+                stdout.write(output)
+                stdout.flush()
+                if status != 0:
+                    print("Failed building %s: Error %s" %
+                          (cmd['target'], status))
+                    failed[i] = cmd
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(max(1, min(jobs, len(commands))))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [failed[i] for i in sorted(failed)]
+
+
 def build_status():
     """Convert the build status to a 2-tuple, (status, msg)."""
     bf = GetBuildFailures()
     failures_message = ''
     if bf:
-        # Cache the command for the first failed target.
-        nodes = []
         for x in bf:
             if x is None:
                 continue
-            sources = [ str(s) for s in x.node.sources ]
-            nodes.append((str(x.node), sources, x.command))
             failures_message += "Failed building %s\n" % bf_to_str(x)
-        # If the command cache already exists, then these build failures
-        # are from running those commands, so don't rewrite the cache file.
-        if not os.path.exists(_last_command_path):
-            lc = open(_last_command_path, "w")
-            pickle.dump(nodes, lc)
-            lc.close()
+        commands = _failed_commands(bf)
+        if commands:
+            _write_commands(commands)
             print("Failed commands cached: %s" % _last_command_path)
 	# bf is normally a list of build failures; if an element is None,
 	# it's because of a target that scons doesn't know anything about.
@@ -97,27 +216,40 @@ def display_build_status():
     if status == 'failed':
         print(failures_message)
     elif status == 'ok':
-        # If we succeeded, and there was a last command file, then we
-        # need to re-run the command without the last command file.
-        if os.path.exists(_last_command_path):
-            # lin = open(_last_command_path, "r")
-            # nodes = pickle.load(lin)
-            # lin.close()
-            # for n in nodes:
-            #     target = n[0] + ".rerun"
-            #     print("Renaming: %s -> %s" % (target, n[0]))
-            #     os.rename(target, n[0])
-            os.unlink(_last_command_path)
-            print("Last failed commands succeeded.\n" +
-                  "Re-running scons to complete the build...")
-            os.execv(_scons_command[0], _scons_command)
         print("Build succeeded.  No commands to rerun.")
 
 
+def rerun_commands():
+    """
+    Run the cached failed commands.  If any still fail, cache those and
+    exit.  Otherwise remove the cache and run the full scons build again.
+    """
+    commands = _read_commands()
+    jobs = GetOption('num_jobs') or 1
+    print("Rerunning %d failed commands with %d jobs..." %
+          (len(commands), min(jobs, len(commands))))
+    failed = _run_commands(commands, jobs)
+    if failed:
+        _write_commands(failed)
+        print("%d of %d commands still fail, cached in %s" %
+              (len(failed), len(commands), _last_command_path))
+        sys.stdout.flush()
+        # Skip the rest of the SConscript files and the build.
+        sys.exit(2)
+    os.unlink(_last_command_path)
+    print("Last failed commands succeeded.\n" +
+          "Re-running scons to complete the build...")
+    sys.stdout.flush()
+    os.execv(_scons_command[0], _scons_command)
+
+
 def Rerun(env):
     global _last_command_path
-    _last_command_path = env.File("#/scons_rerun_commands.txt").get_abspath()
+    _last_command_path = env.File("#/scons_rerun_commands.pickle").get_abspath()
     enabled = env.get('rerun')
+    old = env.File("#/" + _old_command_file).get_abspath()
+    if os.path.exists(old):
+        os.unlink(old)
     exists = os.path.exists(_last_command_path)
 
     # Check for last failed commands, and if found, just run those commands
@@ -127,22 +259,12 @@ def Rerun(env):
         os.unlink(_last_command_path)
         print("Removed rerun command cache.")
     elif exists:
-        print("Creating builder to rerun failed commands...")
-        # Ask SCons not to change or scan dependencies.
-        SetOption("implicit_cache", 1)
-        lin = open(_last_command_path, "r")
-        nodes = pickle.load(lin)
-        lin.close()
-        for n in nodes:
-            # Use a different name for the rerun target, so it doesn't
-            # interfere with the cached dependencies for the original
-            # target.
-            target = n[0] + ".rerun"
-            env.Command(target, None, " ".join(n[2]))
+        # Does not return.
+        rerun_commands()
 
     if enabled:
         atexit.register(display_build_status)
-    return enabled and exists
+    return False
 
 
 def generate(env):
@@ -161,3 +283,20 @@ def exists(env):
     return True
 
 
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test rerun.py
+
+def test_run_commands(tmpdir):
+    env = {'PATH': os.environ.get('PATH', ''), 'MESSAGE': 'hello'}
+    commands = [{'target': 'a', 'command': 'echo $MESSAGE > a.txt',
+                 'env': env, 'cwd': str(tmpdir)},
+                {'target': 'b', 'command': 'exit 3',
+                 'env': env, 'cwd': str(tmpdir)},
+                {'target': 'c', 'command': 'pwd > c.txt',
+                 'env': env, 'cwd': str(tmpdir)}]
+    failed = _run_commands(commands, 2)
+    assert [cmd['target'] for cmd in failed] == ['b']
+    assert tmpdir.join('a.txt').read() == 'hello\n'
+    assert os.path.samefile(tmpdir.join('c.txt').read().strip(),
+                            str(tmpdir))
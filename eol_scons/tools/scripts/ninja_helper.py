@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""
+Run the python function actions of some scons builders as commands, so the
+ninja tool can write ninja rules for those targets instead of leaving them
+to be built by scons.  This script does not import SCons, so it starts
+quickly.  Each command mirrors the function action it replaces:
+
+  install <source> <target>
+        Copy a file or directory like the SCons Install() builder, keeping
+        the permissions and making the copy writable.
+  symlink <source> <target>
+        Make target a symbolic link to the file name of source, like the
+        SymLink builder in the symlink tool.
+  text2cc <source> <target> <variable>
+        Embed the text of source in C++ code, like EmbedTextCC() in the
+        text2cc tool.
+  diff <source1> <source2>
+        Fail with a unified diff if the files differ, like the Diff builder
+        in the testing tool.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import stat
+import shutil
+import difflib
+
+
+def install(source, target):
+    if os.path.isdir(source):
+        if os.path.exists(target) and not os.path.isdir(target):
+            print("cannot overwrite non-directory '%s' with a directory '%s'" %
+                  (target, source), file=sys.stderr)
+            return 1
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        shutil.copytree(source, target, symlinks=True)
+        return 0
+    # Scons removes targets before building them, so do the same.
+    if os.path.lexists(target):
+        os.unlink(target)
+    shutil.copy2(source, target)
+    st = os.stat(source)
+    os.chmod(target, stat.S_IMODE(st[stat.ST_MODE]) | stat.S_IWRITE)
+    return 0
+
+
+def symlink(source, target):
+    if os.path.lexists(target):
+        os.unlink(target)
+    os.symlink(os.path.basename(source), target)
+    return 0
+
+
+def text2cc(source, target, variable):
+    # The text2cc tool module does not need SCons to be imported.
+    sys.path.insert(0, os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    import text2cc as t2c
+    with open(source, "rb") as infile:
+        text = infile.read()
+    if not isinstance(text, str):
+        text = text.decode('utf-8')
+    with open(target, "w") as outfile:
+        outfile.write(t2c.text2cc(text, variable))
+    return 0
+
+
+def diff(source1, source2):
+    with open(source1, "r") as f1:
+        lines1 = f1.readlines()
+    with open(source2, "r") as f2:
+        lines2 = f2.readlines()
+    diffs = list(difflib.unified_diff(lines1, lines2))
+    if diffs:
+        print("".join(diffs))
+        print("Differences found between %s and %s" % (source1, source2),
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+_commands = {
+    'install': (install, 2),
+    'symlink': (symlink, 2),
+    'text2cc': (text2cc, 3),
+    'diff': (diff, 2),
+}
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in _commands or \
+       len(argv) - 2 != _commands[argv[1]][1]:
+        print(__doc__, file=sys.stderr)
+        return 2
+    function = _commands[argv[1]][0]
+    return function(*argv[2:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test ninja_helper.py
+
+def test_ninja_helper(tmpdir):
+    src = tmpdir.join('a.txt')
+    src.write('first "line"\nsecond "line"\n')
+    src.chmod(0o444)
+    dest = str(tmpdir.join('b.txt'))
+    assert main(['', 'install', str(src), dest]) == 0
+    assert open(dest).read() == src.read()
+    assert os.stat(dest).st_mode & stat.S_IWRITE
+    # Installing again replaces the target.
+    assert main(['', 'install', str(src), dest]) == 0
+    link = str(tmpdir.join('c.txt'))
+    assert main(['', 'symlink', dest, link]) == 0
+    assert os.readlink(link) == 'b.txt'
+    assert main(['', 'symlink', dest, link]) == 0
+    code = str(tmpdir.join('a.txt.cc'))
+    assert main(['', 'text2cc', str(src), code, 'EXAMPLE']) == 0
+    assert open(code).read() == ('/***** DO NOT EDIT *****/\n'
+                                 'const char* EXAMPLE = \n'
+                                 '"first \\"line\\"\\n"\n'
+                                 '"second \\"line\\"\\n"\n"";\n')
+    assert main(['', 'diff', str(src), dest]) == 0
+    tmpdir.join('d.txt').write('first "line"\n')
+    assert main(['', 'diff', str(src), str(tmpdir.join('d.txt'))]) == 1
+    assert main(['', 'diff', str(src)]) == 2
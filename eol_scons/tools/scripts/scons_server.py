@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+"""
+Keep scons running with the SConscript files already read, so that
+repeated builds in the edit-compile loop do not wait for the SConscript
+files to be read again.  This script does not import SCons.
+
+  scons_server.py serve [--scons=COMMAND] [scons arguments ...]
+        Run 'scons --interactive' with the given arguments in the current
+        directory, which should be the top directory of the source tree, and
+        wait for build requests on the socket .scons_server.sock.  The scons
+        command defaults to 'scons'.  Stop the server with Ctrl-C or the
+        stop command.
+  scons_server.py build [targets ...]
+        Find the server socket in the current directory or one of its
+        parents, ask the server to build the targets, or the default targets
+        if none are given, and print the scons output.  The exit status is 0
+        if the build succeeded and 1 if it failed.
+  scons_server.py stop
+        Stop the server.
+
+SCons interactive mode already checks the dependency signatures of the
+targets on each build, so only the targets which are out of date get
+rebuilt.  What interactive mode cannot do is notice changes to the build
+configuration, so before each build the server checks the modification
+times of the SConstruct and SConscript files that scons read, the eol_scons
+python modules, and config.py.  If any of those changed, scons is restarted
+to read them all again.  The SConscript files and the alias names are
+learned through the EOL_SCONS_INPUTS environment variable, see
+eol_scons/sconscripts.py.  Targets given to the build command are relative
+to the client directory, except for aliases and names starting with '#'.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import shlex
+import socket
+import subprocess
+
+_socket_name = ".scons_server.sock"
+_inputs_name = ".scons_server.inputs"
+_prompt = b"scons>>> "
+_status = b"\0scons_server_status="
+
+
+def _find_socket(cwd):
+    "Search cwd and its parents for the server socket."
+    path = os.path.abspath(cwd)
+    while True:
+        if os.path.exists(os.path.join(path, _socket_name)):
+            return path
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def _target_paths(targets, cwd, top, aliases=()):
+    """
+    Scons runs in the top directory, so convert targets relative to the
+    client directory into paths relative to the top directory, whether or
+    not they exist yet.  Aliases and names starting with '#' are passed
+    unchanged.
+    """
+    result = []
+    for target in targets:
+        if cwd != top and not target.startswith('#') and \
+           target not in aliases:
+            target = os.path.relpath(os.path.join(cwd, target), top)
+        result.append(target)
+    return result
+
+
+def _build_failed(output):
+    "Return True if the scons output from a build reports an error."
+    for line in output.splitlines():
+        if line.startswith(b"scons: *** ") or \
+           line.startswith(b"scons: building terminated because of errors"):
+            return True
+    return False
+
+
+class _Watcher(object):
+    """
+    Remember the modification times of a set of files and report when any
+    of them change, appear or disappear.
+    """
+
+    def __init__(self, paths):
+        self.mtimes = dict([(p, self._mtime(p)) for p in set(paths)])
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def changed(self):
+        "Return the paths which changed."
+        return sorted([p for p, mtime in self.mtimes.items()
+                       if self._mtime(p) != mtime])
+
+
+def _eol_scons_modules():
+    "Return the python files of the eol_scons package."
+    package = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(package):
+        paths.extend([os.path.join(dirpath, f) for f in filenames
+                      if f.endswith('.py')])
+    return paths
+
+
+class SconsProcess(object):
+    "Run scons in interactive mode and pass build commands to it."
+
+    def __init__(self, command, top):
+        self.command = command
+        self.top = top
+        self.inputs = os.path.join(top, _inputs_name)
+        self.process = None
+        self.watcher = None
+        self.aliases = set()
+
+    def start(self, write):
+        open(self.inputs, "w").close()
+        env = dict(os.environ)
+        env['EOL_SCONS_INPUTS'] = self.inputs
+        env['PYTHONUNBUFFERED'] = '1'
+        self.process = subprocess.Popen(self.command + ['--interactive'],
+                                        cwd=self.top, env=env,
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        stderr=subprocess.STDOUT)
+        if not self._read_to_prompt(write):
+            self.stop()
+            return False
+        paths = []
+        self.aliases = set()
+        with open(self.inputs) as fp:
+            for line in fp:
+                line = line.strip()
+                if line.startswith('alias '):
+                    self.aliases.add(line[len('alias '):])
+                elif line:
+                    paths.append(line)
+        paths.extend(_eol_scons_modules())
+        paths.append(os.path.join(self.top, 'config.py'))
+        self.watcher = _Watcher(paths)
+        return True
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            try:
+                self.process.stdin.write(b"exit\n")
+                self.process.stdin.close()
+            except (IOError, OSError):
+                pass
+            self.process.wait()
+        self.process = None
+        self.watcher = None
+
+    def _read_to_prompt(self, write):
+        """
+        Pass the scons output to write() until scons prompts for the next
+        command.  Return False if scons exits instead.
+        """
+        fd = self.process.stdout.fileno()
+        keep = len(_prompt) - 1
+        pending = b""
+        while True:
+            data = os.read(fd, 65536)
+            if not data:
+                write(pending)
+                return False
+            pending += data
+            if pending.endswith(_prompt):
+                write(pending[:-len(_prompt)])
+                return True
+            if len(pending) > keep:
+                write(pending[:-keep])
+                pending = pending[-keep:]
+
+    def build(self, targets, write):
+        "Build the targets and return the exit status."
+        if self.process and self.watcher:
+            changed = self.watcher.changed()
+            if changed:
+                write(b"scons_server: restarting scons, changed: " +
+                      " ".join(changed[:5]).encode('utf-8') + b"\n")
+                self.stop()
+        if self.process is None and not self.start(write):
+            return 1
+        output = []
+
+        def collect(data):
+            output.append(data)
+            write(data)
+
+        command = " ".join(["build"] + targets) + "\n"
+        self.process.stdin.write(command.encode('utf-8'))
+        self.process.stdin.flush()
+        if not self._read_to_prompt(collect):
+            self.stop()
+            return 1
+        return int(_build_failed(b"".join(output)))
+
+
+def _send(conn):
+    def write(data):
+        if data:
+            conn.sendall(data)
+    return write
+
+
+def serve(args):
+    command = ['scons']
+    if args and args[0].startswith('--scons='):
+        command = shlex.split(args[0][len('--scons='):])
+        args = args[1:]
+    top = os.getcwd()
+    if os.path.exists(_socket_name):
+        if _connect(top) is not None:
+            print("scons_server: a server is already running in %s" % top,
+                  file=sys.stderr)
+            return 1
+        os.unlink(_socket_name)
+    scons = SconsProcess(command + args, top)
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+
+    def echo(data):
+        stdout.write(data)
+        stdout.flush()
+
+    if not scons.start(echo):
+        print("scons_server: scons exited before reaching its prompt",
+              file=sys.stderr)
+        if os.path.exists(scons.inputs):
+            os.unlink(scons.inputs)
+        return 1
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(_socket_name)
+    server.listen(5)
+    print("scons_server: waiting for builds on %s" %
+          os.path.join(top, _socket_name))
+    try:
+        while True:
+            conn = server.accept()[0]
+            try:
+                request = json.loads(conn.makefile('rb').readline().decode())
+                if request.get('command') == 'stop':
+                    conn.sendall(_status + b"0\n")
+                    break
+                targets = _target_paths(request.get('targets', []),
+                                        request.get('cwd', top), top,
+                                        scons.aliases)
+                print("scons_server: build %s" % " ".join(targets))
+                status = scons.build(targets, _send(conn))
+                conn.sendall(_status + str(status).encode() + b"\n")
+            except (IOError, OSError, ValueError) as ex:
+                # The client went away or sent garbage, keep serving.
+                print("scons_server: %s" % ex, file=sys.stderr)
+            finally:
+                conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(_socket_name)
+        scons.stop()
+        if os.path.exists(scons.inputs):
+            os.unlink(scons.inputs)
+    return 0
+
+
+def _connect(top):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Connect through a relative path, since socket paths are limited to
+    # about 100 characters.
+    cwd = os.getcwd()
+    try:
+        os.chdir(top)
+        conn.connect(_socket_name)
+    except (IOError, OSError):
+        conn.close()
+        return None
+    finally:
+        os.chdir(cwd)
+    return conn
+
+
+def request(message):
+    top = _find_socket(os.getcwd())
+    conn = top and _connect(top)
+    if not conn:
+        print("scons_server: no server is running in this directory "
+              "or its parents", file=sys.stderr)
+        return 2
+    conn.sendall(json.dumps(message).encode() + b"\n")
+    stdout = getattr(sys.stdout, 'buffer', sys.stdout)
+    tail = None
+    while True:
+        data = conn.recv(65536)
+        if not data:
+            break
+        if tail is not None:
+            tail += data
+            continue
+        nul = data.find(b"\0")
+        if nul >= 0:
+            tail = data[nul:]
+            data = data[:nul]
+        stdout.write(data)
+        stdout.flush()
+    conn.close()
+    if tail is None or not tail.startswith(_status):
+        print("scons_server: the server did not report a status",
+              file=sys.stderr)
+        return 2
+    return int(tail[len(_status):].strip())
+
+
+def main(argv):
+    if len(argv) < 2 or argv[1] not in ('serve', 'build', 'stop'):
+        print(__doc__, file=sys.stderr)
+        return 2
+    if argv[1] == 'serve':
+        return serve(argv[2:])
+    if argv[1] == 'stop':
+        return request({'command': 'stop'})
+    return request({'command': 'build', 'targets': argv[2:],
+                    'cwd': os.getcwd()})
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test scons_server.py
+
+def test_scons_server(tmpdir):
+    assert not _build_failed(b"scons: `.' is up to date.\n")
+    assert _build_failed(b"gcc -o a.o -c a.c\n"
+                         b"scons: *** [a.o] Error 1\n")
+    top = str(tmpdir)
+    sub = tmpdir.mkdir('src')
+    sconscript = sub.join('SConscript')
+    sconscript.write('')
+    assert _target_paths(['a.o', 'test'], top, top) == ['a.o', 'test']
+    assert _target_paths(['SConscript', 'test', 'lib/a.o', '#b.o'],
+                         str(sub), top, set(['test'])) == \
+        ['src/SConscript', 'test', 'src/lib/a.o', '#b.o']
+    assert _target_paths(['a.o', '../b.o'], str(sub), top) == \
+        ['src/a.o', 'b.o']
+    assert _find_socket(str(sub)) is None
+    tmpdir.join(_socket_name).write('')
+    assert _find_socket(str(sub)) == top
+    missing = str(tmpdir.join('config.py'))
+    watcher = _Watcher([str(sconscript), missing])
+    assert watcher.changed() == []
+    os.utime(str(sconscript), (0, 0))
+    tmpdir.join('config.py').write('')
+    assert watcher.changed() == sorted([str(sconscript), missing])
@@ -66,6 +66,7 @@ from SCons.Node import FS
 from SCons.Node.Python import Value
 from subprocess import *
 import SCons.Warnings
+import eol_scons.profiler
 
 _debug = 0
 
@@ -226,7 +227,8 @@ def _load_svninfo(env, workdir):
         return _svninfomap[workdir]
     pdebug("_load_svninfo(%s): creating svninfo" % (workdir))
     sinfo = SubversionInfo(env, workdir)
-    _svninfomap[workdir] = sinfo.loadInfo()
+    with eol_scons.profiler.Timer('vcs', 'svninfo ' + workdir, env):
+        _svninfomap[workdir] = sinfo.loadInfo()
     return sinfo
 
 
@@ -49,6 +49,35 @@ directory as the target:
 
  scons -c .
 
+Tests can run in parallel with the other targets and with each other
+under the scons -j option.  Each test runs with its own spawner in an
+override of the Environment, so the Environment itself is never modified.
+When more than one job is running, the output of each test, including its
+command lines, is collected and printed as one block when the test
+finishes, so the output of concurrent tests is not interleaved.  The test
+methods take two optional keywords to control how tests run in parallel:
+
+  timeout=<seconds>
+        Kill the test and fail it if it runs longer than this.  The
+        default is the TEST_TIMEOUT construction variable, if set.
+  resources=['postgres', 'xvfb']
+        Name the shared resources the test needs, like a database server
+        or an X display.  Tests which need the same resource never run at
+        the same time, because each resource is a SideEffect() of the
+        tests which need it.
+
+Tests can also be skipped when nothing they depend on has changed.  Pass
+testcache=1 on the command line to enable the test result cache.  Each
+test is keyed by a hash of its command lines, its ENV, and the content
+signatures of all the files it depends on: the test programs, the
+libraries they link against, data files, and so on.  When a test passes,
+its output and its log file are saved under .testcache in the top
+directory.  When a test runs again with the same key, the saved output
+is printed and the log file restored instead of running the test.  Failed
+tests are never cached.  Tests which depend on something scons does not
+know about, like a database server or files read at run time which are
+not sources of the test, should not be run with the cache enabled.
+
 This module defines extra test-related "sub-tools" which seem too small to
 warrant their own module.  The 'gtest' tool adds the gtest library for
 building google-test programs, while the 'gtest_main' tool also links
@@ -65,6 +94,12 @@ import sys
 import os
 import re
 import difflib
+import signal
+import threading
+import json
+import shutil
+import hashlib
+import collections
 
 import SCons
 import SCons.Script
@@ -72,9 +107,23 @@ from SCons.Script import DefaultEnvironment
 from SCons.Action import Action
 from SCons.Action import ListAction
 from SCons.Script import Builder
+from SCons.Script import BoolVariable
+import SCons.Node.FS
+import SCons.Node.Python
 
 _echo_only = False
 
+# Held while the collected output of a test is printed.
+_output_lock = threading.Lock()
+
+# Seconds a test has to exit after a SIGTERM before it is killed.
+_kill_grace = 5
+
+_variables = None
+
+# The _TestCache when testcache is enabled.
+_test_cache = None
+
 _rxpatterns = [ r'^\d+ checks\.',
                 r'^\d+ failures\.',
                 r'^Running \d+ test cases\.\.\.',
@@ -88,20 +137,41 @@ _rxpatterns = [ r'^\d+ checks\.',
 
 
 class _SpawnerLogger(object):
-
-    def __init__(self):
+    """
+    Spawn test commands, writing all of the output to a log file and
+    filtering the output shown on stdout.  Test output can be hundreds of
+    megabytes, so it is read in large chunks, and the raw bytes are written
+    to the log unchanged.  The passing patterns are combined into a single
+    multiline regular expression which searches whole chunks at once, so
+    only the lines which match are split out and decoded for stdout.
+    """
+
+    _chunk_size = 1 << 16
+
+    def __init__(self, timeout=None, collect=False, transcript=False):
         self.logpath = None
         self.logfile = None
         self._rxpass = None
+        self._flines = 0
+        self.timeout = timeout
+        self.timed_out = False
+        # If collecting, the output for stdout is held until close().
+        self._output = [] if collect else None
+        # Everything written for stdout, if kept for the test cache.
+        self.transcript = [] if transcript else None
         self.setPassingPatterns(_rxpatterns)
 
-    def _pass_filter(self, line):
-        if self._rxpass is None:
-            return True
-        for rx in self._rxpass:
-            if rx.search(line):
-                return True
-        return False
+    def _write(self, text):
+        if self.transcript is not None:
+            self.transcript.append(text)
+        if self._output is None:
+            sys.stdout.write(text)
+        else:
+            self._output.append(text)
+
+    def printCommand(self, s, target, source, env):
+        "PRINT_CMD_LINE_FUNC for the test, to keep commands with its output."
+        self._write(s + "\n")
 
     def setPassingPatterns(self, rxpatterns):
         """
@@ -110,74 +180,274 @@ class _SpawnerLogger(object):
         """
         self._rxpass = None
         if rxpatterns:
-            self._rxpass = [ re.compile(rx) for rx in rxpatterns ]
+            rx = "|".join(["(?:%s)" % (rx) for rx in rxpatterns])
+            self._rxpass = re.compile(rx.encode('utf-8'), re.MULTILINE)
 
     def open(self, logpath):
         self.logpath = logpath
-        self.logfile = open(self.logpath, "w")
-        print("Writing test log '%s', filtering stdout and stderr." % 
-              (self.logpath))
+        self.logfile = open(self.logpath, "wb")
+        self._write("Writing test log '%s', filtering stdout and stderr.\n" %
+                    (self.logpath))
 
     def close(self):
         if self.logfile:
-            print("Closing test log '%s'." % (self.logpath))
+            self._write("Closing test log '%s'.\n" % (self.logpath))
             self.logfile.close()
             self.logfile = None
             self.logpath = None
+        if self._output:
+            with _output_lock:
+                sys.stdout.write("".join(self._output))
+                sys.stdout.flush()
+            self._output = []
+
+    def _skip_lines(self, count):
+        "Print a dot for every 50 lines filtered out."
+        dots = (self._flines + count) // 50 - self._flines // 50
+        if dots:
+            self._write('.' * dots)
+        self._flines += count
+
+    def _pass_lines(self, data):
+        if self._flines >= 50:
+            self._write("\n")
+        self._flines = 0
+        self._write(data.decode('utf-8', 'replace'))
+
+    def _filter(self, data):
+        """
+        Pass the lines in data which match the passing patterns to stdout.
+        Data must end at the end of a line, except at the end of the output.
+        """
+        if self._rxpass is None:
+            self._pass_lines(data)
+            return
+        pos = 0
+        for match in self._rxpass.finditer(data):
+            start = data.rfind(b"\n", 0, match.start()) + 1
+            if start < pos:
+                # Another match in a line already passed.
+                continue
+            end = data.find(b"\n", match.end()) + 1 or len(data)
+            self._skip_lines(data.count(b"\n", pos, start))
+            self._pass_lines(data[start:end])
+            pos = end
+        self._skip_lines(data.count(b"\n", pos))
 
     def spawn(self, sh, escape, cmd, args, env):
         cmd = [sh, '-c', ' '.join(args)]
         if _echo_only:
             cmd = [sh, '-c', 'echo "*** Skipping test: %s"' % (" ".join(args))]
+        kw = {}
+        if self.timeout:
+            # Run the test in its own session and process group, so the
+            # whole group can be killed if it times out.  preexec_fn is
+            # not safe with the scons job threads running, so it is only
+            # used where Popen does not have start_new_session.
+            if sys.version_info >= (3, 2):
+                kw['start_new_session'] = True
+            else:
+                kw['preexec_fn'] = os.setsid
         pipe = subprocess.Popen(cmd, env=env,
                                 stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
                                 stderr=subprocess.STDOUT,
-                                bufsize=1, close_fds=True, shell=False)
+                                close_fds=True, shell=False, **kw)
         pipe.stdin.close()
-        output = pipe.stdout.readline().decode()
-        flines = 0
-        while output:
+        timer = None
+        if self.timeout:
+            timer = threading.Timer(self.timeout, self._kill,
+                                    (pipe, signal.SIGTERM))
+            timer.daemon = True
+            timer.start()
+        fd = pipe.stdout.fileno()
+        self._flines = 0
+        pending = b""
+        while True:
+            output = os.read(fd, self._chunk_size)
+            if not output:
+                break
             if self.logfile:
                 self.logfile.write(output)
-            if self._pass_filter(output):
-                if flines >= 50:
-                    sys.stdout.write("\n")
-                sys.stdout.write(output)
-                flines = 0
-            else:
-                flines = flines + 1
-                if flines % 50 == 0:
-                    sys.stdout.write('.')
-            output = pipe.stdout.readline().decode()
+            # Only filter complete lines, and keep the rest for the next
+            # chunk.
+            eol = output.rfind(b"\n")
+            if eol < 0:
+                pending += output
+                continue
+            self._filter(pending + output[:eol+1])
+            pending = output[eol+1:]
+        if pending:
+            self._filter(pending)
+        pipe.stdout.close()
         pipe.wait()
-        if flines >= 50:
-            sys.stdout.write("\n")
+        if timer:
+            timer.cancel()
+        if self._flines >= 50:
+            self._write("\n")
+        if self.timed_out:
+            message = ("*** Test timed out after %s seconds: %s\n" %
+                       (self.timeout, " ".join(args)))
+            if self.logfile:
+                self.logfile.write(message.encode('utf-8'))
+            self._write(message)
+            # The exit status used by the timeout command.
+            return 124
         return pipe.returncode
 
+    def _kill(self, pipe, sig):
+        if pipe.poll() is not None:
+            return
+        self.timed_out = True
+        try:
+            os.killpg(pipe.pid, sig)
+        except OSError:
+            return
+        if sig != signal.SIGKILL:
+            timer = threading.Timer(_kill_grace, self._kill,
+                                    (pipe, signal.SIGKILL))
+            timer.daemon = True
+            timer.start()
+
+
+def _dependencies(target):
+    """
+    Return the file and value nodes which the target depends upon,
+    recursively: its sources, explicit dependencies from Depends(), and
+    implicit dependencies, including those which are ignored for deciding
+    whether to rebuild, since they can still change the test result.
+    """
+    nodes = target.all_children()
+    visited = set(nodes)
+    visited.add(target)
+    pending = collections.deque(nodes)
+    result = []
+    while pending:
+        node = pending.popleft()
+        if isinstance(node, SCons.Node.Python.Value) or \
+           isinstance(node, SCons.Node.FS.Base) and \
+           not isinstance(node, SCons.Node.FS.Dir):
+            result.append(node)
+        for child in node.all_children():
+            if child not in visited:
+                visited.add(child)
+                pending.append(child)
+    return result
+
+
+class _TestCache(object):
+    """
+    Keep the stdout output and the log file of tests which passed, keyed by
+    a hash of everything the test depends on.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def key(self, action, target, source, env):
+        md5 = hashlib.md5()
+
+        def add(text):
+            if not isinstance(text, (bytes, bytearray)):
+                text = text.encode('utf-8')
+            md5.update(bytes(text) + b"\n")
+
+        add(str(target[0]))
+        add(action.get_contents(target, source, env))
+        penv = env['ENV']
+        for name in sorted(penv):
+            add("%s=%s" % (name, penv[name]))
+        for node in _dependencies(target[0]):
+            add("%s %s" % (node, node.get_csig()))
+        return md5.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def lookup(self, key):
+        try:
+            with open(self._entry_path(key), "r") as fp:
+                return json.load(fp)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def store(self, key, target, output, logpath):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        entry = {'target': target, 'output': output, 'log': None}
+        if logpath and os.path.exists(logpath):
+            entry['log'] = key + ".log"
+            shutil.copyfile(logpath, os.path.join(self.path, entry['log']))
+        tmp = self._entry_path(key) + ".tmp"
+        with open(tmp, "w") as fp:
+            json.dump(entry, fp)
+        os.rename(tmp, self._entry_path(key))
+
+    def remove(self, key):
+        for path in [self._entry_path(key),
+                     os.path.join(self.path, key + ".log")]:
+            if os.path.exists(path):
+                os.unlink(path)
+
+    def replay(self, entry, logpath):
+        "Restore the log file and print the output of a cached test."
+        if logpath and entry['log']:
+            shutil.copyfile(os.path.join(self.path, entry['log']), logpath)
+        with _output_lock:
+            sys.stdout.write("Test %s passed before with the same inputs, "
+                             "replaying its output:\n" % (entry['target']))
+            sys.stdout.write(entry['output'])
+            sys.stdout.flush()
+
 
 class LogAction(ListAction):
 
-    def __init__(self, actionlist, logpath=None, patterns=_rxpatterns):
+    def __init__(self, actionlist, logpath=None, patterns=_rxpatterns,
+                 timeout=None):
         ListAction.__init__(self, actionlist)
         self.logpath = logpath
         self.patterns = patterns
+        self.timeout = timeout
         # Disable filtering when log file is disabled.
         if not logpath:
             self.patterns = None
 
-    def __call__(self, target, source, env, **kw):
-        # Replace the SPAWN variable with our own instance of _SpawnerLogger.
-        spawner = _SpawnerLogger()
+    def __call__(self, target, source, env, *args, **kw):
+        # Run the actions in an override of the Environment which uses our
+        # own instance of _SpawnerLogger, so concurrent tests sharing the
+        # Environment do not replace each other's spawner.  With multiple
+        # jobs, collect the output to print it all at once.
+        cache = _test_cache
+        executor = kw.get('executor')
+        if cache and executor:
+            # Newer scons passes the targets and sources in the executor.
+            target = executor.get_all_targets()
+            source = executor.get_all_sources()
+        if cache and target:
+            key = cache.key(self, target, source, env)
+            entry = cache.lookup(key)
+            if entry is not None:
+                cache.replay(entry, self.logpath)
+                return 0
+        collect = (env.GetOption('num_jobs') or 1) > 1
+        spawner = _SpawnerLogger(self.timeout, collect, bool(cache))
         if self.logpath:
             spawner.open(self.logpath)
         spawner.setPassingPatterns(self.patterns)
-        spawnsave = env['SPAWN']
-        env['SPAWN'] = spawner.spawn
+        overrides = {'SPAWN': spawner.spawn}
+        if collect:
+            overrides['PRINT_CMD_LINE_FUNC'] = spawner.printCommand
         try:
-            status = ListAction.__call__(self, target, source, env, **kw)
+            status = ListAction.__call__(self, target, source,
+                                         env.Override(overrides),
+                                         *args, **kw)
         finally:
             spawner.close()
-            env['SPAWN'] = spawnsave
+        if cache and target:
+            if status:
+                cache.remove(key)
+            else:
+                cache.store(key, str(target[0]), "".join(spawner.transcript),
+                            self.logpath)
         return status
 
 
@@ -185,10 +455,13 @@ def _create_log_action(env, *args, **kw):
     return LogAction(*args, **kw)
 
 
-def _test_builder(env, alias, sources, actions, logfile=None):
+def _test_builder(env, alias, sources, actions, logfile=None,
+                  timeout=None, resources=None):
     if not alias:
         alias = 'xtest'
     targets = [ env.File(alias) ]
+    if timeout is None:
+        timeout = env.get('TEST_TIMEOUT')
 
     # Use the Action() factory to create the action instance, which may
     # itself be a ListAction, then wrap the action/s in a LogAction
@@ -196,10 +469,15 @@ def _test_builder(env, alias, sources, actions, logfile=None):
     # patterns either.
     if logfile:
         targets.append(logfile)
-    logaction = LogAction([Action(actions)], logfile)
+    logaction = LogAction([Action(actions)], logfile, timeout=timeout)
 
     xtest = env.Command(targets, sources, logaction)
 
+    # Tests which share a resource are serialized by giving them all the
+    # same side effect, which scons never builds concurrently.
+    for resource in resources or []:
+        env.SideEffect('#/.scons_test_resource_' + resource, xtest)
+
     # The test should always run when given as a target, even if the log
     # file already exists.  This may also be required for the virtual file
     # target, since it is required when using an Alias() builder.
@@ -238,17 +516,19 @@ def _test_builder(env, alias, sources, actions, logfile=None):
     return xtest
 
 
-def _TestLog(env, alias, sources, actions):
+def _TestLog(env, alias, sources, actions, timeout=None, resources=None):
     "Wrap a pseudo-builder test with an output filter."
     if not alias:
         alias = 'xtest'
     logfile = env.File(alias + '.log').get_abspath()
-    return _test_builder(env, alias, sources, actions, logfile)
+    return _test_builder(env, alias, sources, actions, logfile,
+                         timeout, resources)
 
 
-def _TestRun(env, alias, sources, actions):
+def _TestRun(env, alias, sources, actions, timeout=None, resources=None):
     "Run a test without piping the output into a log file."
-    return _test_builder(env, alias, sources, actions)
+    return _test_builder(env, alias, sources, actions, None,
+                         timeout, resources)
 
 
 def _DefaultTest(env, xtest):
@@ -304,6 +584,17 @@ diff_builder = Builder(action=[diff_files], emitter=diff_emitter)
 
 
 def generate(env):
+    global _variables, _test_cache
+    if _variables is None:
+        _variables = env.GlobalVariables()
+        _variables.AddVariables(BoolVariable(
+            'testcache',
+            'Skip tests which passed before with the same inputs, '
+            'replaying their output from the .testcache directory.',
+            False))
+    _variables.Update(env)
+    if env['testcache'] and _test_cache is None:
+        _test_cache = _TestCache(env.Dir('#/.testcache').get_abspath())
     env.Append(BUILDERS = {'Diff':diff_builder})
     env.AddMethod(_TestLog, "TestLog")
     env.AddMethod(_TestRun, "TestRun")
@@ -324,3 +615,87 @@ def gtest_main(env):
 
 SCons.Script.Export('gtest')
 SCons.Script.Export('gtest_main')
+
+
+# To run the tests with py.test:
+#
+# env PYTHONPATH=/usr/lib/scons py.test testing.py
+
+def test_spawner_logger(tmpdir, capsys):
+    script = tmpdir.join('test.sh')
+    script.write('echo "Running 3 test cases..."\n'
+                 'i=0; while [ $i -lt 120 ]; do echo "debug $i"; '
+                 'i=$((i+1)); done\n'
+                 'echo "*** No errors detected"\n'
+                 'printf "\\377 not utf-8\\n"\n'
+                 'printf "Leaving test case x"\n')
+    spawner = _SpawnerLogger()
+    spawner._chunk_size = 100
+    spawner.open(str(tmpdir.join('test.log')))
+    status = spawner.spawn('sh', None, None, ['sh', str(script)],
+                           dict(os.environ))
+    spawner.close()
+    assert status == 0
+    log = tmpdir.join('test.log').read_binary()
+    assert log.count(b"\n") == 123
+    assert b"\xff not utf-8\n" in log
+    out = capsys.readouterr().out.splitlines()
+    assert out[1:4] == ["Running 3 test cases...", "..",
+                        "*** No errors detected"]
+    # The last line has no newline, so the close message follows it.
+    assert out[4].startswith("Leaving test case xClosing test log")
+    spawner.setPassingPatterns(None)
+    spawner.spawn('sh', None, None, ['printf', "'a\\nb'"],
+                  dict(os.environ))
+    assert capsys.readouterr().out == "a\nb"
+
+
+def test_spawner_timeout(tmpdir, capsys):
+    spawner = _SpawnerLogger(timeout=0.5, collect=True)
+    spawner.open(str(tmpdir.join('test.log')))
+    spawner.printCommand("sleep 10", [], [], None)
+    status = spawner.spawn('sh', None, None,
+                           ['echo', 'started;', 'sleep', '10'],
+                           dict(os.environ))
+    assert status == 124
+    # Nothing is printed until the spawner is closed.
+    assert capsys.readouterr().out == ""
+    spawner.close()
+    out = capsys.readouterr().out.splitlines()
+    assert out[1] == "sleep 10"
+    assert out[2].startswith("*** Test timed out after 0.5 seconds")
+    assert b"timed out" in tmpdir.join('test.log').read_binary()
+
+
+def test_test_cache(tmpdir, capsys):
+    cache = _TestCache(str(tmpdir.join('cache')))
+    assert cache.lookup('abc') is None
+    log = tmpdir.join('xtest.log')
+    log.write_binary(b"all the output\n\xff\n")
+    cache.store('abc', 'xtest', "Running 1 test cases...\n", str(log))
+    log.remove()
+    entry = cache.lookup('abc')
+    assert entry['log'] == 'abc.log'
+    cache.replay(entry, str(log))
+    assert log.read_binary() == b"all the output\n\xff\n"
+    out = capsys.readouterr().out
+    assert out.endswith("replaying its output:\nRunning 1 test cases...\n")
+    cache.remove('abc')
+    assert cache.lookup('abc') is None
+    assert not tmpdir.join('cache', 'abc.log').exists()
+
+
+def test_test_cache_depends(tmpdir):
+    env = SCons.Environment.Environment(tools=[])
+    data = tmpdir.join('data.txt')
+    data.write("1\n")
+    action = LogAction([Action('run.sh')])
+    target = env.Command(str(tmpdir.join('xtest')), [], action)
+    env.Depends(target, str(data))
+    cache = _TestCache(str(tmpdir.join('cache')))
+    key = cache.key(action, target, [], env)
+    assert cache.key(action, target, [], env) == key
+    data.write("2\n")
+    # Forget the content signature computed from the old contents.
+    env.File(str(data)).clear()
+    assert cache.key(action, target, [], env) != key
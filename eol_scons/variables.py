@@ -25,6 +25,10 @@ from SCons.Script import DefaultEnvironment
 from SCons.Script import BoolVariable
 
 import eol_scons.debug
+import eol_scons.parseconfig
+import eol_scons.toolindex
+import eol_scons.profiler
+import eol_scons.snapshot
 
 _global_variables = None
 _cache_variables = None
@@ -46,6 +50,35 @@ def GlobalVariables(cfile=None, env=None):
             BoolVariable('eolsconscache',
                          'Enable tools.cache optimization.',
                          _enable_cache))
+        _global_variables.AddVariables(
+            BoolVariable('eolsconsconfigcache',
+                         'Cache config script results across builds '
+                         'in config_scripts.cache.',
+                         False))
+        _global_variables.AddVariables(
+            BoolVariable('eolsconstoolindex',
+                         'Index tool_*.py files in tools.index and only '
+                         'search directories which changed.',
+                         True))
+        _global_variables.AddVariables(
+            BoolVariable('eolsconsapplyonce',
+                         'Apply each tool only once to each Environment.',
+                         False))
+        _global_variables.AddVariables(
+            BoolVariable('eolsconssnapshot',
+                         'Restore the variables set by tools from '
+                         'env_snapshots.cache instead of applying them.',
+                         False))
+        _global_variables.AddVariables(
+            BoolVariable('eolsconsprofile',
+                         'Report the time spent loading tools and running '
+                         'config queries, in eolsconsprofile.json.',
+                         eol_scons.profiler.ProfileEnabled()))
+        _global_variables.AddVariables(
+            BoolVariable('eolsconspkgconfig',
+                         'Resolve pkg-config queries by reading .pc files '
+                         'instead of running pkg-config.',
+                         False))
         print("Config files: %s" % (_global_variables.files))
     return _global_variables
 
@@ -289,3 +322,17 @@ def _update_variables(env):
     if 'eolsconscache' in env:
         global _enable_cache
         _enable_cache = env['eolsconscache']
+    if 'eolsconsconfigcache' in env:
+        eol_scons.parseconfig.EnableConfigCache(env['eolsconsconfigcache'])
+    if 'eolsconstoolindex' in env:
+        eol_scons.toolindex.EnableToolIndex(env['eolsconstoolindex'])
+    if 'eolsconsapplyonce' in env:
+        # Imported here since eol_scons.tool imports this module.
+        import eol_scons.tool as estool
+        estool.EnableApplyOnce(env['eolsconsapplyonce'])
+    if 'eolsconssnapshot' in env:
+        eol_scons.snapshot.EnableSnapshots(env['eolsconssnapshot'])
+    if 'eolsconsprofile' in env:
+        eol_scons.profiler.EnableProfile(env['eolsconsprofile'])
+    if 'eolsconspkgconfig' in env:
+        eol_scons.parseconfig.EnablePkgConfigResolver(env['eolsconspkgconfig'])